@@ -2,6 +2,7 @@
 import os
 import logging
 import json
+import uuid
 import zipfile
 from datetime import datetime
 from dotenv import load_dotenv
@@ -27,12 +28,13 @@ class ExtractTextInfoFromPDF:
         pdf_services (PDFServices): An instance of the PDFServices class.
     """
 
-    def __init__(self, input_pdf_path):
+    def __init__(self, input_pdf_path, input_stream=None):
         """
         Initializes the ExtractTextInfoFromPDF class with the path to the PDF file.
 
         Args:
-            input_pdf_path (str): The path to the input PDF file.
+            input_pdf_path (str): The path to the input PDF file; only its name is used when the content is given.
+            input_stream (bytes, optional): The content of the PDF file. Defaults to reading the file.
         """
         # Load environment variables
         load_dotenv()
@@ -43,8 +45,9 @@ class ExtractTextInfoFromPDF:
         )
         # Initialize PDFServices with the credentials
         self.pdf_services = PDFServices(credentials=self.credentials)
-        # Store the input PDF path
+        # Store the input PDF path and content
         self.input_pdf_path = input_pdf_path
+        self.input_stream = input_stream
 
     def extract_text(self):
         """
@@ -59,9 +62,11 @@ class ExtractTextInfoFromPDF:
             SdkException: If there is an SDK error.
         """
         try:
-            # Open the PDF file and read its content
-            with open(self.input_pdf_path, 'rb') as file:
-                input_stream = file.read()
+            # Open the PDF file and read its content, unless it is already in memory
+            input_stream = self.input_stream
+            if input_stream is None:
+                with open(self.input_pdf_path, 'rb') as file:
+                    input_stream = file.read()
 
             # Upload the PDF file to Adobe PDF Services
             input_asset = self.pdf_services.upload(input_stream=input_stream, mime_type=PDFServicesMediaType.PDF)
@@ -95,7 +100,9 @@ class ExtractTextInfoFromPDF:
     @staticmethod
     def create_output_file_path():
         """
-        Creates a unique file path for the output file based on the current timestamp.
+        Creates a unique file path for the output file from the current timestamp and a random suffix.
+
+        Extractions run concurrently, so the timestamp alone would let two of them share a file.
 
         Returns:
             str: The path to the output file.
@@ -105,7 +112,7 @@ class ExtractTextInfoFromPDF:
         # Ensure the output directory exists
         os.makedirs("output/ExtractTextInfoFromPDF", exist_ok=True)
         # Return the complete path for the output file
-        return f"output/ExtractTextInfoFromPDF/extract{timestamp}.zip"
+        return f"output/ExtractTextInfoFromPDF/extract{timestamp}_{uuid.uuid4().hex}.zip"
 
     def process_output(self, output_file_path):
         """
@@ -190,15 +197,16 @@ class ExtractTextInfoFromPDF:
             return None
 
     @staticmethod
-    def get_section_headings(data):
+    def get_section_headings(data, max_level=1):
         """
         Extracts section headings from the document data.
 
         Args:
             data (dict): The JSON data containing document elements.
+            max_level (int): The deepest heading level to include, e.g. 1 for H1 only or 6 for H1 to H6.
 
         Returns:
-            list: A list of dictionaries containing path and text of section headings.
+            list: A list of dictionaries containing path, text and level of section headings.
         """
         # Initialize a list to store section headings
         section_headings = []
@@ -206,8 +214,8 @@ class ExtractTextInfoFromPDF:
         # Iterate over elements to find section headings
         for element in data.get("elements", []):
             path = element.get("Path", "").replace("//Document/", "")
-            if path[0:2] == "H1": #and path[1].isdigit():
-                section_headings.append({"path": path, "text": element.get("Text", "No Text")})
+            if path[0:1] == "H" and path[1:2].isdigit() and int(path[1]) <= max_level:
+                section_headings.append({"path": path, "text": element.get("Text", "No Text"), "level": int(path[1])})
                 i += 1
 
         return section_headings
@@ -1,14 +1,22 @@
 # Import necessary modules and classes
+import logging
 from adobe_PDF_extract_API import ExtractTextInfoFromPDF
 import os
 import re
 import pandas as pd
 import json
 from pymongo.mongo_client import MongoClient
-import requests
-from text_comparison_openAI_api import compare_strings
+from heading_locator import HeadingLocator
+from section_alignment import get_hierarchical_section_texts, build_heading_tree, align_heading_trees
+from local_diff import compute_diff_stats
+from comparison_results import build_comparison_document, build_identical_comparison_document, render_comparison_results, create_difference_indexes
+from async_comparison import compare_sections_concurrently, DEFAULT_MAX_CONCURRENCY
+from llm_gateway import get_gateway, measure_usage
+from tracing import trace_run, trace_span, estimate_cost, RUNS_COLLECTION_NAME
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 # Load environment variables from .env file
 uri = os.getenv('uri')
@@ -49,9 +57,9 @@ def upload_json_file_to_mongodb(file_path, db_collection):
     if filename.lower().endswith('.json'):
         # Check if the file is already in the database
         if db_collection.count_documents({'file_name': os.path.splitext(filename)[0]}) > 0:
-            print(f"{filename} is already in the database")
+            logger.info(f"{filename} is already in the database")
             return
-        print(f"Uploading {filename} to MongoDB")
+        logger.info(f"Uploading {filename} to MongoDB")
         with open(file_path, 'r', encoding='utf-8') as file:
             json_data = json.load(file)
             db_collection.insert_one({
@@ -61,9 +69,9 @@ def upload_json_file_to_mongodb(file_path, db_collection):
                 'elements': json_data.get('elements'),
                 'pages': json_data.get('pages')
             })
-        print(f"Uploaded {filename} to MongoDB")
+        logger.info(f"Uploaded {filename} to MongoDB")
     else:
-        print(f"{filename} is not a JSON file")
+        logger.error(f"{filename} is not a JSON file")
 
 
 # Function to recursively upload JSON files from a directory to MongoDB
@@ -105,9 +113,9 @@ def upload_json_files_to_mongodb(folder_path, db_collection):
             if filename.lower().endswith('.json'):
                 # Check if the file is already in the database
                 if db_collection.count_documents({'file_name': os.path.splitext(filename)[0]}) > 0:
-                    print(f"{filename} is already in the database")
+                    logger.info(f"{filename} is already in the database")
                     continue
-                print(f"Uploading {filename} to MongoDB")
+                logger.info(f"Uploading {filename} to MongoDB")
                 file_path = os.path.join(foldername, filename)
                 with open(file_path, 'r', encoding='utf-8') as file:
                     json_data = json.load(file)
@@ -118,7 +126,7 @@ def upload_json_files_to_mongodb(folder_path, db_collection):
                         'elements': json_data.get('elements'),
                         'pages': json_data.get('pages')
                     })
-                print(f"Uploaded {filename} to MongoDB")
+                logger.info(f"Uploaded {filename} to MongoDB")
 
 
 # Function to generate the path for a JSON file corresponding to a PDF
@@ -185,11 +193,11 @@ def find_all_pdfs(root_folder):
     """
     pdf_files = {}  # Dictionary to store the file name and path
     for foldername, subfolders, filenames in os.walk(root_folder):
-        print(f"Checking folder: {foldername}")  # Debug: See which folder is being checked
+        logger.debug(f"Checking folder: {foldername}")  # Debug: See which folder is being checked
         for filename in filenames:
             if filename.lower().endswith('.pdf'):  # Check if the file is a PDF
                 full_path = os.path.join(foldername, filename)
-                print(f"Found PDF: {filename} in {full_path}")  # Debug: Report found PDFs
+                logger.debug(f"Found PDF: {filename} in {full_path}")  # Debug: Report found PDFs
                 pdf_files[filename] = full_path  # Store the file name and its full path
     return pdf_files
 
@@ -213,22 +221,22 @@ def get_json_for_all_pdfs(pdf_files):
         4. Prints the document structure.
     """
     for pdf_name, pdf_path in pdf_files.items():
-        print(f"Processing PDF: {pdf_name}")
+        logger.info(f"Processing PDF: {pdf_name}")
         json_file_path = get_json_path(pdf_path)
         if os.path.exists(json_file_path):
-            print(f"JSON file already exists at: {json_file_path}")
+            logger.info(f"JSON file already exists at: {json_file_path}")
         else:
             # Create an instance of the ExtractTextInfoFromPDF class
             extractor = ExtractTextInfoFromPDF(pdf_path)
             # Extract the text
             json_file_path = extractor.extract_text()
-            print(f"JSON file created at: {json_file_path}")
+            logger.info(f"JSON file created at: {json_file_path}")
 
         if json_file_path:
             document_structure = ExtractTextInfoFromPDF.get_document_structure(json_file_path)
             print_document_structure(document_structure)
         
-        print("--------------------------------------------\n\n")
+        logger.debug("--------------------------------------------\n\n")
 
 
 # Function to retrieve Adobe API outputs for given file paths
@@ -243,12 +251,12 @@ def get_adobe_api_outputs(new_file_path, old_file_path, db_collection):
         extractor = ExtractTextInfoFromPDF(new_file_path)
         # Extract the text
         new_file_path_json = extractor.extract_text()
-        print(f"JSON file created at: {new_file_path_json}")
+        logger.info(f"JSON file created at: {new_file_path_json}")
         # Upload JSON files to MongoDB
         upload_json_file_to_mongodb(new_file_path_json, db_collection)
         new_file_json = db_collection.find_one({'file_name': os.path.splitext(new_file_name)[0]})
     else:
-        print(f"{new_file_name} is already in the database")
+        logger.info(f"{new_file_name} is already in the database")
         # Get the JSON file from MongoDB
         new_file_json = db_collection.find_one({'file_name': os.path.splitext(new_file_name)[0]})
 
@@ -258,12 +266,12 @@ def get_adobe_api_outputs(new_file_path, old_file_path, db_collection):
         extractor = ExtractTextInfoFromPDF(old_file_path)
         # Extract the text
         old_file_path_json = extractor.extract_text()
-        print(f"JSON file created at: {old_file_path_json}")
+        logger.info(f"JSON file created at: {old_file_path_json}")
         # Upload JSON files to MongoDB
         upload_json_file_to_mongodb(old_file_path_json, db_collection)
         old_file_json = db_collection.find_one({'file_name': os.path.splitext(old_file_name)[0]})
     else:
-        print(f"{old_file_name} is already in the database")
+        logger.info(f"{old_file_name} is already in the database")
         # Get the JSON file from MongoDB
         old_file_json = db_collection.find_one({'file_name': os.path.splitext(old_file_name)[0]})
 
@@ -343,20 +351,12 @@ def get_cleaned_text_from_mongodb(file_name, db_collection):
         str: The cleaned text of the document.
     """
     data = db_collection.find_one({'file_name': file_name})
-    cleaned_text = data.get('cleaned_text')
-
-    """table_of_contents_list = get_table_of_contents(new_file_adobe_json)
-    for element in table_of_contents_list:
-        if element in cleaned_text:
-            cleaned_text = cleaned_text.replace(element, "")
-        #else:
-            #print(f"Table of contents entry not found in clean text: {element}")"""
-    return cleaned_text
+    return data.get('cleaned_text')
 
 
 # Function to extract section texts from cleaned document text
 # Uses headings to identify sections
-def extract_section_texts(heading_curr_new, heading_next_new, heading_curr_old, heading_next_old, cleaned_text_new, cleaned_text_old, end_index_new, end_index_old):
+def extract_section_texts(heading_curr_new, heading_next_new, heading_curr_old, heading_next_old, cleaned_text_new, cleaned_text_old, end_index_new, end_index_old, locator_new=None, locator_old=None):
     """
     Extract section texts from cleaned document text using headings.
     
@@ -369,28 +369,34 @@ def extract_section_texts(heading_curr_new, heading_next_new, heading_curr_old,
         cleaned_text_old (str): Cleaned text of the old file.
         end_index_new (int): End index of the current heading in the new file.
         end_index_old (int): End index of the current heading in the old file.
+        locator_new (HeadingLocator, optional): Pre-scanned heading positions for the new file. Defaults to None.
+        locator_old (HeadingLocator, optional): Pre-scanned heading positions for the old file. Defaults to None.
     
     Returns:
         tuple: Section texts for the new and old files, and their end indices.
     """
+    # Look headings up in the pre-scanned positions when available instead of searching the text again
+    find_new = locator_new.find if locator_new else cleaned_text_new.find
+    find_old = locator_old.find if locator_old else cleaned_text_old.find
+
     if heading_next_new != None:
         if heading_curr_new == None and heading_curr_old == None:
             heading_curr_index_new = 0
             heading_curr_index_old = 0
         else:
-            heading_curr_index_new = cleaned_text_new.find(heading_curr_new, end_index_new)
-            heading_curr_index_old = cleaned_text_old.find(heading_curr_old, end_index_old)
+            heading_curr_index_new = find_new(heading_curr_new, end_index_new)
+            heading_curr_index_old = find_old(heading_curr_old, end_index_old)
         
-        heading_next_index_new = cleaned_text_new.find(heading_next_new, end_index_new + 1)
+        heading_next_index_new = find_new(heading_next_new, end_index_new + 1)
         section_text_new = cleaned_text_new[heading_curr_index_new:heading_next_index_new]
-        heading_next_index_old = cleaned_text_old.find(heading_next_old, end_index_old + 1)
+        heading_next_index_old = find_old(heading_next_old, end_index_old + 1)
         section_text_old = cleaned_text_old[heading_curr_index_old:heading_next_index_old]
         return section_text_new, section_text_old, heading_next_index_new, heading_next_index_old
     else:
         #print(f"Next_heading_new {heading_next_new} is None")
-        heading_curr_index_new = cleaned_text_new.find(heading_curr_new, end_index_new)
+        heading_curr_index_new = find_new(heading_curr_new, end_index_new)
         section_text_new = cleaned_text_new[heading_curr_index_new:]
-        heading_curr_index_old = cleaned_text_old.find(heading_curr_old, end_index_old)
+        heading_curr_index_old = find_old(heading_curr_old, end_index_old)
         section_text_old = cleaned_text_old[heading_curr_index_old:]
         return section_text_new, section_text_old, len(cleaned_text_new), len(cleaned_text_old)
 
@@ -419,6 +425,10 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
 
     count = 0
 
+    # Scan each document once for all of its headings
+    locator_new = HeadingLocator(cleaned_text_new, [heading["text"] for heading in new_file_section_headings_list_with_path])
+    locator_old = HeadingLocator(cleaned_text_old, [heading["text"] for heading in old_file_section_headings_list_with_path])
+
     while new_file_section_headings_list[current_heading_index_new] not in old_file_section_headings_list:
         current_heading_index_new += 1
         if current_heading_index_new >= len(new_file_section_headings_list):
@@ -435,7 +445,9 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
                 cleaned_text_new,
                 cleaned_text_old,
                 end_index_new,
-                end_index_old)
+                end_index_old,
+                locator_new,
+                locator_old)
     list_of_section_texts.append(["Initial content", section_text_new, section_text_old, new_file_section_headings_list[current_heading_index_new]])
 
     while current_heading_index_new < len(new_file_section_headings_list) and next_heading_index_new < len(new_file_section_headings_list):
@@ -462,7 +474,9 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
                 cleaned_text_new,
                 cleaned_text_old,
                 end_index_new,
-                end_index_old)
+                end_index_old,
+                locator_new,
+                locator_old)
             list_of_section_texts.append([new_file_section_headings_list[current_heading_index_new], section_text_new, section_text_old, new_file_section_headings_list[next_heading_index_new]])
             current_heading_index_new = next_heading_index_new
             next_heading_index_new += 1
@@ -482,12 +496,14 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
                 cleaned_text_new,
                 cleaned_text_old,
                 end_index_new,
-                end_index_old)
+                end_index_old,
+                locator_new,
+                locator_old)
             list_of_section_texts.append([new_file_section_headings_list[current_heading_index_new], section_text_new, section_text_old, "Last section: No section after this."])
             count += 1
 
-    print(f"Total matching headings: {count}, Total headings in new file: {len(new_file_section_headings_list)}")
-    print(f"Total section heading pairs: {len(list_of_section_texts)}")
+    logger.info(f"Total matching headings: {count}, Total headings in new file: {len(new_file_section_headings_list)}")
+    logger.info(f"Total section heading pairs: {len(list_of_section_texts)}")
 
     return list_of_section_texts
 
@@ -523,244 +539,125 @@ def reconstruct_document_exclude_toc(json_file_path):
     return combined_text
 
 
-sample_response = """
-| Section   | Change                                                                                         |
-|-----------|------------------------------------------------------------------------------------------------|
-| 10/01/16  | New release. Timing for new requirements presented below.                                      |
-| 03/31/17  | Certification requirement for Accessory parts identified by Mopar as safety or installed at Mopar Custom Shops. |
-| 04/12/18  |                                                                                                 |
-| Table Of Contents | Updated: "SUMMARY OF IATF 16949 SECTIONS WITH CUSTOMER-SPECIFIC CONTENT" simplified.   |
-| 1.1       | Added note referencing CSR for FCA Italy SpA                                                   |
-| 1.2       | - Implementation timing note (3/31/17 due date) in Table 1 for MOPAR certification upgrade removed |
-|           | - Moved Bulk Metallic Commodity Exemptions tables to Appendix A                                |
-| 2.A       | - Reference to CQI-16: ISO/TS 16949:2009 Guidance Manual removed                               |
-|           | - References to the following documents added:                                                 |
-|           | -- CQI-27: Special Process: Casting System Assessment                                          |
-|           | -- IATF 16949:2016 Sanctioned Interpretations                                                  |
-|           | -- QR.00001 Global Product Assurance Testing                                                   |
-|           | -- SQ.00001 Additional Quality Requirements (AQR)                                              |
-|           | -- SQ.00007 Master Process Failure Mode and Effects Analysis (MPFMEA)                          |
-|           | -- SQ.00008 Product Demonstration Run (PDR)                                                    |
-|           | -- SQ.00010 Advanced Quality Planning (AQP) and Product Part Approval Process (PPAP)           |
-|           | -- SQ.00012 Forever Requirements                                                               |
-|           | -- SQN-A0469 Supplier Incident Management – NATFA                                              |
-|           | -- SQN-A0489 Third Party Containment and Problem Resolution                                    |
-|           | -- SQN-A0490 Launch Risk Mitigation                                                            |
-| 2.B       | Reference to IATF 16949 Sanctioned Interpretations added                                       |
-| 3.1       | - Revised definitions for:                                                                     |
-|           | -- Consigned Part                                                                              |
-|           | -- Directed Part                                                                               |
-|           | -- External Balanced Scorecard (now Global External Balanced Scorecard)                        |
-|           | -- Process Audit                                                                               |
-|           | - Added definitions for:                                                                       |
-|           | -- Additional Quality Requirements (AQR)                                                       |
-|           | -- Advance Quality Planning (AQP)                                                              |
-|           | -- Launch Risk Mitigation (LRM)                                                                |
-|           | -- Master Process Failure Mode and Effects Analysis (MPFMEA)                                   |
-| 3.2       | - No changes found in this section between the two versions of the document.                   |
-| 4.1       | - No changes found in this section between the two versions of the document.                   |
-| 4.2       | - No changes found in this section between the two versions of the document.                   |
-| 4.3       | - No changes found in this section between the two versions of the document.                   |
-| 4.4       | - This section is newly added in this version of the document.                                 |
-| 5.3.1     | Requirement for SIC maintenance added (existing requirement; 30 days grace granted to ensure implementation) |
-| 6         | - No changes found in this section between the two versions of the document.                   |
-| 7.2.2     | - Requirement for CQR (Common Quality Reporting) removed (note – access to application is restricted to FCA US personnel) |
-|           | - GEBCS substituted for EBSC; beStandard and SIC (5.3.1) added                                 |
-| 7.5.3.2.1 | Clarified scope of "organization-controlled documents"                                         |
-| 8.3.2.1   | Product development process requirement revised (PPR/PA removed, AQP/PPAP added). (As noted, change required with start of next product development program – 30 days grace granted for organization acquisition and review of process document). |
-| 8.2.3.1   | References to AQR and MPFMEA added (existing requirements relocated to new standard – 30 days grace granted for organization acquisition and review of process document). |
-| 8.3.3.2   | References to AQR and MPFMEA added (existing requirements relocated to new standard – 30 days grace granted for organization acquisition and review of process document). |
-| 8.4.2.3   | Added "risk-based thinking" as a criterion for establishing extent and timing of supplier QMS development |
-| 8.4.2.4.1 | Clarified requirement for supplier self-certification process                                  |
-| 8.5.6.1   | Existing requirements relocated to new standard. (30 days grace granted for organization acquisition and review) |
-| 8.6.2     | Clarified scope of layout inspection requirements                                              |
-| 8.7.1.1   | Documenting existing requirement (PPA Manual, section 5c; PPAP Tool 3.5)                       |
-| 8.7.1.2   | Existing requirements for control of nonconforming material relocated to new standard. (30 days grace granted for organization acquisition and review of process document). |
-| 8.7.1.3   | Documented existing requirement                                                                |
-| 8.7.1.4   | Documenting existing requirement (PPA Manual, section 5c; PPAP Tool 3.5)                       |
-| 9.1.2     | Updated to support release of Global External Balanced Scorecard                               |
-| 9.1.2.1   | Revised "OEM performance complaint" and "Quality New Business Hold" to more closely align with the Rules and current practice. |
-| 9.2.2.3   | Self-assessment submission requirements for CQI-9 added under "Special Process Assessments – Additional Considerations" (note – this is a current requirement) |
-| 9.2.2.4   | Existing requirements relocated to new standard. (30 days grace granted for organization acquisition and review of process document). |
-| 9.3.3.1   | Simplified Automotive Warranty Management requirement                                          |
-| Appendix A| New (requirements moved from 1.2)                                                              |
-| Appendix B| New note – added in support revision of 9.2.2.3                                                |
-
-"""
-
-
-sample_response_edge_cases = """
-| Section   | Change                                                                                         |
-|-----------|------------------------------------------------------------------------------------------------|
-| 1         | - No changes                                                                                   |
-| 2         | - No changes                                                                                   |
-| 3.1       | - No changes                                                                                   |
-| 3.2       | - Newly added section                                                                          |
-| 4.1       | - No changes                                                                                   |
-| 4.2       | - Newly added section                                                                          |
-| 4.3       | - No changes                                                                                   |
-| 4.4       | - Newly added section                                                                          |
-| 5.1       | - No changes                                                                                   |
-| 5.2       | - Section removed                                                                              |
-"""
-
-
-# Function to make an API call to GPT-4o for finding differences between two texts
-def compare_documents_with_gpt4o(text_new, text_old, endpoint, api_key):
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
-
-    system_prompt = f"""You are an expert in document comparison. Your task is to identify the differences between newer and older versions of a document.
-    You need to compare the two versions on a very granular level, which means you have to compare differences in each section and sub-section and then list the changes explicitly.
-    Each sub-section should be listed along with the changes in that sub-section.
-    If there are changes in specific section or sub-section, please provide a detailed summary of the changes for each section or the sub-section along with the changes in each section or the sub-section.
-    If some of the sections are completely missing or newly added or there are no changes, you need to also make a note of it in the output. The example of this output is given below: \n\n{sample_response_edge_cases}
-    An example of how the output should look like is given below:\n\n{sample_response}"""
-
-    # Prepare the payload for the API call
-    payload = {
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Compare the following two document versions and provide a detailed summary of the changes.\n\nNewer Version:\n{text_new}\n\nOlder Version:\n{text_old}"}
-        ],
-        "max_tokens": 16384,
-        "temperature": 1,
-        "top_p": 1,
-        "n": 1,
-    }
-
-    response = requests.post(endpoint, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        completion = response.json()
-        return completion['choices'][0]['message']['content']
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
-
-
-def compare_documents_with_gpt4o_loop(text_new, text_old, differences, iteration, endpoint, api_key):
+def get_differences_between_sections(list_of_section_texts, comparison_cache=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, on_section_compared=None, priority=None):
     """
-    Loop to compare document sections using GPT-4o.
+    Get differences between sections of documents.
     
     Args:
-        text_new (str): Text of the new document.
-        text_old (str): Text of the old document.
-        differences (list): List to store differences found.
-        iteration (int): Current iteration number.
-        endpoint (str): API endpoint for GPT-4o.
-        api_key (str): API key for authentication.
+        list_of_section_texts (list): List of section texts to compare.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+        max_concurrency (int, optional): Maximum number of comparison requests in flight at once.
+            Defaults to DEFAULT_MAX_CONCURRENCY.
+        on_section_compared (callable, optional): Called as soon as each section is compared with its index,
+            the section text followed by its comparison and diff statistics, and the number of sections
+            compared so far and in total. Defaults to None.
+        priority (callable, optional): Returns the index of the section to compare next, or None. Defaults to None.
     
     Returns:
-        None
+        list: List of section texts, each followed by its structured comparison (None if it failed)
+            and its local diff statistics.
     """
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
+    with trace_span("compare", sections=len(list_of_section_texts)) as span:
+        # Compare the normalized texts locally before calling the API
+        all_diff_stats = [compute_diff_stats(section_text[1], section_text[2]) for section_text in list_of_section_texts]
+        changed_indexes = [index for index, diff_stats in enumerate(all_diff_stats) if not diff_stats["identical"]]
+
+        # Report sections as they complete, identical ones first since they need no call
+        compared_sections = 0
+
+        def report_section(index, comparison_document):
+            nonlocal compared_sections
+            compared_sections += 1
+            if on_section_compared is not None:
+                on_section_compared(index, list(list_of_section_texts[index][:4]) + [comparison_document, all_diff_stats[index]],
+                                    compared_sections, len(list_of_section_texts))
+
+        for index, diff_stats in enumerate(all_diff_stats):
+            if diff_stats["identical"]:
+                report_section(index, build_identical_comparison_document())
+
+        # Find the differences of all changed sections concurrently, starting with the prioritized one
+        changed_position = {index: position for position, index in enumerate(changed_indexes)}
+        cache_stats_before = comparison_cache.stats() if comparison_cache is not None else None
+        # Meter the calls of this comparison only; other runs share the gateway
+        with measure_usage() as usage:
+            results = compare_sections_concurrently(
+                [(list_of_section_texts[index][1], list_of_section_texts[index][2]) for index in changed_indexes],
+                cache=comparison_cache,
+                max_concurrency=max_concurrency,
+                on_result=lambda changed_index, result: report_section(changed_indexes[changed_index], build_comparison_document(result)),
+                priority=(lambda: changed_position.get(priority())) if priority is not None else None)
+        results_by_index = dict(zip(changed_indexes, results))
+
+        # Record the token usage, cost and cache hits of this comparison
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                 cost_usd=estimate_cost(usage.prompt_tokens, usage.completion_tokens),
+                 skipped_sections=len(list_of_section_texts) - len(changed_indexes))
+        if cache_stats_before is not None:
+            cache_stats_after = comparison_cache.stats()
+            span.set(cache_hits=max(0, cache_stats_after["hits"] - cache_stats_before["hits"]),
+                     cache_misses=max(0, cache_stats_after["misses"] - cache_stats_before["misses"]))
+
+    skipped_sections = 0
+    for index, section_text in enumerate(list_of_section_texts):
+        diff_stats = all_diff_stats[index]
+        if diff_stats["identical"]:
+            skipped_sections += 1
+            section_text.append(build_identical_comparison_document())
+            section_text.append(diff_stats)
+            continue
+
+        # Keep the typed differences; reports are rendered from them on demand
+        comparison_document = build_comparison_document(results_by_index[index])
+        if comparison_document:
+            logger.debug("Section heading: %s", section_text[0])
+            logger.debug(render_comparison_results(comparison_document))
+        else:
+            logger.error("Error in comparing the two texts")
 
-    system_prompt = f"""You are an expert in document comparison. Your task is to identify the differences between newer and older versions of a document. 
-    You need to compare the two versions on a very granular level, which means you have to compare differences in each section and sub-section and then list the changes explicitly. 
-    Each sub-section should be listed along with the changes in that sub-section. 
-    If there are changes in specific section or sub-section, please provide a detailed summary of the changes for each section or the sub-section along with the changes in each section or the sub-section. 
-    If some of the sections are completely missing or newly added or there are no changes, you need to also make a note of it in the output. The example of this output is given below: \n\n{sample_response_edge_cases}
-    An example of how the output should look like is given below:\n\n{sample_response}"""
-
-    chain_prompt = f""" You are following up on the previous response of the LLM. The previous response was a preliminary analysis of the differences between the two document versions. 
-    The LLM has provided a summary of the changes in the document. 
-    Your task is to review the summary provided by the LLM and provide a more detailed summary of the changes in the document.
-    You must also check if the previous response has missed any important changes or some sections and sub-sections and provide a detailed summary of those changes along with the changes provided by the previous LLM.
-    The differences provided by the previous LLM are as follows:\n\n{differences}
-    The LLM was prompted with the following system prompt:\n\n{system_prompt}
-    You also need to follow the same system prompt and build up on the previous response.
-    """
-
-    temp = 1 - 0.2 * iteration
-    # Prepare the payload for the API call
-    payload = {
-        "messages": [
-            {"role": "system", "content": chain_prompt},
-            {"role": "user", "content": f"Compare the following two document versions and provide a detailed summary of the changes.\n\nNewer Version:\n{text_new}\n\nOlder Version:\n{text_old}"}
-        ],
-        "max_tokens": 16384,
-        "temperature": temp,
-        "top_p": 1,
-        "n": 1,
-    }
+        section_text.append(comparison_document)
+        section_text.append(diff_stats)
 
-    response = requests.post(endpoint, headers=headers, json=payload)
-    
-    if response.status_code == 200:
-        completion = response.json()
-        return completion['choices'][0]['message']['content']
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
+    logger.info(f"Skipped {skipped_sections} of {len(list_of_section_texts)} sections with identical text")
+    if comparison_cache is not None:
+        cache_stats = comparison_cache.stats()
+        logger.info(f"Comparison cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, hit rate {cache_stats['hit_rate']:.0%}")
 
+    return list_of_section_texts
 
-def get_differences_between_sections(list_of_section_texts):
+
+# Function to convert a compared section into the form stored with its pair
+def build_section_document(section):
     """
-    Get differences between sections of documents.
-    
-    Args:
-        list_of_section_texts (list): List of section texts to compare.
-    
-    Returns:
-        list: List of differences found between sections.
-    """
-    for section_text in list_of_section_texts:
-        new_text = section_text[1]
-        old_text = section_text[2]
-
-        # Find the differences between the two texts
-        result = compare_strings(new_text, old_text)
-        result_string = ""
-        # Display the results
-        if result:
-            print("Section heading: ", section_text[0])
-            print("Differences:")
-            result_string = result_string + "Differences:\n"
-            for diff in result.differences:
-                print(f"Type: {diff.type}, Description: {diff.description}")
-                result_string = result_string + f"Type: {diff.type}, Description: {diff.description}\n"
-                if diff.section:
-                    result_string = result_string + f"Section: {diff.section}\n"
-                    print(f"Section: {diff.section}")
-                if diff.new_file_text or diff.old_file_text:
-                    result_string = result_string + f"New content: {diff.new_file_text}\n"
-                    result_string = result_string + f"Old content: {diff.old_file_text}\n"
-                    print(f"New content: {diff.new_file_text}")
-                    print(f"Old content: {diff.old_file_text}")
-                if diff.content:
-                    result_string = result_string + f"Content: {diff.content}\n"
-                    print(f"Content: {diff.content}")
-                if diff.position is not None:
-                    result_string = result_string + f"Position: {diff.position}\n"
-                    print(f"Position: {diff.position}")
-
-            result_string = result_string + "\n\nSummary:"
-            result_string = result_string + result.summary
-            result_string = result_string + "\n\n-----------------------------------------------\n\n"
-            print("\nSummary:")
-            print(result.summary)
-
-            print("\n\n-----------------------------------------------\n\n")
-        else:
-            print("Error in comparing the two texts")
+    Converts a section and its comparison into the form stored in the 'sections' array of a pair.
 
-        section_text.append(result_string)
+    Args:
+        section (list): The section heading, new text, old text and next heading, optionally followed by
+            the structured comparison and the local diff statistics.
 
-    return list_of_section_texts
+    Returns:
+        dict: The stored section; 'compared' is False while its comparison is pending or after it failed.
+    """
+    comparison_document = (section[4] if len(section) > 4 else None) or {}
+    return {
+        'section_heading': section[0],
+        'new_text': section[1],
+        'old_text': section[2],
+        'next_section_heading': section[3],
+        'differences': comparison_document.get('differences', []),
+        'summary': comparison_document.get('summary'),
+        'diff_stats': section[5] if len(section) > 5 else None,
+        'compared': len(section) > 4 and section[4] is not None
+    }
 
 
 def upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_results, db_collection):
     """
     Upload compared sections to a MongoDB collection.
     
+    The pair is stored as 'completed' only if every section has a comparison; otherwise it stays
+    'comparing', so a later run compares the failed sections again.
+    
     Args:
         file_pair (tuple): A tuple containing two strings representing the file pair being compared.
         list_of_section_texts_with_results (list): A list of tuples containing:
@@ -768,7 +665,8 @@ def upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_re
             - New text
             - Old text
             - Next section heading
-            - Comparison results
+            - Structured comparison with 'differences' and 'summary' (None if the comparison failed)
+            - Local diff statistics (optional)
         db_collection: The MongoDB collection where data will be stored.
     
     Returns:
@@ -778,16 +676,16 @@ def upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_re
     file_pair_str = f"{file_pair[0]}_{file_pair[1]}"  # Create a unique string identifier
 
     # Prepare the sections data for insertion
-    sections = []
-    for section in list_of_section_texts_with_results:
-        section_data = {
-            'section_heading': section[0],
-            'new_text': section[1],
-            'old_text': section[2],
-            'next_section_heading': section[3],
-            'comparison_results': section[4]
-        }
-        sections.append(section_data)
+    sections = [build_section_document(section) for section in list_of_section_texts_with_results]
+    # Record which revisions of the documents were compared, so a changed document is compared again
+    content_hashes = get_pair_content_hashes(file_pair, db_collection.database['documents_data'])
+
+    # Keep the pair resumable while any comparison failed, so the next run retries those sections
+    failed_sections = sum(1 for section in sections if not section['compared'])
+    status = 'comparing' if failed_sections else 'completed'
+
+    # Index the stored differences by type and section for cross-pair queries
+    create_difference_indexes(db_collection)
 
     # Insert or update the entire document for the file pair
     db_collection.update_one(
@@ -795,15 +693,201 @@ def upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_re
         {
             '$set': {
                 'file_pair': file_pair_str,
+                'status': status,
+                'content_hashes': content_hashes,
                 'sections': sections
             }
         },
         upsert=True
     )
-    print(f"Data for file pair {file_pair} successfully uploaded to MongoDB.")
+    if failed_sections:
+        logger.warning(f"Data for file pair {file_pair} uploaded to MongoDB with {failed_sections} sections left to compare.")
+    else:
+        logger.info(f"Data for file pair {file_pair} successfully uploaded to MongoDB.")
+
+
+# Function to check whether a stored section was aligned from the same texts
+def is_same_section(stored_section, section_document):
+    """
+    Checks whether a stored section has the same heading, texts and next heading as a newly aligned one.
+
+    Args:
+        stored_section (dict): A section stored with its pair.
+        section_document (dict): The aligned section, as returned by build_section_document.
+
+    Returns:
+        bool: True if the stored comparison applies to the aligned section.
+    """
+    return all(stored_section.get(field) == section_document[field] for field in ('section_heading', 'new_text', 'old_text', 'next_section_heading'))
+
+
+# Function to store the aligned sections of a pair before they are compared
+def resume_compared_sections(file_pair, list_of_section_texts, db_collection):
+    """
+    Stores the aligned sections of a pair with pending comparisons, keeping those of an interrupted run.
+
+    A section compared by an earlier run of the pair is kept only if its heading, texts and next heading
+    are unchanged and its comparison succeeded; all other sections are compared again. A section that
+    already carries a comparison, such as one derived from other pairs, is stored as compared.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        list_of_section_texts (list): The aligned sections, each optionally followed by its structured comparison
+            and diff statistics.
+        db_collection: The MongoDB collection where data will be stored.
+
+    Returns:
+        dict: The stored sections that are already compared, by position in the pair.
+    """
+    file_pair_str = f"{file_pair[0]}_{file_pair[1]}"
+    checkpoint = db_collection.find_one({'file_pair': file_pair_str, 'status': 'comparing'}) or {}
+    stored_sections = checkpoint.get('sections', [])
+
+    sections = []
+    completed_sections = {}
+    for index, section_text in enumerate(list_of_section_texts):
+        section_document = build_section_document(section_text)
+        stored_section = stored_sections[index] if index < len(stored_sections) else {}
+        if section_document['compared']:
+            completed_sections[index] = section_document
+        elif stored_section.get('compared') and stored_section.get('summary') is not None and is_same_section(stored_section, section_document):
+            section_document = stored_section
+            completed_sections[index] = stored_section
+        sections.append(section_document)
+
+    create_difference_indexes(db_collection)
+    db_collection.update_one(
+        {'file_pair': file_pair_str},
+        {'$set': {'file_pair': file_pair_str, 'status': 'comparing', 'sections': sections}},
+        upsert=True
+    )
+    return completed_sections
+
+
+# Function to look up the content hashes of the documents of a pair
+def get_pair_content_hashes(file_pair, documents_data_db):
+    """
+    Looks up the content hashes under which the documents of a pair were processed.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        documents_data_db: MongoDB collection for document data.
+
+    Returns:
+        list: The content hash of the new and old document, None for a document stored without one.
+    """
+    return [(documents_data_db.find_one({'file_name': file_name}, {'content_hash': 1}) or {}).get('content_hash') for file_name in file_pair]
 
 
-def find_section_wise_differences_all_pairs(pairs_list, adobe_api_json_outputs_db, documents_data_db, sections_data):
+# Function to check whether a pair is already fully compared
+def is_pair_completed(file_pair, db_collection, content_hashes=None):
+    """
+    Checks whether all sections of a pair are compared and stored.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        db_collection: The MongoDB collection holding the compared sections.
+        content_hashes (tuple, optional): Content hashes of the new and old document. When given, the pair
+            only counts as completed if it was compared from these revisions. Defaults to None.
+
+    Returns:
+        bool: True if the pair is stored and not interrupted mid-comparison.
+    """
+    query = {'file_pair': f"{file_pair[0]}_{file_pair[1]}", 'status': {'$ne': 'comparing'}}
+    if content_hashes is not None:
+        query['content_hashes'] = list(content_hashes)
+    return db_collection.count_documents(query, limit=1) > 0
+
+
+# Function to load the sections of a pair compared by an earlier run
+def load_completed_sections(file_pair, list_of_section_texts, db_collection):
+    """
+    Loads the comparisons of a completed pair, if it was compared over the same aligned sections.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        list_of_section_texts (list): The aligned sections, without comparisons.
+        db_collection: The MongoDB collection holding the compared sections.
+
+    Returns:
+        list | None: The sections, each followed by its stored comparison and diff statistics, or None if the
+            pair is not completed or its stored sections differ.
+    """
+    stored_pair = db_collection.find_one({'file_pair': f"{file_pair[0]}_{file_pair[1]}", 'status': {'$ne': 'comparing'}}) or {}
+    stored_sections = stored_pair.get('sections', [])
+    if len(stored_sections) != len(list_of_section_texts) or not all(
+            stored_section.get('compared', True) and is_same_section(stored_section, build_section_document(section_text))
+            for stored_section, section_text in zip(stored_sections, list_of_section_texts)):
+        return None
+    return [list(section_text[:4]) + [{'differences': stored_section.get('differences', []), 'summary': stored_section.get('summary')},
+                                      stored_section.get('diff_stats')]
+            for stored_section, section_text in zip(stored_sections, list_of_section_texts)]
+
+
+# Function to store the comparison of one section as soon as it completes
+def upload_compared_section(file_pair, index, section_text_with_results, db_collection):
+    """
+    Stores the comparison of one section in place, without rewriting the other sections of the pair.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        index (int): Position of the section in the pair.
+        section_text_with_results (list): The section followed by its structured comparison and diff statistics.
+        db_collection: The MongoDB collection where data will be stored.
+    """
+    section_document = build_section_document(section_text_with_results)
+    db_collection.update_one(
+        {'file_pair': f"{file_pair[0]}_{file_pair[1]}"},
+        {'$set': {f"sections.{index}.{field}": section_document[field] for field in ('differences', 'summary', 'diff_stats', 'compared')}}
+    )
+
+
+# Function to compare the sections of a pair with a stored checkpoint per section
+def compare_sections_with_checkpoints(file_pair, list_of_section_texts, sections_data, comparison_cache=None, on_section_compared=None, priority=None):
+    """
+    Compares the sections of a pair, storing each comparison as soon as it completes.
+
+    Sections already compared by an interrupted run of the pair are taken from storage, so a rerun
+    only pays for the missing ones. Sections that already carry a comparison are stored as they are.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        list_of_section_texts (list): The aligned sections, each optionally followed by its structured comparison
+            and diff statistics.
+        sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+        on_section_compared (callable, optional): Progress callback, as for get_differences_between_sections.
+        priority (callable, optional): Returns the index of the section to compare next, or None.
+
+    Returns:
+        list: The sections, each followed by its structured comparison and diff statistics.
+    """
+    with trace_span("upload"):
+        completed_sections = resume_compared_sections(file_pair, list_of_section_texts, sections_data)
+    missing_indexes = [index for index in range(len(list_of_section_texts)) if index not in completed_sections]
+    missing_position = {index: position for position, index in enumerate(missing_indexes)}
+    if completed_sections:
+        logger.info(f"Resuming {file_pair}: {len(completed_sections)} of {len(list_of_section_texts)} sections already compared")
+
+    # Store each section as soon as it is compared, so an interruption loses at most the requests in flight
+    def store_section(position, section_text_with_results, compared_sections, total_sections):
+        index = missing_indexes[position]
+        upload_compared_section(file_pair, index, section_text_with_results, sections_data)
+        if on_section_compared is not None:
+            on_section_compared(index, section_text_with_results, len(completed_sections) + compared_sections, len(list_of_section_texts))
+
+    get_differences_between_sections([list_of_section_texts[index] for index in missing_indexes], comparison_cache,
+                                     on_section_compared=store_section,
+                                     priority=(lambda: missing_position.get(priority())) if priority is not None else None)
+
+    # The compared sections were extended in place; add the stored comparisons to the others
+    for index, stored_section in completed_sections.items():
+        list_of_section_texts[index] = list(list_of_section_texts[index][:4]) + [
+            {'differences': stored_section.get('differences', []), 'summary': stored_section['summary']}, stored_section.get('diff_stats')]
+    return list_of_section_texts
+
+
+def find_section_wise_differences_all_pairs(pairs_list, adobe_api_json_outputs_db, documents_data_db, sections_data, comparison_cache=None, pdf_paths=None):
     """
     Find section-wise differences for all pairs in a list.
     
@@ -812,41 +896,57 @@ def find_section_wise_differences_all_pairs(pairs_list, adobe_api_json_outputs_d
         adobe_api_json_outputs_db: MongoDB collection for Adobe API outputs.
         documents_data_db: MongoDB collection for document data.
         sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of section comparisons shared by all pairs. Defaults to None.
+        pdf_paths (dict, optional): PDF paths by base name, as returned by get_pdf_paths_by_name. Defaults to None.
     
     Returns:
         None
     """
+    # Report cache hits and model calls for this batch only
+    if comparison_cache is not None:
+        comparison_cache.reset_stats()
+    get_gateway().reset_metrics()
+
     for pair in pairs_list:
         new_file_name = os.path.splitext(pair[0])[0]
         old_file_name = os.path.splitext(pair[1])[0]
-        print(pair)
+        logger.debug(pair)
 
-        # Assuming get_file_paths_from_pair is a function that retrieves file paths
-        new_file_path, old_file_path = get_file_paths_from_pair(pair)
+        # Skip pairs a previous run already finished
+        if is_pair_completed((new_file_name, old_file_name), sections_data):
+            logger.info(f"Skipping {new_file_name}_{old_file_name}: already compared")
+            continue
 
-        print(new_file_name)
-        print(old_file_name)
+        new_file_path, old_file_path = get_file_paths_from_pair(pair, pdf_paths)
 
-        # Extract JSON data
-        new_file_json, old_file_json = get_adobe_api_outputs(new_file_path, old_file_path, adobe_api_json_outputs_db)
+        with trace_run(f"{new_file_name}_{old_file_name}", sections_data.database[RUNS_COLLECTION_NAME]):
+            with trace_span("ingest") as span:
+                # Extract JSON data
+                new_file_json, old_file_json = get_adobe_api_outputs(new_file_path, old_file_path, adobe_api_json_outputs_db)
 
-        # Get section headings
-        new_file_section_headings_list, new_file_section_headings_list_with_path, old_file_section_headings_list, old_file_section_headings_list_with_path = get_section_headings_and_processing(new_file_json, old_file_json)
+                # Fetch cleaned text from MongoDB
+                new_file_cleaned_text = get_cleaned_text_from_mongodb(new_file_name, documents_data_db)
+                old_file_cleaned_text = get_cleaned_text_from_mongodb(old_file_name, documents_data_db)
+                span.set(bytes=len(new_file_cleaned_text.encode("utf-8")) + len(old_file_cleaned_text.encode("utf-8")))
 
-        # Fetch cleaned text from MongoDB
-        new_file_cleaned_text = get_cleaned_text_from_mongodb(new_file_name, documents_data_db)
-        old_file_cleaned_text = get_cleaned_text_from_mongodb(old_file_name, documents_data_db)
+            # Extract section texts by aligning the H1 to H6 heading trees of both files
+            with trace_span("align") as span:
+                list_of_section_texts = get_hierarchical_section_texts(new_file_json, old_file_json, new_file_cleaned_text, old_file_cleaned_text)
+                span.set(sections=len(list_of_section_texts))
 
-        # Extract section texts
-        list_of_section_texts = get_section_texts(new_file_section_headings_list, new_file_section_headings_list_with_path, old_file_section_headings_list, old_file_section_headings_list_with_path, new_file_cleaned_text, old_file_cleaned_text)
+            logger.debug(f"Aligned {len(list_of_section_texts)} sections of {new_file_name} and {old_file_name}")
 
-        print(list_of_section_texts)
+            # Compare sections, resuming an interrupted run of the pair
+            list_of_section_texts_with_results = compare_sections_with_checkpoints((new_file_name, old_file_name), list_of_section_texts, sections_data, comparison_cache)
 
-        # Compare sections
-        list_of_section_texts_with_results = get_differences_between_sections(list_of_section_texts)
+            # Store results in MongoDB
+            with trace_span("upload"):
+                upload_compared_sections_to_mongodb((new_file_name, old_file_name), list_of_section_texts_with_results, sections_data)
 
-        # Store results in MongoDB
-        upload_compared_sections_to_mongodb((new_file_name, old_file_name), list_of_section_texts_with_results, sections_data)
+    if comparison_cache is not None:
+        cache_stats = comparison_cache.stats()
+        logger.info(f"Batch comparison cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, hit rate {cache_stats['hit_rate']:.0%}")
+    get_gateway().log_metrics()
 
 
 def get_mongodb_connection(uri):
@@ -870,7 +970,7 @@ def get_mongodb_connection(uri):
     client = MongoClient(uri)
     try:
         client.admin.command('ping')
-        print("Successfully connected to MongoDB!")
+        logger.info("Successfully connected to MongoDB!")
     except Exception as e:
         raise ConnectionError(f"Error connecting to MongoDB: {e}")
     return client, client['capstone_db']
@@ -900,6 +1000,28 @@ def get_file_pairs_from_excel(file_path):
     return pairs_list
 
 
+def get_version_series_from_excel(file_path):
+    """
+    Extract the version series of each document from an Excel file.
+    
+    Args:
+        file_path (str): Path to the Excel file containing document version information.
+    
+    Returns:
+        list: A tuple per row with the file names from newest to oldest: (new, old_1, old) or (new, old).
+    """
+    document_list_df = pd.read_excel(file_path)
+    series_list = []
+
+    for _, row in document_list_df.iterrows():
+        if pd.isna(row['old_version_1']):
+            series_list.append((row['new_version'], row['old_version']))
+        else:
+            series_list.append((row['new_version'], row['old_version_1'], row['old_version']))
+
+    return series_list
+
+
 def check_and_upload_json(file_path, db_collection):
     """
     Check if a JSON file is in the MongoDB collection and upload it if not.
@@ -913,7 +1035,7 @@ def check_and_upload_json(file_path, db_collection):
     """
     filename = os.path.basename(file_path)
     if db_collection.count_documents({'file_name': os.path.splitext(filename)[0]}) > 0:
-        print(f"{filename} is already in the database.")
+        logger.info(f"{filename} is already in the database.")
         return
     with open(file_path, 'r', encoding='utf-8') as file:
         json_data = json.load(file)
@@ -924,7 +1046,7 @@ def check_and_upload_json(file_path, db_collection):
             'elements': json_data.get('elements'),
             'pages': json_data.get('pages')
         })
-    print(f"Uploaded {filename} to MongoDB.")
+    logger.info(f"Uploaded {filename} to MongoDB.")
 
 
 def get_adobe_api_outputs(new_file_path, old_file_path, db_collection):
@@ -982,7 +1104,7 @@ def get_cleaned_text(file_name, db_collection):
     return data.get('cleaned_text') if data else None
 
 
-def compare_section_texts(list_of_section_texts, endpoint, api_key):
+def compare_section_texts(list_of_section_texts, endpoint, api_key, max_concurrency=DEFAULT_MAX_CONCURRENCY):
     """
     Compare texts for each section using GPT-4 and append results to the section data.
     
@@ -990,14 +1112,20 @@ def compare_section_texts(list_of_section_texts, endpoint, api_key):
         list_of_section_texts (list): List of section texts to compare.
         endpoint (str): API endpoint for GPT-4.
         api_key (str): API key for authentication.
+        max_concurrency (int, optional): Maximum number of comparison requests in flight at once.
+            Defaults to DEFAULT_MAX_CONCURRENCY.
     
     Returns:
         list: List of section texts with comparison results.
     """
-    for section_text in list_of_section_texts:
-        new_text = section_text[1]
-        old_text = section_text[2]
-        section_text.append(compare_strings(new_text, old_text, endpoint, api_key))
+    # Compare all sections concurrently, keeping the results in section order
+    results = compare_sections_concurrently(
+        [(section_text[1], section_text[2]) for section_text in list_of_section_texts],
+        max_concurrency=max_concurrency,
+        azure_endpoint=endpoint,
+        azure_api_key=api_key)
+    for section_text, result in zip(list_of_section_texts, results):
+        section_text.append(result)
     return list_of_section_texts
 
 
@@ -1014,21 +1142,23 @@ def upload_comparison_results(file_pair, section_texts_with_results, db_collecti
         None
     """
     file_pair_str = f"{file_pair[0]}__{file_pair[1]}"
-    sections = [
-        {
+    sections = []
+    for section in section_texts_with_results:
+        comparison_document = build_comparison_document(section[4]) or {}
+        sections.append({
             'section_heading': section[0],
             'new_text': section[1],
             'old_text': section[2],
             'next_section_heading': section[3],
-            'comparison_results': section[4]
-        } for section in section_texts_with_results
-    ]
+            'differences': comparison_document.get('differences', []),
+            'summary': comparison_document.get('summary')
+        })
     db_collection.update_one(
         {'file_pair': file_pair_str},
         {'$set': {'file_pair': file_pair_str, 'sections': sections}},
         upsert=True
     )
-    print(f"Uploaded comparison results for {file_pair} to MongoDB.")
+    logger.info(f"Uploaded comparison results for {file_pair} to MongoDB.")
 
 
 def find_all_pdfs(root_folder):
@@ -1049,7 +1179,48 @@ def find_all_pdfs(root_folder):
     return pdf_files
 
 
-def find_section_wise_differences_in_files(new_file_path, old_file_path, adobe_api_json_outputs_db, documents_data_db, sections_data):
+# Function to index PDF files by their base name
+def get_pdf_paths_by_name(root_folder):
+    """
+    Find all PDF files under a root folder and index them by file name without extension.
+    
+    Args:
+        root_folder (str): Root directory path to start the search
+    
+    Returns:
+        dict: The path of each PDF file by its base name
+    """
+    return {os.path.splitext(os.path.basename(pdf_path))[0]: pdf_path for pdf_path in find_all_pdfs(root_folder)}
+
+
+# Function to resolve the files of a pair listed in the Excel sheet
+def get_file_paths_from_pair(pair, pdf_paths=None):
+    """
+    Resolve the file names of a pair, or of a longer version series, to the paths of their PDF files.
+    
+    Args:
+        pair (tuple): The file names from newest to oldest, with or without the '.pdf' extension.
+        pdf_paths (dict, optional): PDF paths by base name, as returned by get_pdf_paths_by_name.
+            Defaults to None, in which case the names are used as paths.
+    
+    Returns:
+        tuple: The paths of the files, in the same order.
+    
+    Raises:
+        FileNotFoundError: If a file of the pair is not among the indexed PDFs.
+    """
+    if pdf_paths is None:
+        return tuple(str(file_name) for file_name in pair)
+    file_paths = []
+    for file_name in pair:
+        base_name = os.path.splitext(os.path.basename(str(file_name)))[0]
+        if base_name not in pdf_paths:
+            raise FileNotFoundError(f"No PDF found for {file_name}")
+        file_paths.append(pdf_paths[base_name])
+    return tuple(file_paths)
+
+
+def find_section_wise_differences_in_files(new_file_path, old_file_path, adobe_api_json_outputs_db, documents_data_db, sections_data, comparison_cache=None, on_section_compared=None, priority=None):
     """
     Find section-wise differences between two files and upload results to MongoDB.
     
@@ -1059,6 +1230,9 @@ def find_section_wise_differences_in_files(new_file_path, old_file_path, adobe_a
         adobe_api_json_outputs_db: MongoDB collection for Adobe API outputs.
         documents_data_db: MongoDB collection for document data.
         sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+        on_section_compared (callable, optional): Progress callback passed on to get_differences_between_sections.
+        priority (callable, optional): Returns the index of the section to compare next, or None.
     
     Returns:
         None
@@ -1066,26 +1240,55 @@ def find_section_wise_differences_in_files(new_file_path, old_file_path, adobe_a
     new_file_name = os.path.splitext(os.path.basename(new_file_path))[0]
     old_file_name = os.path.splitext(os.path.basename(old_file_path))[0]
 
+    with trace_run(f"{new_file_name}_{old_file_name}", sections_data.database[RUNS_COLLECTION_NAME]):
+        with trace_span("ingest") as span:
+            new_file_json, old_file_json = get_adobe_api_outputs(new_file_path, old_file_path, adobe_api_json_outputs_db)
+            new_file_cleaned_text = get_cleaned_text_from_mongodb(new_file_name, documents_data_db)
+            old_file_cleaned_text = get_cleaned_text_from_mongodb(old_file_name, documents_data_db)
+            span.set(bytes=len(new_file_cleaned_text.encode("utf-8")) + len(old_file_cleaned_text.encode("utf-8")))
 
-    new_file_json, old_file_json = get_adobe_api_outputs(new_file_path, old_file_path, adobe_api_json_outputs_db)
+        with trace_span("parse"):
+            new_heading_tree = build_heading_tree(new_file_json, new_file_cleaned_text)
+            old_heading_tree = build_heading_tree(old_file_json, old_file_cleaned_text)
 
-    new_file_section_headings_list, new_file_section_headings_list_with_path, old_file_section_headings_list, old_file_section_headings_list_with_path = get_section_headings_and_processing(new_file_json, old_file_json)
+        return find_section_wise_differences_in_heading_trees((new_file_name, old_file_name), new_heading_tree, old_heading_tree,
+                                                              new_file_cleaned_text, old_file_cleaned_text, sections_data,
+                                                              comparison_cache, on_section_compared, priority)
 
-    print(new_file_name)
 
-    new_file_cleaned_text = get_cleaned_text_from_mongodb(new_file_name, documents_data_db)
-    print(old_file_name)
-    old_file_cleaned_text = get_cleaned_text_from_mongodb(old_file_name, documents_data_db)
-
-    list_of_section_texts = get_section_texts(new_file_section_headings_list, new_file_section_headings_list_with_path, old_file_section_headings_list, old_file_section_headings_list_with_path, new_file_cleaned_text, old_file_cleaned_text)
-
-    print(list_of_section_texts)
+# Function to compare two documents whose heading trees are already built
+def find_section_wise_differences_in_heading_trees(file_pair, new_heading_tree, old_heading_tree, new_file_cleaned_text, old_file_cleaned_text, sections_data, comparison_cache=None, on_section_compared=None, priority=None):
+    """
+    Align two prepared documents, compare their sections and upload the results to MongoDB.
+    
+    Args:
+        file_pair (tuple): The new and old file names.
+        new_heading_tree (list): Heading tree of the new file, as returned by build_heading_tree.
+        old_heading_tree (list): Heading tree of the old file, as returned by build_heading_tree.
+        new_file_cleaned_text (str): Cleaned text of the new file.
+        old_file_cleaned_text (str): Cleaned text of the old file.
+        sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+        on_section_compared (callable, optional): Progress callback passed on to get_differences_between_sections.
+        priority (callable, optional): Returns the index of the section to compare next, or None.
+    
+    Returns:
+        The sections_data collection.
+    """
+    with trace_run(f"{file_pair[0]}_{file_pair[1]}", sections_data.database[RUNS_COLLECTION_NAME]):
+        # Align subsections within matched parents so each comparison unit stays under the token budget
+        with trace_span("align") as span:
+            list_of_section_texts = align_heading_trees(new_heading_tree, old_heading_tree, new_file_cleaned_text, old_file_cleaned_text)
+            span.set(sections=len(list_of_section_texts))
 
-    list_of_section_texts_with_results = get_differences_between_sections(list_of_section_texts)
+        logger.debug(f"Aligned {len(list_of_section_texts)} sections of {file_pair[0]} and {file_pair[1]}")
 
-    file_pair = (new_file_name, old_file_name)
+        # Store each section as soon as it is compared, so it can be shown before the whole pair is done
+        list_of_section_texts_with_results = compare_sections_with_checkpoints(file_pair, list_of_section_texts, sections_data, comparison_cache,
+                                                                               on_section_compared, priority)
 
-    upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_results, sections_data)
+        with trace_span("upload"):
+            upload_compared_sections_to_mongodb(file_pair, list_of_section_texts_with_results, sections_data)
 
     return sections_data
 
@@ -1094,33 +1297,15 @@ def main():
     """
     Main function to execute the application.
     
-    This function connects to MongoDB, processes PDFs, and compares sections.
+    Runs the batch comparison of the file pairs listed in an Excel sheet; see batch_compare.py for the options.
     
     Returns:
         None
     """
-    # Establish MongoDB connection
-    client, capstone_db = get_mongodb_connection(uri)
-    adobe_api_json_outputs_db = capstone_db['adobe_api_json_outputs']
-
-    # Define root folder and find all PDFs
-    root_folder = r"D:\Google Drive University\Nexteer AI Docs Capstone Project\Resources from client"
-    pdf_files = find_all_pdfs(root_folder)
-
-    # Process PDFs and upload JSON to MongoDB
-    for pdf_file in pdf_files:
-        json_file_path = ExtractTextInfoFromPDF(pdf_file).extract_text()
-        check_and_upload_json(json_file_path, adobe_api_json_outputs_db)
-
-    # Example usage: Compare sections of two documents
-    file_pairs = get_file_pairs_from_excel("path_to_excel.xlsx")
-    for new_file, old_file in file_pairs:
-        new_json, old_json = get_adobe_api_outputs(new_file, old_file, adobe_api_json_outputs_db)
-        new_headings = get_section_headings(new_json)
-        old_headings = get_section_headings(old_json)
-        section_texts = [(heading, get_cleaned_text(heading, adobe_api_json_outputs_db)) for heading in new_headings]
-        section_texts_with_results = compare_section_texts(section_texts, "api_endpoint", "api_key")
-        upload_comparison_results((new_file, old_file), section_texts_with_results, adobe_api_json_outputs_db)
+    # Imported here because the batch command builds on this module
+    from batch_compare import main as batch_main
+    batch_main()
+
 
 if __name__ == "__main__":
     main()
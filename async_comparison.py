@@ -0,0 +1,398 @@
+# Import necessary libraries and modules
+import logging
+import time
+import random
+import asyncio
+from openai import APIConnectionError
+from llm_gateway import get_gateway, CircuitOpenError, TokenBucketRateLimiter, requests_per_minute, tokens_per_minute
+from text_comparison_openAI_api import (
+    ComparisonResult, PackedComparisonResult, build_comparison_messages, build_packed_comparison_messages,
+    DEPLOYMENT_NAME, PROMPT_VERSION
+)
+from token_counting import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Default number of comparison requests in flight at once
+DEFAULT_MAX_CONCURRENCY = 8
+# Completion tokens reserved per request when estimating its quota usage
+EXPECTED_COMPLETION_TOKENS = 1000
+# Sections with at most this many tokens (new and old text combined) are packed with others
+SMALL_SECTION_TOKENS = 800
+# Token budget of the section texts packed into a single request
+PACK_TOKEN_BUDGET = 6000
+
+
+# Function to get the HTTP status code of an API error
+def get_status_code(error):
+    """
+    Returns the HTTP status code carried by an API error, if any.
+
+    Args:
+        error (Exception): The error raised by the API call.
+
+    Returns:
+        int | None: The status code, or None for errors without a response.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+# Function to decide whether an API call should be retried
+def is_retryable_error(error):
+    """
+    Checks whether an error is transient: rate limiting, a server error, a connection problem or an open circuit breaker.
+
+    Args:
+        error (Exception): The error raised by the API call.
+
+    Returns:
+        bool: True if the call should be retried.
+    """
+    if isinstance(error, (APIConnectionError, ConnectionError, TimeoutError, asyncio.TimeoutError, CircuitOpenError)):
+        return True
+    status_code = get_status_code(error)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+# Function to read the delay requested by the server
+def get_retry_after_seconds(error):
+    """
+    Reads the Retry-After delay sent with a rate-limited response, or the time until an open circuit lets calls through.
+
+    Args:
+        error (Exception): The error raised by the API call.
+
+    Returns:
+        float | None: The delay in seconds, or None if the server did not send one.
+    """
+    if isinstance(error, CircuitOpenError):
+        return error.retry_after_seconds
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class ConcurrentComparisonEngine:
+    """
+    Runs comparison requests concurrently under a concurrency bound and the deployment quotas.
+
+    Transient failures (429, 5xx, connection errors and an open circuit) are retried with jittered exponential backoff.
+    Results are returned in the order of the submitted jobs.
+
+    Attributes:
+        call: Coroutine function that performs one request for a job payload.
+        max_concurrency (int): Maximum number of requests in flight at once.
+        rate_limiter (TokenBucketRateLimiter): Limiter enforcing the deployment quotas, usually shared through the gateway.
+        max_retries (int): Maximum number of retries per request.
+        base_delay (float): Base backoff delay in seconds.
+        max_delay (float): Maximum backoff delay in seconds.
+    """
+
+    def __init__(self, call, max_concurrency=DEFAULT_MAX_CONCURRENCY, requests_per_minute=requests_per_minute,
+                 tokens_per_minute=tokens_per_minute, max_retries=5, base_delay=1.0, max_delay=60.0, rate_limiter=None):
+        """
+        Initializes the engine.
+
+        Args:
+            call: Coroutine function that takes a job payload and returns its result.
+            max_concurrency (int): Maximum number of requests in flight at once.
+            requests_per_minute (int): Requests-per-minute quota of a limiter of this engine alone.
+            tokens_per_minute (int): Tokens-per-minute quota of a limiter of this engine alone.
+            max_retries (int): Maximum number of retries per request.
+            base_delay (float): Base backoff delay in seconds.
+            max_delay (float): Maximum backoff delay in seconds.
+            rate_limiter (TokenBucketRateLimiter, optional): Limiter shared with other engines, e.g. the gateway's.
+                Defaults to a new limiter with the given quotas.
+        """
+        self.call = call
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    async def _run_job(self, semaphore, payload, estimated_tokens):
+        """
+        Runs a single job with rate limiting and retries.
+
+        Args:
+            semaphore (asyncio.Semaphore): Semaphore bounding the requests in flight.
+            payload: The job payload passed to the call.
+            estimated_tokens (int): Estimated prompt and completion tokens of the job.
+
+        Returns:
+            The result of the call, or None if it failed.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                async with semaphore:
+                    return await self.call(payload)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_retries:
+                    logger.error(f"Error during API call or processing: {e}")
+                    return None
+                # Back off exponentially with full jitter, but never less than the server asked for
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, get_retry_after_seconds(e) or 0)
+                self.retries += 1
+                await asyncio.sleep(delay)
+        return None
+
+    async def run(self, jobs, on_result=None, priority=None):
+        """
+        Runs all jobs concurrently.
+
+        Jobs are started in submission order, except that the job named by the priority callable, if it
+        has not started yet, is started next.
+
+        Args:
+            jobs (list): Tuples of (payload, estimated_tokens).
+            on_result (callable, optional): Called with the index and result of each job as soon as it finishes.
+            priority (callable, optional): Returns the index of the job to start next, or None.
+
+        Returns:
+            list: The result of each job in submission order, None for failed jobs.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = [None] * len(jobs)
+        pending_indexes = list(range(len(jobs)))
+
+        async def worker():
+            while pending_indexes:
+                # Take the prioritized job if it is still waiting, otherwise the oldest one
+                preferred_index = priority() if priority is not None else None
+                job_index = preferred_index if preferred_index in pending_indexes else pending_indexes[0]
+                pending_indexes.remove(job_index)
+                payload, estimated_tokens = jobs[job_index]
+                results[job_index] = await self._run_job(semaphore, payload, estimated_tokens)
+                if on_result is not None:
+                    on_result(job_index, results[job_index])
+
+        await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(jobs)))))
+        return results
+
+
+# Function to estimate the quota usage of a request
+def estimate_request_tokens(messages, expected_completion_tokens=EXPECTED_COMPLETION_TOKENS):
+    """
+    Estimates the tokens a chat request consumes from the tokens-per-minute quota.
+
+    Args:
+        messages (list): The chat messages of the request.
+        expected_completion_tokens (int): Completion tokens reserved for the response.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(count_tokens(message["content"]) for message in messages) + expected_completion_tokens
+
+
+# Function to create the asynchronous Azure OpenAI client
+def create_async_client(azure_endpoint=None, azure_api_key=None):
+    """
+    Creates a pooled asynchronous Azure OpenAI client of the shared gateway, with the SDK's own retries disabled.
+
+    Args:
+        azure_endpoint (str, optional): The Azure OpenAI endpoint. Defaults to the 'endpoint' environment variable.
+        azure_api_key (str, optional): The Azure OpenAI API key. Defaults to the 'api_key' environment variable.
+
+    Returns:
+        AsyncAzureOpenAI: The client.
+    """
+    return get_gateway(azure_endpoint, azure_api_key).create_async_client()
+
+
+# Function to group small section pairs into packed requests
+def pack_section_pairs(section_pairs, pack_token_budget=PACK_TOKEN_BUDGET, small_section_tokens=SMALL_SECTION_TOKENS):
+    """
+    Groups consecutive small section pairs so that each group fits a single request.
+
+    Args:
+        section_pairs (list): Tuples of (new_text, old_text).
+        pack_token_budget (int): Token budget of the section texts in a single packed request.
+        small_section_tokens (int): Sections above this size are always compared on their own.
+
+    Returns:
+        list: Lists of section indexes; each list is sent as one request.
+    """
+    groups = []
+    current_group, current_tokens = [], 0
+    for index, (new_text, old_text) in enumerate(section_pairs):
+        section_tokens = count_tokens(new_text) + count_tokens(old_text)
+        if section_tokens > small_section_tokens:
+            groups.append([index])
+            continue
+        if current_group and current_tokens + section_tokens > pack_token_budget:
+            groups.append(current_group)
+            current_group, current_tokens = [], 0
+        current_group.append(index)
+        current_tokens += section_tokens
+    if current_group:
+        groups.append(current_group)
+    return groups
+
+
+# Function to compare section pairs concurrently
+async def compare_sections_async(section_pairs, max_concurrency=DEFAULT_MAX_CONCURRENCY, azure_endpoint=None, azure_api_key=None, pack_token_budget=PACK_TOKEN_BUDGET, on_result=None, priority=None, **engine_options):
+    """
+    Compares section pairs concurrently with structured output.
+
+    Small sections are packed into shared requests that return one result per section id. Sections
+    missing from a malformed or partial packed response are compared again on their own.
+
+    Args:
+        section_pairs (list): Tuples of (new_text, old_text).
+        max_concurrency (int): Maximum number of requests in flight at once.
+        azure_endpoint (str, optional): The Azure OpenAI endpoint. Defaults to the 'endpoint' environment variable.
+        azure_api_key (str, optional): The Azure OpenAI API key. Defaults to the 'api_key' environment variable.
+        pack_token_budget (int): Token budget of a packed request; 0 compares every section on its own.
+        on_result (callable, optional): Called with the index and ComparisonResult (or None) of each section
+            as soon as its result is final.
+        priority (callable, optional): Returns the index of the section to compare next, or None.
+        **engine_options: Further keyword arguments for ConcurrentComparisonEngine. Unless quotas are given,
+            the engine shares the gateway's rate limiter with all other callers of the deployment.
+
+    Returns:
+        list: A ComparisonResult or None for each section pair, in order.
+    """
+    gateway = get_gateway(azure_endpoint, azure_api_key)
+    if "requests_per_minute" not in engine_options and "tokens_per_minute" not in engine_options:
+        engine_options.setdefault("rate_limiter", gateway.rate_limiter)
+    async with gateway.create_async_client() as async_client:
+        async def compare(payload):
+            # Each payload is the response model and the messages of the request
+            response_format, messages = payload
+            operation = "packed_section_comparison" if response_format is PackedComparisonResult else "section_comparison"
+            return await gateway.aparse(async_client, messages, response_format, operation=operation)
+
+        engine = ConcurrentComparisonEngine(compare, max_concurrency=max_concurrency, **engine_options)
+
+        def single_job(index):
+            messages = build_comparison_messages(*section_pairs[index])
+            return (ComparisonResult, messages), estimate_request_tokens(messages)
+
+        # Build one request per group, packing small sections together
+        groups = pack_section_pairs(section_pairs, pack_token_budget) if pack_token_budget else [[index] for index in range(len(section_pairs))]
+        jobs = []
+        for group in groups:
+            if len(group) == 1:
+                jobs.append(single_job(group[0]))
+                continue
+            messages = build_packed_comparison_messages([(str(index), *section_pairs[index]) for index in group])
+            jobs.append(((PackedComparisonResult, messages), estimate_request_tokens(messages, EXPECTED_COMPLETION_TOKENS * len(group))))
+
+        results = [None] * len(section_pairs)
+        fallback_indexes = []
+
+        def set_result(index, result):
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+        # Unpack each result back to its sections as it arrives and collect the ones that need an individual call
+        def unpack_group_result(group_index, group_result):
+            group = groups[group_index]
+            if len(group) == 1:
+                set_result(group[0], group_result)
+                return
+            results_by_id = {section_result.section_id: section_result for section_result in group_result.results} if group_result else {}
+            for index in group:
+                section_result = results_by_id.get(str(index))
+                if section_result is None:
+                    fallback_indexes.append(index)
+                else:
+                    set_result(index, ComparisonResult(differences=section_result.differences, summary=section_result.summary))
+
+        # Translate the prioritized section into the request that carries it
+        group_by_index = {index: group_index for group_index, group in enumerate(groups) for index in group}
+
+        def group_priority():
+            return group_by_index.get(priority()) if priority is not None else None
+
+        def fallback_priority():
+            preferred_index = priority() if priority is not None else None
+            return fallback_indexes.index(preferred_index) if preferred_index in fallback_indexes else None
+
+        start_time = time.perf_counter()
+        await engine.run(jobs, on_result=unpack_group_result, priority=group_priority)
+
+        if fallback_indexes:
+            await engine.run([single_job(index) for index in fallback_indexes],
+                             on_result=lambda job_index, result: set_result(fallback_indexes[job_index], result),
+                             priority=fallback_priority)
+
+        # Report how many requests packing saved
+        request_count = len(groups) + len(fallback_indexes)
+        elapsed = time.perf_counter() - start_time
+        if section_pairs:
+            logger.info(f"Sent {request_count} requests for {len(section_pairs)} sections ({len(section_pairs) - request_count} saved by packing, "
+                  f"{len(fallback_indexes)} fallbacks), {elapsed / len(section_pairs):.2f}s per section")
+        return results
+
+
+# Function to compare section pairs concurrently from synchronous code
+def compare_sections_concurrently(section_pairs, cache=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, azure_endpoint=None, azure_api_key=None, on_result=None, priority=None, **engine_options):
+    """
+    Compares section pairs concurrently, answering repeated comparisons from the cache.
+
+    Args:
+        section_pairs (list): Tuples of (new_text, old_text).
+        cache (ComparisonCache, optional): Cache consulted before and updated after the API calls. Defaults to None.
+        max_concurrency (int): Maximum number of requests in flight at once.
+        azure_endpoint (str, optional): The Azure OpenAI endpoint. Defaults to the 'endpoint' environment variable.
+        azure_api_key (str, optional): The Azure OpenAI API key. Defaults to the 'api_key' environment variable.
+        on_result (callable, optional): Called with the index and ComparisonResult (or None) of each section
+            as soon as its result is known, cached results first.
+        priority (callable, optional): Returns the index of the section to compare next, or None. It is
+            polled whenever a request slot frees up, so the answer may change while the comparison runs.
+        **engine_options: Further keyword arguments for ConcurrentComparisonEngine.
+
+    Returns:
+        list: A ComparisonResult or None for each section pair, in order.
+    """
+    results = [None] * len(section_pairs)
+    cache_keys = [None] * len(section_pairs)
+    pending_indexes = []
+
+    # Answer repeated comparisons from the cache
+    for index, (new_text, old_text) in enumerate(section_pairs):
+        if cache is not None:
+            cache_keys[index] = cache.make_key(new_text, old_text, PROMPT_VERSION, DEPLOYMENT_NAME)
+            cached_result = cache.get(cache_keys[index])
+            if cached_result is not None:
+                results[index] = ComparisonResult.model_validate(cached_result)
+                if on_result is not None:
+                    on_result(index, results[index])
+                continue
+        pending_indexes.append(index)
+
+    if pending_indexes:
+        pending_position = {index: position for position, index in enumerate(pending_indexes)}
+        start_time = time.perf_counter()
+        pending_results = asyncio.run(compare_sections_async(
+            [section_pairs[index] for index in pending_indexes],
+            max_concurrency=max_concurrency,
+            azure_endpoint=azure_endpoint,
+            azure_api_key=azure_api_key,
+            on_result=(lambda pending_index, result: on_result(pending_indexes[pending_index], result)) if on_result is not None else None,
+            priority=(lambda: pending_position.get(priority())) if priority is not None else None,
+            **engine_options))
+        logger.info(f"Compared {len(pending_indexes)} sections in {time.perf_counter() - start_time:.1f}s with up to {max_concurrency} concurrent requests")
+
+        for index, result in zip(pending_indexes, pending_results):
+            results[index] = result
+            if cache is not None and result is not None:
+                cache.set(cache_keys[index], result.model_dump())
+
+    return results
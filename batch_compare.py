@@ -0,0 +1,389 @@
+# Import necessary libraries and modules
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app import (get_mongodb_connection, get_file_pairs_from_excel, get_version_series_from_excel, get_pdf_paths_by_name, get_file_paths_from_pair,
+                 get_cleaned_text_from_mongodb, find_section_wise_differences_in_heading_trees, is_pair_completed)
+from section_alignment import build_heading_tree
+from version_series import compare_version_series, get_series_pairs
+from comparison_jobs import prepare_document
+from section_processing import get_file_content_hash
+from comparison_cache import ComparisonCache
+from llm_gateway import get_gateway
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Load environment variables from .env file
+uri = os.getenv('uri')
+# Number of pairs compared at once by the batch command
+batch_workers = int(os.getenv('batch_workers', 2))
+# Number of documents extracted and cleaned at once by the batch command
+batch_prepare_workers = int(os.getenv('batch_prepare_workers', 4))
+
+
+# Function to resolve the comparisons of a batch to their files
+def plan_batch(comparisons_list, pdf_paths):
+    """
+    Resolves the file names of every comparison to PDF paths and drops repeated comparisons.
+
+    Args:
+        comparisons_list (list): The file names of each comparison, from newest to oldest: pairs as returned by
+            get_file_pairs_from_excel or version series as returned by get_version_series_from_excel.
+        pdf_paths (dict): PDF paths by base name, as returned by get_pdf_paths_by_name.
+
+    Returns:
+        tuple: The planned comparisons, each a dictionary with the 'file_names' and 'file_paths', and the
+            comparisons that could not be resolved, each with its 'file_names' and 'error'.
+    """
+    planned_comparisons = []
+    unresolved_comparisons = []
+    seen_comparisons = set()
+    for comparison in comparisons_list:
+        file_names = tuple(os.path.splitext(os.path.basename(str(file_name)))[0] for file_name in comparison)
+        if file_names in seen_comparisons:
+            continue
+        seen_comparisons.add(file_names)
+        try:
+            file_paths = get_file_paths_from_pair(comparison, pdf_paths)
+        except FileNotFoundError as e:
+            unresolved_comparisons.append({"file_names": file_names, "error": str(e)})
+            continue
+        planned_comparisons.append({"file_names": file_names, "file_paths": file_paths})
+    return planned_comparisons, unresolved_comparisons
+
+
+# Function to build the dependency graph of a batch
+def build_batch_graph(planned_pairs):
+    """
+    Collects the unique documents of a batch and the comparisons that depend on each of them.
+
+    Args:
+        planned_pairs (list): The comparisons as returned by plan_batch.
+
+    Returns:
+        dict: For each document name, in order of first appearance, its 'file_path' and the positions of the
+            comparisons ('pairs') it belongs to.
+    """
+    documents = {}
+    for index, planned_pair in enumerate(planned_pairs):
+        for file_name, file_path in zip(planned_pair["file_names"], planned_pair["file_paths"]):
+            document = documents.setdefault(file_name, {"file_path": file_path, "pairs": []})
+            if index not in document["pairs"]:
+                document["pairs"].append(index)
+    return documents
+
+
+# Function to order the documents of a batch for preparation
+def order_documents(documents, planned_pairs):
+    """
+    Orders the documents so that pairs become ready for comparison as early as possible.
+
+    Each step picks the document that completes the most pairs whose other documents come earlier,
+    then the one shared by the most pairs, then the one listed first. A series of versions is thus
+    prepared version by version, and each prepared version immediately releases a comparison.
+
+    Args:
+        documents (dict): The documents as returned by build_batch_graph.
+        planned_pairs (list): The comparisons as returned by plan_batch.
+
+    Returns:
+        list: The document names in the order they should be prepared.
+    """
+    first_position = {file_name: position for position, file_name in enumerate(documents)}
+    ordered = []
+    scheduled = set()
+    while len(ordered) < len(documents):
+        def score(file_name):
+            completed_pairs = sum(all(other == file_name or other in scheduled for other in planned_pairs[index]["file_names"])
+                                  for index in documents[file_name]["pairs"])
+            return completed_pairs, len(documents[file_name]["pairs"]), -first_position[file_name]
+        file_name = max((name for name in documents if name not in scheduled), key=score)
+        ordered.append(file_name)
+        scheduled.add(file_name)
+    return ordered
+
+
+class BatchComparison:
+    """
+    Compares the pairs of a batch, preparing every document only once.
+
+    The batch is scheduled from the graph of its documents and pairs: each unique document is extracted,
+    cleaned and parsed into its heading tree once, and each pair is compared as soon as both its documents
+    are ready. A prepared document is kept in memory until the last of its pairs has been compared.
+
+    In version-series mode a row with three versions is compared as one series (see version_series.py),
+    which derives most of its newest-to-oldest comparison from the two adjacent ones.
+
+    Attributes:
+        database: The 'capstone_db' database.
+        workers (int): Number of pairs compared at once.
+        prepare_workers (int): Number of documents prepared at once.
+        comparison_cache (ComparisonCache | None): Cache of section comparisons shared by all pairs.
+        resume (bool): Skip completed pairs and continue interrupted ones from their stored sections.
+        prepare_seconds (dict): Seconds spent preparing each document of the last run.
+    """
+
+    def __init__(self, database, workers=batch_workers, prepare_workers=batch_prepare_workers, comparison_cache=None, resume=True):
+        """
+        Initializes the batch.
+
+        Args:
+            database: The 'capstone_db' database.
+            workers (int): Number of pairs compared at once.
+            prepare_workers (int): Number of documents prepared at once.
+            comparison_cache (ComparisonCache, optional): Cache of section comparisons shared by all pairs. Defaults to None.
+            resume (bool): Skip completed pairs and continue interrupted ones. When False, stored results are discarded.
+        """
+        self.database = database
+        self.workers = workers
+        self.prepare_workers = prepare_workers
+        self.comparison_cache = comparison_cache
+        self.resume = resume
+        self.prepare_seconds = {}
+
+    def load_document(self, file_path):
+        """
+        Extracts and cleans a document unless it is already stored, then builds its heading tree.
+
+        Args:
+            file_path (str): Path to the PDF file.
+
+        Returns:
+            dict: The 'heading_tree' and 'cleaned_text' of the document and the 'seconds' spent preparing it.
+        """
+        start_time = time.perf_counter()
+        file_name = os.path.splitext(os.path.basename(file_path))[0]
+        prepare_document(file_path, self.database)
+        adobe_json = self.database['adobe_api_json_outputs'].find_one({'file_name': file_name})
+        cleaned_text = get_cleaned_text_from_mongodb(file_name, self.database['documents_data'])
+        return {"heading_tree": build_heading_tree(adobe_json, cleaned_text), "cleaned_text": cleaned_text,
+                "seconds": time.perf_counter() - start_time}
+
+    def compare_pair(self, planned_pair, prepared_documents):
+        """
+        Aligns and compares the sections of a pair or series of prepared documents, storing each section as it completes.
+
+        Args:
+            planned_pair (dict): The pair or series as returned by plan_batch.
+            prepared_documents (list): The documents as returned by load_document, from newest to oldest.
+
+        Returns:
+            tuple: The number of sections stored, the number derived from adjacent versions and the seconds spent comparing.
+        """
+        start_time = time.perf_counter()
+        file_names = planned_pair["file_names"]
+        if len(file_names) > 2:
+            series_counts = compare_version_series(file_names, [document["heading_tree"] for document in prepared_documents],
+                                                   [document["cleaned_text"] for document in prepared_documents],
+                                                   self.database['sections_data'], self.comparison_cache)
+            return series_counts["sections"], series_counts["derived_sections"], time.perf_counter() - start_time
+
+        new_document, old_document = prepared_documents
+        sections_data = find_section_wise_differences_in_heading_trees(
+            file_names, new_document["heading_tree"], old_document["heading_tree"], new_document["cleaned_text"], old_document["cleaned_text"],
+            self.database['sections_data'], self.comparison_cache)
+        stored_pair = sections_data.find_one({'file_pair': f"{file_names[0]}_{file_names[1]}"}, {'_id': 0, 'sections.compared': 1}) or {}
+        return len(stored_pair.get('sections', [])), 0, time.perf_counter() - start_time
+
+    def run(self, planned_pairs):
+        """
+        Runs the batch over the planned pairs and series.
+
+        Args:
+            planned_pairs (list): The comparisons as returned by plan_batch.
+
+        Returns:
+            list: The outcome of each comparison: its 'file_names', 'status' ('completed', 'skipped' or 'failed'),
+                'sections', 'derived_sections', 'compare_seconds' and 'error'.
+        """
+        sections_data = self.database['sections_data']
+        outcomes = []
+        pending_pairs = []
+        content_hashes = {}
+        for planned_pair in planned_pairs:
+            file_names = planned_pair["file_names"]
+            stored_pairs = get_series_pairs(file_names)
+            if not self.resume:
+                sections_data.delete_many({'file_pair': {'$in': [f"{new_name}_{old_name}" for new_name, old_name in stored_pairs]}})
+                pending_pairs.append(planned_pair)
+                continue
+            # A pair counts as compared only for the current content of its files, since a changed file is extracted again
+            for file_name, file_path in zip(file_names, planned_pair["file_paths"]):
+                if file_name not in content_hashes:
+                    content_hashes[file_name] = get_file_content_hash(file_path)
+            if all(is_pair_completed(file_pair, sections_data, [content_hashes[file_name] for file_name in file_pair]) for file_pair in stored_pairs):
+                logger.info(f"Skipping {'_'.join(file_names)}: already compared")
+                outcomes.append({"file_names": file_names, "status": "skipped", "sections": 0, "derived_sections": 0,
+                                 "compare_seconds": 0.0, "error": None})
+                continue
+            pending_pairs.append(planned_pair)
+
+        # Only the documents of comparisons still to run are prepared
+        documents = build_batch_graph(pending_pairs)
+        missing_inputs = [len(set(planned_pair["file_names"])) for planned_pair in pending_pairs]
+        remaining_pairs = {file_name: len(document["pairs"]) for file_name, document in documents.items()}
+        prepared_documents = {}
+        finished_pairs = set()
+        self.prepare_seconds = {}
+        logger.info(f"Scheduling {len(pending_pairs)} comparisons over {len(documents)} unique documents")
+
+        def finish_pair(index, status, sections=0, derived_sections=0, compare_seconds=0.0, error=None):
+            finished_pairs.add(index)
+            outcomes.append({"file_names": pending_pairs[index]["file_names"], "status": status, "sections": sections,
+                             "derived_sections": derived_sections, "compare_seconds": compare_seconds, "error": error})
+            # Release the documents no remaining comparison needs, and skip preparing those still queued
+            for file_name in set(pending_pairs[index]["file_names"]):
+                remaining_pairs[file_name] -= 1
+                if remaining_pairs[file_name] == 0:
+                    prepared_documents.pop(file_name, None)
+                    if file_name in document_futures and document_futures[file_name].cancel():
+                        logger.info(f"Skipped preparing {file_name}: none of its comparisons are left")
+
+        with ThreadPoolExecutor(max_workers=self.prepare_workers, thread_name_prefix="prepare") as prepare_executor, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compare") as compare_executor:
+            document_futures = {file_name: prepare_executor.submit(self.load_document, documents[file_name]["file_path"])
+                                for file_name in order_documents(documents, pending_pairs)}
+            futures = {future: ("document", file_name) for file_name, future in document_futures.items()}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, key = futures.pop(future)
+                    if future.cancelled():
+                        continue
+                    if kind == "document":
+                        try:
+                            prepared_document = future.result()
+                        except Exception as e:
+                            logger.error(f"Failed to prepare {key}: {e}")
+                            for index in documents[key]["pairs"]:
+                                if index not in finished_pairs:
+                                    finish_pair(index, "failed", error=f"Failed to prepare {key}: {e}")
+                            continue
+                        self.prepare_seconds[key] = prepared_document["seconds"]
+                        # Keep the document only if a comparison still needs it; its partners may have failed meanwhile
+                        if remaining_pairs[key] == 0:
+                            continue
+                        prepared_documents[key] = prepared_document
+                        # Fan out the comparisons whose other documents are already prepared
+                        for index in documents[key]["pairs"]:
+                            missing_inputs[index] -= 1
+                            if missing_inputs[index] == 0 and index not in finished_pairs:
+                                futures[compare_executor.submit(self.compare_pair, pending_pairs[index],
+                                                                [prepared_documents[file_name] for file_name in pending_pairs[index]["file_names"]])] = ("pair", index)
+                    else:
+                        comparison_name = "_".join(pending_pairs[key]["file_names"])
+                        try:
+                            sections, derived_sections, compare_seconds = future.result()
+                        except Exception as e:
+                            logger.error(f"Failed to compare {comparison_name}: {e}")
+                            finish_pair(key, "failed", error=str(e))
+                            continue
+                        logger.info(f"Compared {comparison_name}: {sections} sections in {compare_seconds:.1f}s")
+                        finish_pair(key, "completed", sections, derived_sections, compare_seconds)
+        return outcomes
+
+
+# Function to summarize the throughput of a batch
+def summarize_batch(outcomes, elapsed_seconds, prepare_seconds, comparison_cache=None):
+    """
+    Summarizes the outcomes and throughput of a batch.
+
+    Args:
+        outcomes (list): The outcome of each pair, as returned by BatchComparison.run.
+        elapsed_seconds (float): Wall-clock duration of the batch.
+        prepare_seconds (dict): Seconds spent preparing each document, as recorded by BatchComparison.run.
+        comparison_cache (ComparisonCache, optional): Cache used by the batch, to report its hit rate. Defaults to None.
+
+    Returns:
+        dict: Pair and document counts, compared sections, stage times, throughput, cache statistics and model usage.
+    """
+    completed = [outcome for outcome in outcomes if outcome["status"] == "completed"]
+    sections = sum(outcome["sections"] for outcome in completed)
+    return {
+        "pairs": len(outcomes),
+        "completed": len(completed),
+        "skipped": sum(outcome["status"] == "skipped" for outcome in outcomes),
+        "failed": [outcome for outcome in outcomes if outcome["status"] == "failed"],
+        "documents": len(prepare_seconds),
+        "sections": sections,
+        "derived_sections": sum(outcome["derived_sections"] for outcome in completed),
+        "elapsed_seconds": elapsed_seconds,
+        "prepare_seconds": sum(prepare_seconds.values()),
+        "compare_seconds": sum(outcome["compare_seconds"] for outcome in outcomes),
+        "pairs_per_minute": len(completed) * 60 / elapsed_seconds if elapsed_seconds else 0.0,
+        "sections_per_second": sections / elapsed_seconds if elapsed_seconds else 0.0,
+        "cache": comparison_cache.stats() if comparison_cache is not None else None,
+        "model_calls": get_gateway().metrics_summary()
+    }
+
+
+# Function to format the summary of a batch
+def format_batch_summary(summary):
+    """
+    Formats the summary of a batch for the console.
+
+    Args:
+        summary (dict): The summary as returned by summarize_batch.
+
+    Returns:
+        str: The summary text.
+    """
+    lines = [
+        f"Comparisons: {summary['pairs']} ({summary['completed']} compared, {summary['skipped']} already compared, {len(summary['failed'])} failed)",
+        f"Documents prepared: {summary['documents']}, sections compared: {summary['sections']} "
+        f"({summary['derived_sections']} derived from adjacent versions without a model call)",
+        f"Elapsed: {summary['elapsed_seconds']:.1f}s (preparing {summary['prepare_seconds']:.1f}s summed over documents, "
+        f"comparing {summary['compare_seconds']:.1f}s summed over comparisons)",
+        f"Throughput: {summary['pairs_per_minute']:.2f} comparisons/min, {summary['sections_per_second']:.2f} sections/s"
+    ]
+    if summary["cache"] is not None:
+        lines.append(f"Comparison cache: {summary['cache']['hits']} hits, {summary['cache']['misses']} misses, hit rate {summary['cache']['hit_rate']:.0%}")
+    for operation, operation_summary in summary["model_calls"].items():
+        lines.append(f"Model calls ({operation}): {operation_summary['calls']} calls, {operation_summary['failures']} failed, "
+                     f"p95 latency {operation_summary['p95_latency_seconds']:.2f}s")
+    for outcome in summary["failed"]:
+        lines.append(f"Failed: {'_'.join(outcome['file_names'])}: {outcome['error']}")
+    return "\n".join(lines)
+
+
+# Main execution logic for the batch comparison
+def main():
+    """
+    Compares the file pairs listed in an Excel sheet and prints a throughput summary.
+    """
+    parser = argparse.ArgumentParser(description="Compare the file pairs listed in an Excel sheet section by section.")
+    parser.add_argument("excel_path", help="Excel sheet with 'new_version', 'old_version' and 'old_version_1' columns")
+    parser.add_argument("root_folder", help="Folder searched recursively for the PDF files named in the sheet")
+    parser.add_argument("--workers", type=int, default=batch_workers, help="Number of pairs compared at once")
+    parser.add_argument("--prepare-workers", type=int, default=batch_prepare_workers, help="Number of documents extracted, cleaned and parsed at once")
+    parser.add_argument("--version-series", action="store_true",
+                        help="Compare rows with three versions as one series, deriving most of the newest-to-oldest comparison from the adjacent ones")
+    parser.add_argument("--no-resume", action="store_true", help="Discard stored results and compare every pair from the start")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client, capstone_db = get_mongodb_connection(uri)
+    comparison_cache = ComparisonCache(capstone_db['comparison_cache'])
+
+    comparisons_list = get_version_series_from_excel(args.excel_path) if args.version_series else get_file_pairs_from_excel(args.excel_path)
+    planned_pairs, unresolved_pairs = plan_batch(comparisons_list, get_pdf_paths_by_name(args.root_folder))
+    logger.info(f"Planned {len(planned_pairs)} comparisons, {len(unresolved_pairs)} could not be resolved")
+
+    # Report cache hits and model calls for this batch only
+    comparison_cache.reset_stats()
+    get_gateway().reset_metrics()
+    start_time = time.perf_counter()
+    batch = BatchComparison(capstone_db, args.workers, args.prepare_workers, comparison_cache, resume=not args.no_resume)
+    outcomes = batch.run(planned_pairs)
+    outcomes += [{"file_names": pair["file_names"], "status": "failed", "sections": 0, "derived_sections": 0,
+                  "compare_seconds": 0.0, "error": pair["error"]} for pair in unresolved_pairs]
+    print(format_batch_summary(summarize_batch(outcomes, time.perf_counter() - start_time, batch.prepare_seconds, comparison_cache)))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Import necessary libraries and modules
+import os
+import time
+import argparse
+from mock_openai_server import MockOpenAIServer, LatencyModel, LATENCY_DISTRIBUTIONS
+
+
+# Main execution logic for the benchmark
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent section comparison against a local mock endpoint.")
+    parser.add_argument("--sections", type=int, default=60, help="Number of section pairs to compare")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="uniform", help="Latency distribution of the mock endpoint")
+    parser.add_argument("--latency-mean", type=float, default=0.3, help="Mean injected latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.1, help="Half-width (uniform) or standard deviation (normal, lognormal) in seconds")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="Probability of an injected 429 answer")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After in seconds sent with injected 429 answers")
+    parser.add_argument("--pack", action="store_true", help="Pack small sections into shared requests")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16], help="Concurrency levels to measure")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latency and 429 answers")
+    args = parser.parse_args()
+
+    # The shared gateway is created on import and needs credentials; the requests themselves go to each mock endpoint
+    os.environ.setdefault("endpoint", "http://127.0.0.1")
+    os.environ.setdefault("api_key", "mock-key")
+    from async_comparison import compare_sections_concurrently, PACK_TOKEN_BUDGET
+
+    section_pairs = [(f"New text of section {index} with a revised value {index + 1}", f"Old text of section {index} with a value {index}")
+                     for index in range(args.sections)]
+
+    for max_concurrency in args.concurrency:
+        # Start a fresh, identically seeded endpoint so every level sees the same latencies and 429s
+        with MockOpenAIServer(latency_model=LatencyModel(args.latency, args.latency_mean, args.latency_spread, args.seed),
+                              rate_limit_probability=args.rate_limit_probability, retry_after_seconds=args.retry_after,
+                              seed=args.seed) as server:
+            start_time = time.perf_counter()
+            results = compare_sections_concurrently(section_pairs, max_concurrency=max_concurrency, azure_endpoint=server.url,
+                                                    azure_api_key="mock-key", pack_token_budget=PACK_TOKEN_BUDGET if args.pack else 0,
+                                                    requests_per_minute=100000, tokens_per_minute=10 ** 9)
+            elapsed = time.perf_counter() - start_time
+            completed = sum(result is not None for result in results)
+            print(f"concurrency={max_concurrency:<3} sections={args.sections} completed={completed} "
+                  f"requests={server.stats['requests']} rate_limited={server.stats['rate_limited']} "
+                  f"elapsed={elapsed:.2f}s throughput={args.sections / elapsed:.1f} sections/s")
@@ -0,0 +1,153 @@
+# Import necessary libraries and modules
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timezone
+from benchmarks.synthetic_corpus import generate_pair
+from mock_openai_server import MockOpenAIServer, LatencyModel, LATENCY_DISTRIBUTIONS
+
+
+# Function to time a pipeline stage
+def time_stage(function, repeats):
+    """
+    Runs a stage several times and measures each run.
+
+    Args:
+        function (callable): The stage, called without arguments.
+        repeats (int): Number of timed runs.
+
+    Returns:
+        tuple: The timings in seconds and the result of the last run.
+    """
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return timings, result
+
+
+# Function to summarize the timings of a stage
+def summarize_timings(stage, timings, **details):
+    """
+    Summarizes the timings of a stage for the results file.
+
+    Args:
+        stage (str): Name of the stage.
+        timings (list): Timings in seconds.
+        **details: Further values to record with the stage, such as the number of sections.
+
+    Returns:
+        dict: The stage with its median, minimum and maximum time and all timings.
+    """
+    return {
+        "stage": stage,
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "max_seconds": max(timings),
+        "timings": timings,
+        **details
+    }
+
+
+# Function to benchmark the pipeline on one synthetic document pair
+def benchmark_pair(pair, repeats, max_concurrency):
+    """
+    Times every stage of the pipeline on a synthetic document pair.
+
+    Args:
+        pair (dict): The pair as returned by generate_pair.
+        repeats (int): Number of timed runs of each local stage.
+        max_concurrency (int): Maximum number of comparison requests in flight at once.
+
+    Returns:
+        list: The summarized timings of each stage.
+    """
+    # Imported here so they pick up the mock endpoint set in the environment
+    from app import get_section_headings_and_processing, get_section_texts, get_differences_between_sections, reconstruct_document_exclude_toc
+    from section_alignment import get_hierarchical_section_texts
+    from section_processing import extract_page_texts, detect_repeated_headers_footers
+
+    with open(pair["new_json"], "r", encoding="utf-8") as file:
+        new_file_json = json.load(file)
+    with open(pair["old_json"], "r", encoding="utf-8") as file:
+        old_file_json = json.load(file)
+    cleaned_text_new = reconstruct_document_exclude_toc(pair["new_json"])
+    cleaned_text_old = reconstruct_document_exclude_toc(pair["old_json"])
+
+    stages = []
+    timings, (page_texts, total_pages) = time_stage(lambda: extract_page_texts(pair["new_pdf"]), repeats)
+    stages.append(summarize_timings("extract_page_texts", timings, pages=total_pages))
+
+    timings, (headers, footers) = time_stage(lambda: detect_repeated_headers_footers(page_texts), repeats)
+    stages.append(summarize_timings("detect_repeated_headers_footers", timings, headers=len(headers), footers=len(footers)))
+
+    timings, headings = time_stage(lambda: get_section_headings_and_processing(new_file_json, old_file_json), repeats)
+    stages.append(summarize_timings("get_section_headings_and_processing", timings, headings=len(headings[0])))
+
+    timings, list_of_section_texts = time_stage(lambda: get_section_texts(*headings, cleaned_text_new, cleaned_text_old), repeats)
+    stages.append(summarize_timings("get_section_texts", timings, sections=len(list_of_section_texts)))
+
+    timings, hierarchical_section_texts = time_stage(
+        lambda: get_hierarchical_section_texts(new_file_json, old_file_json, cleaned_text_new, cleaned_text_old), repeats)
+    stages.append(summarize_timings("get_hierarchical_section_texts", timings, sections=len(hierarchical_section_texts)))
+
+    # The comparison appends its results to the sections, so it is run once on a copy
+    timings, compared_sections = time_stage(
+        lambda: get_differences_between_sections([list(section_text) for section_text in list_of_section_texts],
+                                                 max_concurrency=max_concurrency), 1)
+    stages.append(summarize_timings("get_differences_between_sections", timings, sections=len(compared_sections),
+                                    failed_sections=sum(section_text[4] is None for section_text in compared_sections)))
+    return stages
+
+
+# Main execution logic for the benchmark
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic versioned PDF pairs.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 80], help="Document sizes in pages")
+    parser.add_argument("--heading-depth", type=int, default=3, help="Deepest heading level of the documents")
+    parser.add_argument("--edit-rate", type=float, default=0.05, help="Probability that a paragraph is edited in the new version")
+    parser.add_argument("--no-repeated-headers", action="store_true", help="Write the documents without repeated headers and footers")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs of each local stage")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum comparison requests in flight at once")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="uniform", help="Latency distribution of the mock endpoint")
+    parser.add_argument("--latency-mean", type=float, default=0.3, help="Mean injected latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.1, help="Half-width (uniform) or standard deviation (normal, lognormal) in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of the mock endpoint")
+    parser.add_argument("--corpus-dir", default=None, help="Directory to keep the generated corpus in. Defaults to a temporary directory")
+    parser.add_argument("--output", default="bench_pipeline_results.json", help="Path of the JSON results file")
+    args = parser.parse_args()
+
+    with MockOpenAIServer(latency_model=LatencyModel(args.latency, args.latency_mean, args.latency_spread, args.seed), seed=args.seed) as server, \
+            tempfile.TemporaryDirectory() as temporary_dir:
+        # Point the shared gateway at the mock endpoint
+        os.environ["endpoint"] = server.url
+        os.environ["api_key"] = "mock-key"
+
+        results = []
+        for pages in args.pages:
+            pair = generate_pair(args.corpus_dir or temporary_dir, pages, args.heading_depth, args.edit_rate,
+                                 repeated_headers=not args.no_repeated_headers, seed=args.seed)
+            requests_before = server.stats["requests"]
+            stages = benchmark_pair(pair, args.repeats, args.concurrency)
+            results.append({"pages": pair["new_pages"], "requested_pages": pages, "mock_requests": server.stats["requests"] - requests_before,
+                            "stages": stages})
+            for stage in stages:
+                print(f"pages={pair['new_pages']:<4} {stage['stage']:<36} median={stage['median_seconds']:.4f}s")
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
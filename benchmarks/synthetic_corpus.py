@@ -0,0 +1,189 @@
+# Import necessary libraries and modules
+import os
+import json
+import random
+import textwrap
+import fitz  # PyMuPDF for writing the synthetic PDFs
+
+# Vocabulary of the generated requirement text
+WORDS = (
+    "steering system shall provide torque assist within the specified tolerance when the vehicle speed "
+    "exceeds threshold column motor sensor signal controller module supplier validate test report "
+    "temperature range voltage current fault detection response time calibration requirement interface"
+).split()
+# Layout of the generated pages
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 54
+LINE_HEIGHT = 14
+FONT_SIZE = 10
+CHARACTERS_PER_LINE = 95
+# Body lines per page between the repeated header and footer
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN - 4 * LINE_HEIGHT) // LINE_HEIGHT
+
+
+# Function to generate a sentence of requirement text
+def generate_sentence(rng, min_words=8, max_words=20):
+    """
+    Generates a random sentence from the requirement vocabulary.
+
+    Args:
+        rng (random.Random): The random generator.
+        min_words (int): Minimum number of words.
+        max_words (int): Maximum number of words.
+
+    Returns:
+        str: The sentence.
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+
+# Function to generate the elements of a synthetic document
+def generate_document_elements(pages, heading_depth=3, seed=0):
+    """
+    Generates the elements of a document in the Adobe PDF Extract 'structuredData' format.
+
+    The document starts with a table of contents and continues with numbered H1 to H<heading_depth>
+    sections, each followed by a few paragraphs, until the body fills roughly the requested pages.
+
+    Args:
+        pages (int): Approximate number of pages of the document.
+        heading_depth (int): Deepest heading level, between 1 and 6.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Elements with 'Path', 'Text' and 'Page' keys, in reading order.
+    """
+    rng = random.Random(seed)
+    body_elements = []
+    section_numbers = [0] * heading_depth
+    target_lines = pages * LINES_PER_PAGE
+    used_lines = 0
+    level = 1
+    while used_lines < target_lines:
+        # Number the heading like "2.3.1" and reset the deeper counters
+        section_numbers[level - 1] += 1
+        section_numbers[level:] = [0] * (heading_depth - level)
+        number = ".".join(str(value) for value in section_numbers[:level])
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+        body_elements.append({"Path": f"//Document/H{level}", "Text": f"{number} {title} "})
+        used_lines += 2
+        for _ in range(rng.randint(1, 4)):
+            paragraph = " ".join(generate_sentence(rng) for _ in range(rng.randint(2, 5)))
+            body_elements.append({"Path": "//Document/P", "Text": paragraph + " "})
+            used_lines += len(textwrap.wrap(paragraph, CHARACTERS_PER_LINE)) + 1
+        # Go one level deeper, stay, or climb back up
+        level = max(1, min(heading_depth, level + rng.choice((-1, 0, 1))))
+
+    # The table of contents lists the top-level sections
+    toc_elements = [{"Path": "//Document/TOC/TOCI", "Text": f"{element['Text'].strip()} ........ "}
+                    for element in body_elements if element["Path"].endswith("/H1")]
+    return [{"Path": "//Document/Title", "Text": "Synthetic Steering System Requirements "}] + toc_elements + body_elements
+
+
+# Function to derive a new version of a synthetic document
+def apply_edits(elements, edit_rate=0.05, seed=0):
+    """
+    Derives a new version of a document by modifying, inserting and deleting paragraphs.
+
+    Args:
+        elements (list): Elements of the old version.
+        edit_rate (float): Probability that a paragraph is edited.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Elements of the new version.
+    """
+    rng = random.Random(seed + 1)
+    edited_elements = []
+    for element in elements:
+        if element["Path"] != "//Document/P" or rng.random() >= edit_rate:
+            edited_elements.append(dict(element))
+            continue
+        edit = rng.choice(("modify", "insert", "delete"))
+        if edit == "modify":
+            sentences = element["Text"].strip().split(". ")
+            sentences[rng.randrange(len(sentences))] = generate_sentence(rng).rstrip(".")
+            edited_elements.append({**element, "Text": ". ".join(sentences) + " "})
+        elif edit == "insert":
+            edited_elements.append(dict(element))
+            edited_elements.append({"Path": "//Document/P", "Text": generate_sentence(rng) + " "})
+    return edited_elements
+
+
+# Function to write a synthetic document as a PDF
+def write_pdf(elements, pdf_path, header_text="Nexteer Automotive - Synthetic Specification", footer_text="Confidential - For benchmark use only"):
+    """
+    Writes document elements into a PDF with repeated headers, footers and page numbers.
+
+    The page of every element is recorded in its 'Page' key, as in the Adobe output.
+
+    Args:
+        elements (list): Elements of the document.
+        pdf_path (str): Path of the PDF to write.
+        header_text (str | None): Header repeated on every page, or None for no header.
+        footer_text (str | None): Footer repeated on every page, or None for no footer.
+
+    Returns:
+        int: The number of pages written.
+    """
+    doc = fitz.open()
+    page = None
+    y = PAGE_HEIGHT
+
+    def new_page():
+        new = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if header_text:
+            new.insert_text((MARGIN, MARGIN), header_text, fontsize=FONT_SIZE)
+        if footer_text:
+            new.insert_text((MARGIN, PAGE_HEIGHT - MARGIN), footer_text, fontsize=FONT_SIZE)
+        new.insert_text((PAGE_WIDTH - 2 * MARGIN, PAGE_HEIGHT - MARGIN), f"Page {len(doc)}", fontsize=FONT_SIZE)
+        return new, MARGIN + 2 * LINE_HEIGHT
+
+    for element in elements:
+        lines = textwrap.wrap(element["Text"].strip(), CHARACTERS_PER_LINE) or [""]
+        for line in lines + [""]:
+            if page is None or y > PAGE_HEIGHT - MARGIN - 2 * LINE_HEIGHT:
+                page, y = new_page()
+            page.insert_text((MARGIN, y), line, fontsize=FONT_SIZE)
+            y += LINE_HEIGHT
+        element["Page"] = len(doc) - 1
+
+    doc.save(pdf_path)
+    page_count = len(doc)
+    doc.close()
+    return page_count
+
+
+# Function to generate a versioned pair of synthetic documents
+def generate_pair(output_dir, pages, heading_depth=3, edit_rate=0.05, repeated_headers=True, seed=0):
+    """
+    Generates an old and a new version of a synthetic document as PDFs with matching Adobe-style JSON.
+
+    Args:
+        output_dir (str): Directory to write the files to.
+        pages (int): Approximate number of pages of each document.
+        heading_depth (int): Deepest heading level, between 1 and 6.
+        edit_rate (float): Probability that a paragraph is edited in the new version.
+        repeated_headers (bool): Repeat a header and footer on every page.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: Paths of the 'new_pdf', 'old_pdf', 'new_json' and 'old_json' files and their page counts.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    old_elements = generate_document_elements(pages, heading_depth, seed)
+    new_elements = apply_edits(old_elements, edit_rate, seed)
+    header_footer = {} if repeated_headers else {"header_text": None, "footer_text": None}
+
+    pair = {}
+    for version, elements in (("new", new_elements), ("old", old_elements)):
+        base_name = f"synthetic_{pages}p_d{heading_depth}_{version}"
+        pdf_path = os.path.join(output_dir, f"{base_name}.pdf")
+        json_path = os.path.join(output_dir, f"{base_name}.json")
+        pair[f"{version}_pages"] = write_pdf(elements, pdf_path, **header_footer)
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump({"elements": elements}, file)
+        pair[f"{version}_pdf"] = pdf_path
+        pair[f"{version}_json"] = json_path
+    return pair
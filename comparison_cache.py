@@ -0,0 +1,166 @@
+# Import necessary libraries and modules
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING
+
+# Default lifetime of a cached comparison
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+# Default maximum number of cached comparisons kept in the collection
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class ComparisonCache:
+    """
+    A persistent cache of LLM comparison results stored in a MongoDB collection.
+
+    Entries are keyed by a hash of the compared texts, the prompt version and the model deployment.
+    They expire after a time-to-live, and the least recently used entries are evicted once the
+    collection grows past its size bound.
+
+    Attributes:
+        db_collection: The MongoDB collection holding the cached results.
+        ttl_seconds (int): Lifetime of a cached result in seconds.
+        max_entries (int): Maximum number of cached results kept in the collection.
+        hits (int): Number of cache hits since the last reset.
+        misses (int): Number of cache misses since the last reset.
+    """
+
+    def __init__(self, db_collection, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initializes the cache on top of a MongoDB collection.
+
+        Args:
+            db_collection: The MongoDB collection to store the cached results in.
+            ttl_seconds (int): Lifetime of a cached result in seconds.
+            max_entries (int): Maximum number of cached results kept in the collection.
+        """
+        self.db_collection = db_collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._indexes_created = False
+        self._writes_since_eviction = 0
+
+    @staticmethod
+    def make_key(new_text, old_text, prompt_version, deployment):
+        """
+        Builds the cache key of a comparison.
+
+        Args:
+            new_text (str): The text from the new file.
+            old_text (str): The text from the old file.
+            prompt_version (str): Version of the prompt used for the comparison.
+            deployment (str): The model deployment used for the comparison.
+
+        Returns:
+            str: The SHA-256 hex digest identifying the comparison.
+        """
+        payload = json.dumps([new_text, old_text, prompt_version, deployment], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _ensure_indexes(self):
+        """
+        Creates the lookup, expiry and eviction indexes the first time the cache is used.
+        """
+        if self._indexes_created:
+            return
+        self.db_collection.create_index([("cache_key", ASCENDING)], unique=True)
+        # Let MongoDB remove entries once their expiry date has passed
+        self.db_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        self.db_collection.create_index([("last_accessed", ASCENDING)])
+        self._indexes_created = True
+
+    def get(self, cache_key):
+        """
+        Looks up a cached comparison result.
+
+        Args:
+            cache_key (str): The key returned by make_key.
+
+        Returns:
+            The cached result, or None if it is missing or expired.
+        """
+        self._ensure_indexes()
+        now = datetime.now(timezone.utc)
+        # Refresh the access time so the entry is not evicted while it is in use
+        entry = self.db_collection.find_one_and_update(
+            {"cache_key": cache_key, "expires_at": {"$gt": now}},
+            {"$set": {"last_accessed": now}, "$inc": {"hit_count": 1}}
+        )
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, cache_key, value):
+        """
+        Stores a comparison result.
+
+        Args:
+            cache_key (str): The key returned by make_key.
+            value: The JSON-serializable result to cache.
+        """
+        self._ensure_indexes()
+        now = datetime.now(timezone.utc)
+        self.db_collection.update_one(
+            {"cache_key": cache_key},
+            {
+                "$set": {
+                    "value": value,
+                    "last_accessed": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                },
+                "$setOnInsert": {"created_at": now, "hit_count": 0}
+            },
+            upsert=True
+        )
+        # Check the size bound periodically rather than on every write
+        with self._lock:
+            self._writes_since_eviction += 1
+            should_evict = self._writes_since_eviction >= 100
+            if should_evict:
+                self._writes_since_eviction = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the collection is within its size bound.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        excess = self.db_collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return 0
+        stale_ids = [entry["_id"] for entry in self.db_collection.find({}, {"_id": 1}).sort("last_accessed", ASCENDING).limit(excess)]
+        return self.db_collection.delete_many({"_id": {"$in": stale_ids}}).deleted_count
+
+    def stats(self):
+        """
+        Returns the hit statistics since the last reset.
+
+        Returns:
+            dict: The number of hits, misses and the hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def reset_stats(self):
+        """
+        Resets the hit statistics, e.g. at the start of a batch.
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,419 @@
+# Import necessary libraries and modules
+import os
+import time
+import uuid
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from adobe_PDF_extract_API import ExtractTextInfoFromPDF
+from app import upload_json_file_to_mongodb, find_section_wise_differences_in_files, is_pair_completed
+from section_processing import process_and_upload_pdf, get_content_hash
+from comparison_cache import ComparisonCache
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Load environment variables from .env file
+uri = os.getenv('uri')
+# Number of jobs run at once by a worker pool
+comparison_workers = int(os.getenv('comparison_workers', 2))
+
+# Name of the collection the comparison jobs are stored in
+JOBS_COLLECTION_NAME = "comparison_jobs"
+# Statuses of a job that is not finished yet
+ACTIVE_JOB_STATUSES = ("queued", "running")
+# A running job whose lease has expired is taken over by another worker
+JOB_LEASE_SECONDS = 900
+# Seconds an idle worker waits before looking for a new job
+POLL_INTERVAL_SECONDS = 2.0
+# Seconds a running job reuses the prioritized section before reading it again
+PRIORITY_REFRESH_SECONDS = 1.0
+
+
+# Function to create the indexes used by the job queue
+def create_job_indexes(jobs_collection):
+    """
+    Creates the index the workers use to claim the oldest available job.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+    """
+    jobs_collection.create_index([("status", ASCENDING), ("submitted_at", ASCENDING)])
+
+
+# Function to submit the comparison of a file pair
+def submit_comparison_job(jobs_collection, new_file_path, old_file_path, file_pair, retry=False, temporary_files=()):
+    """
+    Queues the comparison of a file pair, unless it is already queued, running or completed.
+
+    The job is identified by the file pair, so resubmitting after a browser refresh or from a second
+    session returns the existing job. A failed job keeps its error until it is explicitly retried.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        new_file_path (str): Path to the new file.
+        old_file_path (str): Path to the old file.
+        file_pair (str): Name of the file pair.
+        retry (bool): Queue the job again if it failed. Defaults to False.
+        temporary_files (iterable): Uploaded files written only for this job, deleted once it finishes.
+
+    Returns:
+        dict: The job.
+    """
+    job = {
+        "new_file_path": new_file_path,
+        "old_file_path": old_file_path,
+        "status": "queued",
+        "submitted_at": datetime.now(timezone.utc),
+        "started_at": None,
+        "finished_at": None,
+        "worker_id": None,
+        "lease_expires_at": None,
+        "stage": "queued",
+        "documents": {"new": "waiting", "old": "waiting"},
+        "completed_sections": 0,
+        "total_sections": None,
+        "priority_section": None,
+        "temporary_files": list(temporary_files),
+        "error": None
+    }
+    jobs_collection.update_one({"_id": file_pair}, {"$setOnInsert": job}, upsert=True)
+    if retry:
+        jobs_collection.update_one({"_id": file_pair, "status": "failed"}, {"$set": job})
+    return jobs_collection.find_one({"_id": file_pair})
+
+
+# Function to fetch a job
+def get_job(jobs_collection, file_pair):
+    """
+    Fetches the job of a file pair.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+
+    Returns:
+        dict | None: The job, or None if the pair was never submitted.
+    """
+    return jobs_collection.find_one({"_id": file_pair})
+
+
+# Function to claim the oldest available job
+def claim_next_job(jobs_collection, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+    """
+    Atomically claims the oldest queued job, or a running job whose worker stopped renewing its lease.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        worker_id (str): Identifier of the claiming worker.
+        lease_seconds (float): Seconds the claim holds without being renewed.
+
+    Returns:
+        dict | None: The claimed job, or None if no job is available.
+    """
+    now = datetime.now(timezone.utc)
+    return jobs_collection.find_one_and_update(
+        {"$or": [{"status": "queued"}, {"status": "running", "lease_expires_at": {"$lt": now}}]},
+        {"$set": {"status": "running", "worker_id": worker_id, "started_at": now, "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                  "completed_sections": 0}},
+        sort=[("submitted_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER)
+
+
+# Function to update the progress of a job
+def update_job(jobs_collection, file_pair, lease_seconds=JOB_LEASE_SECONDS, **fields):
+    """
+    Sets fields of a running job and renews its lease.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+        lease_seconds (float): Seconds the renewed claim holds.
+        **fields: Fields to set, such as the 'stage'.
+    """
+    lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    jobs_collection.update_one({"_id": file_pair}, {"$set": {**fields, "lease_expires_at": lease_expires_at}})
+
+
+# Function to record the number of compared sections of a job
+def record_section_progress(jobs_collection, file_pair, completed_sections, total_sections):
+    """
+    Records how many sections of a job are compared. The sections themselves are stored with the pair as they complete.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+        completed_sections (int): Number of sections compared so far.
+        total_sections (int): Number of sections of the pair.
+    """
+    update_job(jobs_collection, file_pair, completed_sections=completed_sections, total_sections=total_sections)
+
+
+# Function to move a section to the front of a running job
+def prioritize_section(jobs_collection, file_pair, index):
+    """
+    Asks the job of a pair to compare a section next, e.g. the one the user selected.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+        index (int | None): Position of the section in the pair, or None to keep document order.
+    """
+    jobs_collection.update_one({"_id": file_pair, "status": {"$in": list(ACTIVE_JOB_STATUSES)}}, {"$set": {"priority_section": index}})
+
+
+# Function to follow the prioritized section of a job
+def make_priority_reader(jobs_collection, file_pair, refresh_seconds=PRIORITY_REFRESH_SECONDS):
+    """
+    Creates a callable returning the section the job should compare next.
+
+    The comparison engine polls it each time a request slot frees up, so the stored value is read at
+    most once per refresh interval.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+        refresh_seconds (float): Seconds a read value is reused.
+
+    Returns:
+        callable: Returns the index of the prioritized section, or None.
+    """
+    state = {"index": None, "read_at": float("-inf")}
+
+    def read_priority():
+        if time.monotonic() - state["read_at"] >= refresh_seconds:
+            job = jobs_collection.find_one({"_id": file_pair}, {"priority_section": 1}) or {}
+            state["index"] = job.get("priority_section")
+            state["read_at"] = time.monotonic()
+        return state["index"]
+
+    return read_priority
+
+
+# Function to finish a job
+def finish_job(jobs_collection, file_pair, error=None):
+    """
+    Marks a job as completed, or as failed with its error.
+
+    Args:
+        jobs_collection: The MongoDB collection holding the jobs.
+        file_pair (str): Name of the file pair.
+        error (str, optional): The error that ended the job. Defaults to None.
+    """
+    jobs_collection.update_one(
+        {"_id": file_pair},
+        {"$set": {"status": "failed" if error else "completed", "stage": "failed" if error else "completed",
+                  "finished_at": datetime.now(timezone.utc), "lease_expires_at": None, "error": error}})
+
+
+# Function to delete the uploaded files of a finished job
+def remove_temporary_files(job):
+    """
+    Deletes the files written only for a job, and their directories once they are empty.
+
+    A failed job can still be retried: the upload is written again before the job is resubmitted.
+
+    Args:
+        job (dict): The finished job.
+    """
+    for file_path in job.get("temporary_files", []):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete {file_path}: {e}")
+            continue
+        # Uploads are saved as <upload directory>/<content hash>/<name>.pdf
+        for directory in (os.path.dirname(file_path), os.path.dirname(os.path.dirname(file_path))):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+
+
+# Function to prepare a document for comparison
+def prepare_document(file_path, database, on_stage=None):
+    """
+    Extracts a document with the Adobe API and processes its text, unless both are already stored for its content.
+
+    Args:
+        file_path (str): Path to the PDF file. For a document already resolved to stored content by its hash
+            (see section_processing.resolve_document_name) only the name is used, so it need not exist.
+        database: The 'capstone_db' database.
+        on_stage (callable, optional): Called with the name of each preparation stage as it starts.
+    """
+    report_stage = on_stage or (lambda stage: None)
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    if not os.path.exists(file_path):
+        in_adobe = database['adobe_api_json_outputs'].count_documents({"file_name": file_name}, limit=1) > 0
+        in_documents = database['documents_data'].count_documents({"file_name": file_name}, limit=1) > 0
+        if not (in_adobe and in_documents):
+            raise FileNotFoundError(f"{file_path} does not exist and is not stored")
+        report_stage("ready")
+        return
+
+    # Read the file once, identify it by its content and hand the bytes to both the Adobe API and PyMuPDF
+    with open(file_path, "rb") as file:
+        pdf_bytes = file.read()
+    content_hash = get_content_hash(pdf_bytes)
+    in_documents = database['documents_data'].count_documents({"file_name": file_name, "content_hash": content_hash}, limit=1) > 0
+    # The extraction stored under this name belongs to other content unless the processed text matches
+    in_adobe = in_documents and database['adobe_api_json_outputs'].count_documents({"file_name": file_name}, limit=1) > 0
+    if in_adobe and in_documents:
+        report_stage("ready")
+        return
+
+    if not in_adobe:
+        report_stage("extracting with the Adobe API")
+        json_path = ExtractTextInfoFromPDF(file_path, pdf_bytes).extract_text()
+        if json_path:
+            database['adobe_api_json_outputs'].delete_many({"file_name": file_name})
+            upload_json_file_to_mongodb(json_path, database['adobe_api_json_outputs'])
+    report_stage("cleaning text")
+    process_and_upload_pdf(file_path, pdf_bytes)
+    report_stage("ready")
+
+
+# Function to run a comparison job
+def run_comparison_job(job, database, comparison_cache=None):
+    """
+    Prepares both documents of a job and compares them section by section, recording progress with the job.
+
+    Args:
+        job (dict): The claimed job.
+        database: The 'capstone_db' database.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+    """
+    jobs_collection = database[JOBS_COLLECTION_NAME]
+    file_pair = job["_id"]
+
+    # Prepare both documents at the same time, so the comparison waits only for the slower one
+    update_job(jobs_collection, file_pair, stage="preparing documents")
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(prepare_document, job[f"{version}_file_path"], database,
+                            lambda stage, version=version: update_job(jobs_collection, file_pair, **{f"documents.{version}": stage}))
+            for version in ("new", "old")
+        ]
+        for future in futures:
+            future.result()
+    logger.info(f"Prepared both documents of {file_pair} in {time.perf_counter() - start_time:.1f}s")
+
+    update_job(jobs_collection, file_pair, stage="comparing sections")
+    find_section_wise_differences_in_files(
+        job["new_file_path"], job["old_file_path"], database['adobe_api_json_outputs'], database['documents_data'], database['sections_data'],
+        comparison_cache,
+        on_section_compared=lambda index, section_text, completed, total: record_section_progress(jobs_collection, file_pair, completed, total),
+        priority=make_priority_reader(jobs_collection, file_pair))
+
+    # Fail the job while sections are left to compare, so resubmitting it retries only those sections
+    file_names = tuple(os.path.splitext(os.path.basename(job[f"{version}_file_path"]))[0] for version in ("new", "old"))
+    if not is_pair_completed(file_names, database['sections_data']):
+        raise RuntimeError(f"Some sections of {file_pair} could not be compared; submit the comparison again to retry them")
+
+
+class ComparisonWorkerPool:
+    """
+    Worker threads that claim comparison jobs from MongoDB and run them.
+
+    Attributes:
+        database: The 'capstone_db' database.
+        max_workers (int): Number of jobs run at once.
+        comparison_cache (ComparisonCache | None): Cache of previous section comparisons.
+        poll_interval (float): Seconds an idle worker waits before looking for a new job.
+    """
+
+    def __init__(self, database, max_workers=comparison_workers, comparison_cache=None, poll_interval=POLL_INTERVAL_SECONDS):
+        """
+        Initializes the pool.
+
+        Args:
+            database: The 'capstone_db' database.
+            max_workers (int): Number of jobs run at once.
+            comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+            poll_interval (float): Seconds an idle worker waits before looking for a new job.
+        """
+        self.database = database
+        self.max_workers = max_workers
+        self.comparison_cache = comparison_cache
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Starts the worker threads.
+
+        Returns:
+            ComparisonWorkerPool: The pool.
+        """
+        create_job_indexes(self.database[JOBS_COLLECTION_NAME])
+        for _ in range(self.max_workers):
+            thread = threading.Thread(target=self._work, args=(f"{os.getpid()}-{uuid.uuid4().hex[:8]}",), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.max_workers} comparison workers")
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers once their current jobs are finished.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each worker. Defaults to waiting indefinitely.
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self, worker_id):
+        """
+        Claims and runs jobs until the pool is stopped.
+
+        Args:
+            worker_id (str): Identifier of the worker.
+        """
+        jobs_collection = self.database[JOBS_COLLECTION_NAME]
+        while not self._stop_event.is_set():
+            try:
+                job = claim_next_job(jobs_collection, worker_id)
+            except Exception as e:
+                logger.error(f"Failed to claim a comparison job: {e}")
+                job = None
+            if job is None:
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            logger.info(f"Worker {worker_id} started job {job['_id']}")
+            start_time = time.perf_counter()
+            try:
+                run_comparison_job(job, self.database, self.comparison_cache)
+                finish_job(jobs_collection, job["_id"])
+                logger.info(f"Worker {worker_id} finished job {job['_id']} in {time.perf_counter() - start_time:.1f}s")
+            except Exception as e:
+                logger.exception(f"Job {job['_id']} failed")
+                finish_job(jobs_collection, job["_id"], error=str(e))
+            finally:
+                remove_temporary_files(job)
+
+
+# Main execution logic to run a standalone worker pool
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run comparison workers that process the jobs submitted from the GUI.")
+    parser.add_argument("--workers", type=int, default=comparison_workers, help="Number of jobs run at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    capstone_db = MongoClient(uri)['capstone_db']
+    pool = ComparisonWorkerPool(capstone_db, args.workers, ComparisonCache(capstone_db['comparison_cache'])).start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop()
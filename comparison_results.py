@@ -0,0 +1,259 @@
+# Import necessary libraries and modules
+import os
+import re
+import argparse
+from pymongo import ASCENDING
+from local_diff import NO_CHANGE_SUMMARY
+
+# Separator printed after each rendered section comparison
+RESULT_SEPARATOR = "-----------------------------------------------"
+
+
+# Function to convert a comparison result into a storable document
+def build_comparison_document(result):
+    """
+    Converts a ComparisonResult into the structured form stored with each section.
+
+    Args:
+        result (ComparisonResult | None): The comparison result, or None if the comparison failed.
+
+    Returns:
+        dict | None: The 'differences' as a list of dictionaries and the 'summary', or None if the comparison failed.
+    """
+    if result is None:
+        return None
+    return {
+        "differences": [difference.model_dump() for difference in result.differences],
+        "summary": result.summary
+    }
+
+
+# Function to build the stored document of a section without changes
+def build_identical_comparison_document():
+    """
+    Builds the structured comparison of a section whose normalized texts are identical.
+
+    Returns:
+        dict: An empty list of differences and the no-change summary.
+    """
+    return {"differences": [], "summary": NO_CHANGE_SUMMARY}
+
+
+# Function to render structured differences as a report
+def render_differences(differences, summary):
+    """
+    Renders structured differences and their summary as a plain text report.
+
+    Args:
+        differences (list): Dictionaries with the fields of a Difference.
+        summary (str): Summary of the main differences.
+
+    Returns:
+        str: The report.
+    """
+    lines = ["Differences:"]
+    for difference in differences:
+        lines.append(f"Type: {difference.get('type')}, Description: {difference.get('description')}")
+        if difference.get("section"):
+            lines.append(f"Section: {difference['section']}")
+        if difference.get("new_file_text") or difference.get("old_file_text"):
+            lines.append(f"New content: {difference.get('new_file_text')}")
+            lines.append(f"Old content: {difference.get('old_file_text')}")
+        if difference.get("content"):
+            lines.append(f"Content: {difference['content']}")
+        if difference.get("position") is not None:
+            lines.append(f"Position: {difference['position']}")
+    return "\n".join(lines) + f"\n\n\nSummary:{summary}\n\n{RESULT_SEPARATOR}\n\n"
+
+
+# Function to render the comparison of a stored section
+def render_comparison_results(section):
+    """
+    Renders the comparison report of a section as stored in MongoDB.
+
+    Sections stored before structured differences were introduced keep their report string.
+
+    Args:
+        section (dict): The stored section.
+
+    Returns:
+        str: The report, or an empty string if the comparison failed.
+    """
+    if section.get("summary") is not None:
+        return render_differences(section.get("differences") or [], section["summary"])
+    return section.get("comparison_results") or ""
+
+
+# Function to create the indexes used by difference queries
+def create_difference_indexes(db_collection):
+    """
+    Creates the indexes on file pairs, on the stored section headings and on the type of stored differences.
+
+    The section and difference indexes are multikey indexes over the nested arrays, so queries such as
+    "all removed requirements in section Scope" select matching file pairs without scanning every document.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+    """
+    db_collection.create_index([("file_pair", ASCENDING)])
+    db_collection.create_index([("sections.differences.type", ASCENDING)])
+    db_collection.create_index([("sections.section_heading", ASCENDING)])
+
+
+# Function to count stored differences by type
+def count_differences_by_type(db_collection, file_pair=None):
+    """
+    Counts the stored differences of each type.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+        file_pair (str, optional): Restrict the count to one file pair. Defaults to all pairs.
+
+    Returns:
+        dict: The number of differences per type.
+    """
+    pipeline = [{"$match": {"file_pair": file_pair}}] if file_pair else []
+    pipeline += [
+        {"$unwind": "$sections"},
+        {"$unwind": "$sections.differences"},
+        {"$group": {"_id": "$sections.differences.type", "count": {"$sum": 1}}}
+    ]
+    return {entry["_id"]: entry["count"] for entry in db_collection.aggregate(pipeline)}
+
+
+# Function to find stored differences across file pairs
+def find_differences(db_collection, difference_type=None, section=None, file_pair=None):
+    """
+    Finds stored differences by type, section and file pair.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+        difference_type (str, optional): Type of difference ('added', 'removed' or 'modified').
+        section (str, optional): Heading of the stored section the difference belongs to.
+        file_pair (str, optional): Restrict the search to one file pair.
+
+    Returns:
+        list: Dictionaries with the 'file_pair', the 'section_heading' and the 'difference'.
+    """
+    difference_filter = {}
+    if difference_type:
+        difference_filter["sections.differences.type"] = difference_type
+    if section:
+        difference_filter["sections.section_heading"] = section
+    pair_filter = {"file_pair": file_pair} if file_pair else {}
+
+    pipeline = [
+        # Select the matching file pairs through the indexes, then keep only the matching differences
+        {"$match": {**pair_filter, **difference_filter}},
+        {"$unwind": "$sections"},
+        {"$unwind": "$sections.differences"},
+        {"$match": difference_filter},
+        {"$project": {
+            "_id": 0,
+            "file_pair": 1,
+            "section_heading": "$sections.section_heading",
+            "difference": "$sections.differences"
+        }}
+    ]
+    return list(db_collection.aggregate(pipeline))
+
+
+# Function to page through the section headings of a pair
+def list_section_headings(db_collection, file_pair, search=None, skip=0, limit=50):
+    """
+    Pages through the section headings of a pair without loading the section texts.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+        file_pair (str): Name of the file pair.
+        search (str, optional): Case-insensitive text the headings must contain. Defaults to all headings.
+        skip (int): Number of matching headings to skip.
+        limit (int): Maximum number of headings to return.
+
+    Returns:
+        dict: The 'total' number of matching headings and the 'sections' of the page, each with its
+            'section_id' (position in the pair), 'section_heading' and whether it is 'compared'.
+    """
+    pipeline = [
+        {"$match": {"file_pair": file_pair}},
+        # Drop the texts and differences before unwinding, so only headings leave the server
+        {"$project": {"_id": 0, "sections.section_heading": 1, "sections.compared": 1}},
+        {"$unwind": {"path": "$sections", "includeArrayIndex": "section_id"}}
+    ]
+    if search:
+        pipeline.append({"$match": {"sections.section_heading": {"$regex": re.escape(search), "$options": "i"}}})
+    pipeline.append({"$facet": {
+        "total": [{"$count": "count"}],
+        "sections": [
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": {
+                "section_id": 1,
+                "section_heading": "$sections.section_heading",
+                # Sections stored before per-section progress have no flag and are all compared
+                "compared": {"$ifNull": ["$sections.compared", True]}
+            }}
+        ]
+    }})
+    page = next(db_collection.aggregate(pipeline), {"total": [], "sections": []})
+    return {"total": page["total"][0]["count"] if page["total"] else 0, "sections": page["sections"]}
+
+
+# Function to fetch a single stored section of a pair
+def fetch_section(db_collection, file_pair, section_id):
+    """
+    Fetches the texts and comparison of one section of a pair.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+        file_pair (str): Name of the file pair.
+        section_id (int): Position of the section in the pair, as returned by list_section_headings.
+
+    Returns:
+        dict | None: The stored section, or None if the pair or section does not exist.
+    """
+    result = db_collection.find_one({"file_pair": file_pair}, {"_id": 0, "sections": {"$slice": [int(section_id), 1]}})
+    if not result or not result.get("sections"):
+        return None
+    return result["sections"][0]
+
+
+# Function to report the pairs whose comparison has not finished
+def get_partial_pairs(db_collection):
+    """
+    Lists the pairs whose comparison was interrupted or is still running, with their progress.
+
+    Args:
+        db_collection: The MongoDB collection holding the compared sections.
+
+    Returns:
+        list: Dictionaries with the 'file_pair', the number of 'compared_sections' and of 'total_sections'.
+    """
+    pipeline = [
+        {"$match": {"status": "comparing"}},
+        {"$project": {
+            "_id": 0,
+            "file_pair": 1,
+            "total_sections": {"$size": "$sections"},
+            "compared_sections": {"$size": {"$filter": {"input": "$sections", "cond": {"$eq": ["$$this.compared", True]}}}}
+        }},
+        {"$sort": {"file_pair": 1}}
+    ]
+    return list(db_collection.aggregate(pipeline))
+
+
+# Main execution logic to view the pairs with unfinished comparisons
+if __name__ == "__main__":
+    from pymongo import MongoClient
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Show the pairs whose section-wise comparison has not finished.")
+    parser.parse_args()
+
+    load_dotenv()
+    sections_collection = MongoClient(os.getenv('uri'))['capstone_db']['sections_data']
+    partial_pairs = get_partial_pairs(sections_collection)
+    if not partial_pairs:
+        print("No partially compared pairs.")
+    for pair in partial_pairs:
+        print(f"{pair['file_pair']}: {pair['compared_sections']} of {pair['total_sections']} sections compared")
@@ -1,14 +1,26 @@
 # Import necessary libraries and modules
+import logging
 import os
 import re
-import requests
 from pymongo import MongoClient
 import json
 from adobe_PDF_extract_API import ExtractTextInfoFromPDF
 import re
 from text_comparison_openAI_api import compare_strings
+from heading_locator import HeadingLocator
+from comparison_cache import ComparisonCache
+from async_comparison import ConcurrentComparisonEngine, DEFAULT_MAX_CONCURRENCY
+from token_counting import count_tokens
+from llm_gateway import get_gateway
+from local_diff import get_changed_hunks, text_fingerprint
+from comparison_results import build_comparison_document, render_comparison_results
+from datetime import datetime, timezone
+import asyncio
+import time
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 # Load environment variables from .env file
 uri = os.getenv('uri')
@@ -37,14 +49,14 @@ def find_matching_jsons(json_folder, pdf_file1, pdf_file2):
     json_file1_path = os.path.join(json_folder, f"{base_name1}.json")
     json_file2_path = os.path.join(json_folder, f"{base_name2}.json")
 
-    print(base_name1)
-    print(json_file1_path)
+    logger.debug(base_name1)
+    logger.debug(json_file1_path)
     # Initialize variables for JSON content
     json1, json2 = None, None
 
     # Check and load JSON for the first PDF
     if os.path.exists(json_file1_path):
-        print(f"Found JSON for {pdf_file1}: {json_file1_path}")
+        logger.info(f"Found JSON for {pdf_file1}: {json_file1_path}")
         with open(json_file1_path, 'r', encoding='utf-8') as f:
             json1 = json.load(f)
     else:
@@ -52,7 +64,7 @@ def find_matching_jsons(json_folder, pdf_file1, pdf_file2):
 
     # Check and load JSON for the second PDF
     if os.path.exists(json_file2_path):
-        print(f"Found JSON for {pdf_file2}: {json_file2_path}")
+        logger.info(f"Found JSON for {pdf_file2}: {json_file2_path}")
         with open(json_file2_path, 'r', encoding='utf-8') as f:
             json2 = json.load(f)
     else:
@@ -151,60 +163,37 @@ capstone_db = client['capstone_db']
 adobe_api_json_outputs_db = capstone_db['adobe_api_json_outputs']
 # Access the documents_data collection
 documents_data_db = capstone_db['documents_data']
+# Access the comparison_cache collection shared by all comparison paths
+comparison_cache = ComparisonCache(capstone_db['comparison_cache'])
 # Send a ping to confirm a successful connection
 try:
     client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
+    logger.info("Pinged your deployment. You successfully connected to MongoDB!")
 except Exception as e:
-    print(e)
-
-
-def get_cleaned_text_from_mongodb(file_name, file_headings_list, new_file_adobe_json, db_collection):
-    """
-    Retrieve cleaned text from MongoDB for a given file.
-
-    Args:
-        file_name (str): The name of the file to retrieve.
-        file_headings_list (list): List of section headings for the file.
-        new_file_adobe_json (dict): JSON data of the new file.
-        db_collection: The MongoDB collection to query.
-
-    Returns:
-        str: The cleaned text from the database.
-    """
-    # Find the document in the database
-    data = db_collection.find_one({'file_name': file_name})
-    # Get the cleaned text from the document
-    cleaned_text = data.get('cleaned_text')
+    logger.error(e)
 
 
-    """table_of_contents_list = get_table_of_contents(new_file_adobe_json)
-    for element in table_of_contents_list:
-        if element in cleaned_text:
-            cleaned_text = cleaned_text.replace(element, "")
-        #else:
-            #print(f"Table of contents entry not found in clean text: {element}")"""
-    return cleaned_text
+def extract_section_texts(heading_curr_new, heading_next_new, heading_curr_old, heading_next_old, cleaned_text_new, cleaned_text_old, end_index_new, end_index_old, locator_new=None, locator_old=None):
+    # Look headings up in the pre-scanned positions when available instead of searching the text again
+    find_new = locator_new.find if locator_new else cleaned_text_new.find
+    find_old = locator_old.find if locator_old else cleaned_text_old.find
 
-
-
-def extract_section_texts(heading_curr_new, heading_next_new, heading_curr_old, heading_next_old, cleaned_text_new, cleaned_text_old, end_index_new, end_index_old):
     if heading_next_new != None:
         if heading_curr_new == None:
             heading_curr_index_new = 0
             heading_curr_index_old = 0
-        heading_curr_index_new = cleaned_text_new.find(heading_curr_new, end_index_new)
-        heading_next_index_new = cleaned_text_new.find(heading_next_new, end_index_new + 1)
+        heading_curr_index_new = find_new(heading_curr_new, end_index_new)
+        heading_next_index_new = find_new(heading_next_new, end_index_new + 1)
         section_text_new = cleaned_text_new[heading_curr_index_new:heading_next_index_new]
-        heading_curr_index_old = cleaned_text_old.find(heading_curr_old, end_index_old)
-        heading_next_index_old = cleaned_text_old.find(heading_next_old, end_index_old + 1)
+        heading_curr_index_old = find_old(heading_curr_old, end_index_old)
+        heading_next_index_old = find_old(heading_next_old, end_index_old + 1)
         section_text_old = cleaned_text_old[heading_curr_index_old:heading_next_index_old]
         return section_text_new, section_text_old, heading_next_index_new, heading_next_index_old
     else:
-        print(f"Next_heading_new {heading_next_new} is None")
-        heading_curr_index_new = cleaned_text_new.find(heading_curr_new, end_index_new)
+        logger.debug(f"Next_heading_new {heading_next_new} is None")
+        heading_curr_index_new = find_new(heading_curr_new, end_index_new)
         section_text_new = cleaned_text_new[heading_curr_index_new:]
-        heading_curr_index_old = cleaned_text_old.find(heading_curr_old, end_index_old)
+        heading_curr_index_old = find_old(heading_curr_old, end_index_old)
         section_text_old = cleaned_text_old[heading_curr_index_old:]
         return section_text_new, section_text_old, len(cleaned_text_new), len(cleaned_text_old)
 
@@ -236,6 +225,10 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
     # Initialize a counter to keep track of the number of matching headings
     count = 0
 
+    # Scan each document once for all of its headings
+    locator_new = HeadingLocator(cleaned_text_new, [heading["text"] for heading in new_file_section_headings_list_with_path])
+    locator_old = HeadingLocator(cleaned_text_old, [heading["text"] for heading in old_file_section_headings_list_with_path])
+
     # Iterate over the section headings in the new file
     while current_heading_index_new < len(new_file_section_headings_list) and next_heading_index_new < len(new_file_section_headings_list):
         # Check if the current heading in the new file is in the old file
@@ -243,20 +236,20 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
             # Find the index of the current heading in the old file
             current_heading_index_old = old_file_section_headings_list.index(new_file_section_headings_list[current_heading_index_new])
             # Print the current headings in the new and old files
-            print(f"Current heading in new file: {new_file_section_headings_list_with_path[current_heading_index_new]['text']} | Current heading in old file: {old_file_section_headings_list_with_path[current_heading_index_old]['text']}")
+            logger.debug(f"Current heading in new file: {new_file_section_headings_list_with_path[current_heading_index_new]['text']} | Current heading in old file: {old_file_section_headings_list_with_path[current_heading_index_old]['text']}")
             # Move to the next heading in the new file
             next_heading_index_new = current_heading_index_new + 1
             # Check if the next heading in the new file is in the old file
             while new_file_section_headings_list[next_heading_index_new] not in old_file_section_headings_list:
                 # Print a message indicating that the heading is not in the old file
-                print("counter_increased")
-                print("Heading that is not in old file: ", new_file_section_headings_list[next_heading_index_new])
+                logger.debug("counter_increased")
+                logger.debug("Heading that is not in old file: %s", new_file_section_headings_list[next_heading_index_new])
                 # Move to the next heading in the new file
                 next_heading_index_new += 1
             # Find the index of the next heading in the old file
             next_heading_index_old = old_file_section_headings_list.index(new_file_section_headings_list[next_heading_index_new])
             # Print the next headings in the new and old files
-            print(f"Next heading in new file: {new_file_section_headings_list_with_path[next_heading_index_new]['text']} | Next heading in old file: {old_file_section_headings_list_with_path[next_heading_index_old]['text']}")
+            logger.debug(f"Next heading in new file: {new_file_section_headings_list_with_path[next_heading_index_new]['text']} | Next heading in old file: {old_file_section_headings_list_with_path[next_heading_index_old]['text']}")
             # Extract the section texts for the current and next headings
             section_text_new, section_text_old, end_index_new, end_index_old = extract_section_texts(
                 new_file_section_headings_list_with_path[current_heading_index_new]["text"],
@@ -266,7 +259,9 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
                 cleaned_text_new,
                 cleaned_text_old,
                 end_index_new,
-                end_index_old)
+                end_index_old,
+                locator_new,
+                locator_old)
             # Add the section texts to the list
             list_of_section_texts.append((section_text_new, section_text_old))
             # Move to the next heading in the new file
@@ -290,16 +285,18 @@ def get_section_texts(new_file_section_headings_list, new_file_section_headings_
                 cleaned_text_new,
                 cleaned_text_old,
                 end_index_new,
-                end_index_old)
+                end_index_old,
+                locator_new,
+                locator_old)
             # Add the section texts to the list
             list_of_section_texts.append((section_text_new, section_text_old))
             # Increment the counter
             count += 1
 
     # Print the total number of matching headings and the total number of headings in the new file
-    print(f"Total matching headings: {count}, Total headings in new file: {len(new_file_section_headings_list)}")
+    logger.info(f"Total matching headings: {count}, Total headings in new file: {len(new_file_section_headings_list)}")
     # Print the total number of section texts
-    print(f"Total section heading pairs: {len(list_of_section_texts)}")
+    logger.info(f"Total section heading pairs: {len(list_of_section_texts)}")
 
     # Return the list of section texts
     return list_of_section_texts
@@ -372,15 +369,34 @@ def search_query_processing(query_text, new_text, old_text):
     match_next_new = re.search(search_value, new_text)
     end_index_new = match_next_new.start()
     # match_next_new = re.search(new_text[start_index_new - 2]+1, new_text)
-    print(start_index_new)
-    print(start_index_old)
-    print(new_text[start_index_new - 2])
-    print(end_index_new)
-    print(new_text[end_index_new])
+    logger.debug(start_index_new)
+    logger.debug(start_index_old)
+    logger.debug(new_text[start_index_new - 2])
+    logger.debug(end_index_new)
+    logger.debug(new_text[end_index_new])
     # Return the start indices
     return start_index_new, start_index_old
 
 
+def format_section_comparison(section):
+    """
+    Format the stored comparison of a section for display.
+
+    Args:
+        section (dict): The stored section.
+
+    Returns:
+        str: The heading and comparison report of the section, or None if the section has no comparison yet.
+    """
+    comparison_results = render_comparison_results(section)
+    if not comparison_results:
+        return None
+    return (
+        f"**Section Heading:**\n{section['section_heading']}\n\n"
+        f"**Comparison Results:**\n\n{comparison_results}"
+    )
+
+
 def fetch_comparison_results(file_pair, section_heading, db_name="capstone_db", collection_name="sections_data"):
     """
     Fetch comparison results from the database.
@@ -412,60 +428,85 @@ def fetch_comparison_results(file_pair, section_heading, db_name="capstone_db",
         )
 
         if result and "sections" in result:
-            section = result["sections"][0]  # Extract the first matched section
-            formatted_result = (
-                f"**Section Heading:**\n{section['section_heading']}\n\n"
-                f"**Comparison Results:**\n\n{section['comparison_results']}"
-            )
-            return formatted_result
+            return format_section_comparison(result["sections"][0])  # Extract the first matched section
         else:
             return None
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
         return None
 
 
-def fetch_results(file_pair, db_name="capstone_db", collection_name="api_data"):
+def fetch_results(file_pair, new_clean_text, old_clean_text, db_name="capstone_db", collection_name="api_data"):
     """
-    Fetch results from the database.
+    Fetch a stored whole-document comparison from the database.
+
+    Results are keyed by the content hashes of both documents and the prompt version, so a renamed
+    file is still found and an edited one is compared again.
 
     Args:
         file_pair (str): File pair identifier.
+        new_clean_text (str): Cleaned text of the new file.
+        old_clean_text (str): Cleaned text of the old file.
         db_name (str): Database name.
         collection_name (str): Collection name.
 
     Returns:
-        str: Results.
+        str: Comparison results, or None if the documents have not been compared yet.
     """
     try:
-        # Connect to MongoDB
-        client = MongoClient(uri)  # Update with your MongoDB connection string
-        db = client[db_name]
-        collection = db[collection_name]
-
-        # Query the database for the file pair and section heading
-        result = collection.find_one(
+        result = client[db_name][collection_name].find_one(
             {
-                "file_pair": file_pair
-            }
+                "new_hash": text_fingerprint(new_clean_text),
+                "old_hash": text_fingerprint(old_clean_text),
+                "prompt_version": DOCUMENT_PROMPT_VERSION
+            },
+            {"comparison_results": 1}
         )
-
-        if result and "file_pair" in result:
-            section = result["file_pair"][0]  # Extract the first matched section
-            formatted_result = (
-                # f"**Section Heading:**\n{section['section_heading']}\n\n"
-                f"**Comparison Results:**\n{section['comparison_results']}"
-            )
-            return formatted_result
-        else:
-            return None
+        if result:
+            logger.info(f"Stored comparison found for file pair {file_pair}")
+            return result["comparison_results"]
+        return None
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
         return None
 
 
+def save_results(file_pair, new_clean_text, old_clean_text, comparison_result, db_name="capstone_db", collection_name="api_data"):
+    """
+    Store a whole-document comparison in the database.
+
+    Args:
+        file_pair (str): File pair identifier.
+        new_clean_text (str): Cleaned text of the new file.
+        old_clean_text (str): Cleaned text of the old file.
+        comparison_result (str): Comparison results.
+        db_name (str): Database name.
+        collection_name (str): Collection name.
+    """
+    try:
+        collection = client[db_name][collection_name]
+        collection.create_index([("new_hash", 1), ("old_hash", 1), ("prompt_version", 1)], unique=True)
+        collection.update_one(
+            {
+                "new_hash": text_fingerprint(new_clean_text),
+                "old_hash": text_fingerprint(old_clean_text),
+                "prompt_version": DOCUMENT_PROMPT_VERSION
+            },
+            {
+                "$set": {
+                    "file_pair": file_pair,
+                    "comparison_results": comparison_result,
+                    "updated_at": datetime.now(timezone.utc)
+                }
+            },
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+
+
 sample_response = """
 | Section   | Change                                                                                         |
 |-----------|------------------------------------------------------------------------------------------------|
@@ -531,6 +572,9 @@ sample_response = """
 
 """
 
+# Version of the whole-document comparison prompt, part of the comparison cache key
+DOCUMENT_PROMPT_VERSION = "document-comparison-v1"
+
 sample_response_edge_cases = """
 | Section   | Change                                                                                         |
 |-----------|------------------------------------------------------------------------------------------------|
@@ -546,28 +590,117 @@ sample_response_edge_cases = """
 | 5.2       | - Section removed                                                                              |
 """
 
-def compare_documents_with_gpt4o(text_new, text_old):
+# System prompt shared by the whole-document and per-chunk comparisons
+document_system_prompt = f"""You are an expert in document comparison. Your task is to identify the differences between newer and older versions of a document.
+    You need to compare the two versions on a very granular level, which means you have to compare differences in each section and sub-section and then list the changes explicitly.
+    Each sub-section should be listed along with the changes in that sub-section.
+    If there are changes in specific section or sub-section, please provide a detailed summary of the changes for each section or the sub-section along with the changes in each section or the sub-section.
+    If some of the sections are completely missing or newly added or there are no changes, you need to also make a note of it in the output. The example of this output is given below: \n\n{sample_response_edge_cases}
+    An example of how the output should look like is given below:\n\n{sample_response}"""
+
+# System prompt of a refinement pass, which reviews the previous table against the local diff
+refinement_system_prompt = """You are an expert in document comparison reviewing a preliminary comparison of a newer and an older version of a document.
+    You are given the preliminary comparison and the list of changes that a word-level diff found between the two versions, grouped by section.
+    Check every listed change against the preliminary comparison. Add rows for changes it misses, correct rows that are inaccurate and keep the rows that are correct.
+    Return the complete updated comparison as a markdown table with the columns Section and Change, and nothing else."""
+
+# Token budget of the locally computed changes sent with a refinement pass
+REFINEMENT_HUNK_TOKEN_BUDGET = 8000
+# Number of preceding words of the new text shown with each changed hunk
+HUNK_CONTEXT_WORDS = 8
+
+# Token budget of the new and old text in a single map-reduce chunk
+MAP_REDUCE_CHUNK_TOKEN_BUDGET = 12000
+# Combined document size above which the whole-document comparison switches to map-reduce
+MAP_REDUCE_THRESHOLD_TOKENS = 30000
+# Minimum seconds between two updates of the streamed text
+STREAM_UPDATE_INTERVAL_SECONDS = 0.1
+
+def stream_chat_completion(messages, max_tokens=4096, temperature=1, request_endpoint=None, request_api_key=None):
+    """
+    Stream a chat completion from the GPT-4o endpoint through the shared gateway.
+
+    Args:
+        messages (list): The chat messages of the request.
+        max_tokens (int): Maximum number of completion tokens.
+        temperature (float): Sampling temperature.
+        request_endpoint (str, optional): API endpoint. Defaults to the 'endpoint' environment variable.
+        request_api_key (str, optional): API key. Defaults to the 'api_key' environment variable.
+
+    Yields:
+        str: The content of each streamed token delta.
+    """
+    yield from get_gateway(request_endpoint, request_api_key).stream_chat(messages, max_tokens, temperature, operation="document_comparison_stream")
+
+
+def collect_streamed_completion(messages, on_update, max_tokens=4096, temperature=1, request_endpoint=None, request_api_key=None):
+    """
+    Stream a chat completion, reporting the accumulated text as it arrives.
+
+    Updates are throttled to one per STREAM_UPDATE_INTERVAL_SECONDS, so the text is joined only when it is
+    rendered instead of after every delta. The complete text is always reported last.
+
+    Args:
+        messages (list): The chat messages of the request.
+        on_update (callable): Called with the text received so far.
+        max_tokens (int): Maximum number of completion tokens.
+        temperature (float): Sampling temperature.
+        request_endpoint (str, optional): API endpoint. Defaults to the 'endpoint' environment variable.
+        request_api_key (str, optional): API key. Defaults to the 'api_key' environment variable.
+
+    Returns:
+        str: The complete content of the completion.
+    """
+    start_time = time.perf_counter()
+    last_update_time = start_time
+    first_row_logged = False
+    current_line = ""
+    parts = []
+    for delta in stream_chat_completion(messages, max_tokens, temperature, request_endpoint, request_api_key):
+        parts.append(delta)
+        # Log when the first complete data row of the table has arrived, checking only the lines just completed
+        if not first_row_logged:
+            current_line += delta
+            if "\n" in delta:
+                completed_lines, _, current_line = current_line.rpartition("\n")
+                if parse_comparison_table_rows(completed_lines):
+                    first_row_logged = True
+                    logger.info(f"Time to first table row: {time.perf_counter() - start_time:.2f}s")
+        now = time.perf_counter()
+        if now - last_update_time >= STREAM_UPDATE_INTERVAL_SECONDS:
+            last_update_time = now
+            on_update("".join(parts))
+    comparison_result = "".join(parts)
+    on_update(comparison_result)
+    logger.info(f"Time to complete comparison: {time.perf_counter() - start_time:.2f}s")
+    return comparison_result
+
+
+def compare_documents_with_gpt4o(text_new, text_old, cache=None, on_update=None):
     """
     Compare two document texts using GPT-4o.
 
     Args:
         text_new (str): Text of the new document.
         text_old (str): Text of the old document.
+        cache (ComparisonCache, optional): Cache consulted before and updated after the API call. Defaults to None.
+        on_update (callable, optional): Called with the text received so far while the completion streams.
+            When omitted the completion is requested in one piece. Defaults to None.
 
     Returns:
         str: Comparison results.
     """
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
-
-    system_prompt = f"""You are an expert in document comparison. Your task is to identify the differences between newer and older versions of a document.
-    You need to compare the two versions on a very granular level, which means you have to compare differences in each section and sub-section and then list the changes explicitly.
-    Each sub-section should be listed along with the changes in that sub-section.
-    If there are changes in specific section or sub-section, please provide a detailed summary of the changes for each section or the sub-section along with the changes in each section or the sub-section.
-    If some of the sections are completely missing or newly added or there are no changes, you need to also make a note of it in the output. The example of this output is given below: \n\n{sample_response_edge_cases}
-    An example of how the output should look like is given below:\n\n{sample_response}"""
+    # Return a previous result for the exact same comparison when available
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(text_new, text_old, DOCUMENT_PROMPT_VERSION, endpoint)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            if on_update:
+                on_update(cached_result)
+            return cached_result
+
+    system_prompt = document_system_prompt
 
     # Define the system prompt for the initial comparison
     initial_prompt = """
@@ -619,22 +752,25 @@ def compare_documents_with_gpt4o(text_new, text_old):
         ],
         "max_tokens": 4096,
         "temperature": 1,
-        "top_p": 1,
-        "n": 1,
     }
 
     try:
-        response = requests.post(endpoint, headers=headers, json=payload)
-        response.raise_for_status()
-        completion = response.json()
-        return completion['choices'][0]['message']['content']
+        if on_update:
+            comparison_result = collect_streamed_completion(payload["messages"], on_update, payload["max_tokens"], payload["temperature"])
+        else:
+            comparison_result = get_gateway().chat(payload["messages"], payload["max_tokens"], payload["temperature"], operation="document_comparison")
+        if cache is not None:
+            cache.set(cache_key, comparison_result)
+        return comparison_result
     except Exception as e:
         return f"Error in document comparison: {str(e)}"
 
 
-def compare_documents_with_gpt4o_loop(text_new, text_old, differences, iteration, endpoint, api_key):
+def compare_documents_with_gpt4o_loop(text_new, text_old, differences, iteration, endpoint, api_key, on_update=None, changed_hunks_text=None):
     """
-    Compare two documents using GPT-4o in a loop.
+    Refine a previous comparison using GPT-4o in a loop.
+
+    Instead of both documents, each pass sends the previous comparison and the locally computed changes.
 
     Args:
         text_new (str): Text of the new document.
@@ -643,55 +779,281 @@ def compare_documents_with_gpt4o_loop(text_new, text_old, differences, iteration
         iteration (int): Current iteration.
         endpoint (str): API endpoint.
         api_key (str): API key.
+        on_update (callable, optional): Called with the text received so far while the completion streams.
+            Defaults to None.
+        changed_hunks_text (str, optional): Changes formatted by format_changed_hunks. Computed from the whole
+            documents when omitted. Defaults to None.
 
     Returns:
         str: Comparison results.
     """
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
-
-    system_prompt = f"""You are an expert in document comparison. Your task is to identify the differences between newer and older versions of a document. 
-    You need to compare the two versions on a very granular level, which means you have to compare differences in each section and sub-section and then list the changes explicitly. 
-    Each sub-section should be listed along with the changes in that sub-section. 
-    If there are changes in specific section or sub-section, please provide a detailed summary of the changes for each section or the sub-section along with the changes in each section or the sub-section. 
-    If some of the sections are completely missing or newly added or there are no changes, you need to also make a note of it in the output. The example of this output is given below: \n\n{sample_response_edge_cases}
-    An example of how the output should look like is given below:\n\n{sample_response}"""
-
-    chain_prompt = f""" You are following up on the previous response of the LLM. The previous response was a preliminary analysis of the differences between the two document versions. 
-    The LLM has provided a summary of the changes in the document. 
-    Your task is to review the summary provided by the LLM and provide a more detailed summary of the changes in the document.
-    You must also check if the previous response has missed any important changes or some sections and sub-sections and provide a detailed summary of those changes along with the changes provided by the previous LLM.
-    The differences provided by the previous LLM are as follows:\n\n{differences}
-    The LLM was prompted with the following system prompt:\n\n{system_prompt}
-    You also need to follow the same system prompt and build up on the previous response.
-    """
+    if changed_hunks_text is None:
+        changed_hunks_text = format_changed_hunks([("Entire document", get_changed_hunks(text_new, text_old, HUNK_CONTEXT_WORDS))])
 
     temp = 1 - 0.2 * iteration
     # Prepare the payload for the API call
     payload = {
         "messages": [
-            {"role": "system", "content": chain_prompt},
-            {"role": "user", "content": f"Compare the following two document versions and provide a detailed summary of the changes.\n\nNewer Version:\n{text_new}\n\nOlder Version:\n{text_old}"}
+            {"role": "system", "content": refinement_system_prompt},
+            {"role": "user", "content": f"Preliminary comparison:\n\n{differences}\n\nChanges found by the word-level diff:\n\n{changed_hunks_text}"}
         ],
         "max_tokens": 4096,
         "temperature": temp,
-        "top_p": 1,
-        "n": 1,
     }
 
-    response = requests.post(endpoint, headers=headers, json=payload)
-
-    if response.status_code == 200:
-        completion = response.json()
-        return completion['choices'][0]['message']['content']
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
+    try:
+        if on_update:
+            return collect_streamed_completion(payload["messages"], on_update, payload["max_tokens"], temp, endpoint, api_key)
+        return get_gateway(endpoint, api_key).chat(payload["messages"], payload["max_tokens"], temp, operation="document_refinement")
+    except Exception as e:
+        logger.error(f"Error: {e}")
         return None
 
 
+def get_changed_hunks_by_section(file_pair, new_clean_text, old_clean_text, db_name="capstone_db", collection_name="sections_data"):
+    """
+    Compute the word-level changes between two documents, grouped by their stored aligned sections.
+
+    Args:
+        file_pair (str): File pair identifier.
+        new_clean_text (str): Cleaned text of the new file.
+        old_clean_text (str): Cleaned text of the old file.
+        db_name (str): Database name.
+        collection_name (str): Collection name.
+
+    Returns:
+        list: Tuples of (section_heading, hunks) in document order. The whole documents form a single
+            section when the pair has no stored sections.
+    """
+    result = client[db_name][collection_name].find_one(
+        {"file_pair": file_pair},
+        {"sections.section_heading": 1, "sections.new_text": 1, "sections.old_text": 1}
+    )
+    if not result or not result.get("sections"):
+        return [("Entire document", get_changed_hunks(new_clean_text, old_clean_text, HUNK_CONTEXT_WORDS))]
+    return [
+        (section.get("section_heading", ""), get_changed_hunks(section.get("new_text", ""), section.get("old_text", ""), HUNK_CONTEXT_WORDS))
+        for section in result["sections"]
+    ]
+
+
+def format_changed_hunks(section_hunks, token_budget=REFINEMENT_HUNK_TOKEN_BUDGET):
+    """
+    Format changed hunks as a compact list for a refinement prompt.
+
+    Args:
+        section_hunks (list): Tuples of (section_heading, hunks) as returned by get_changed_hunks_by_section.
+        token_budget (int): Maximum tokens of the formatted list; further hunks are counted but left out.
+
+    Returns:
+        str: The formatted changes.
+    """
+    lines = []
+    used_tokens = 0
+    omitted_hunks = 0
+    for section_heading, hunks in section_hunks:
+        section_header_added = False
+        for hunk in hunks:
+            line = f"- {hunk['type']} after \"...{hunk.get('context', '')}\": old \"{hunk['old_text']}\" -> new \"{hunk['new_text']}\""
+            line_tokens = count_tokens(line)
+            if used_tokens + line_tokens > token_budget:
+                omitted_hunks += 1
+                continue
+            if not section_header_added:
+                lines.append(f"Section: {section_heading}")
+                section_header_added = True
+            lines.append(line)
+            used_tokens += line_tokens
+
+    if omitted_hunks:
+        lines.append(f"({omitted_hunks} further changes omitted)")
+    if not lines:
+        return "No changes were found by the word-level diff."
+    return "\n".join(lines)
+
+
+def parse_comparison_table_rows(comparison_result):
+    """
+    Parse the rows of a Section/Change markdown table.
+
+    Args:
+        comparison_result (str): Comparison results containing a markdown table.
+
+    Returns:
+        list: Tuples of (section, change) for each data row, in order.
+    """
+    rows = []
+    for line in (comparison_result or "").splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            continue
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        # Skip the header and separator rows
+        if cells[0].lower() == "section" or all(set(cell) <= set("-: ") for cell in cells):
+            continue
+        rows.append((cells[0], " | ".join(cells[1:])))
+    return rows
+
+
+def merge_comparison_tables(comparison_results):
+    """
+    Merge per-chunk Section/Change tables into a single report without another model call.
+
+    Args:
+        comparison_results (list): Comparison results of each chunk, in document order.
+
+    Returns:
+        str: A single markdown table with the rows of all chunks, without duplicate rows.
+    """
+    merged_rows = []
+    seen_rows = set()
+    for comparison_result in comparison_results:
+        for row in parse_comparison_table_rows(comparison_result):
+            if row not in seen_rows:
+                seen_rows.add(row)
+                merged_rows.append(row)
+
+    if not merged_rows:
+        # Keep free-form answers when no chunk returned a table
+        return "\n\n".join(result for result in comparison_results if result)
+
+    lines = ["| Section | Change |", "|---------|--------|"]
+    lines.extend(f"| {section} | {change} |" for section, change in merged_rows)
+    return "\n".join(lines)
+
+
+def split_documents_into_chunks(new_clean_text, old_clean_text, aligned_sections=None, token_budget=MAP_REDUCE_CHUNK_TOKEN_BUDGET):
+    """
+    Split both documents into aligned chunks under a token budget.
+
+    Args:
+        new_clean_text (str): Cleaned text of the new file.
+        old_clean_text (str): Cleaned text of the old file.
+        aligned_sections (list, optional): Tuples of (new_text, old_text) of the aligned sections in document order.
+            When missing, both documents are split at line breaks into proportional parts. Defaults to None.
+        token_budget (int): Maximum tokens of new and old text combined in a chunk.
+
+    Returns:
+        list: Tuples of (new_text, old_text) for each chunk.
+    """
+    if not aligned_sections:
+        # Cut both documents at the same relative positions, moved forward to the next line break
+        total_tokens = count_tokens(new_clean_text) + count_tokens(old_clean_text)
+        part_count = max(1, -(-total_tokens // token_budget))
+        aligned_sections = []
+        new_start, old_start = 0, 0
+        for part in range(1, part_count + 1):
+            new_end = len(new_clean_text) if part == part_count else new_clean_text.find("\n", len(new_clean_text) * part // part_count)
+            old_end = len(old_clean_text) if part == part_count else old_clean_text.find("\n", len(old_clean_text) * part // part_count)
+            new_end = len(new_clean_text) if new_end == -1 else max(new_end, new_start)
+            old_end = len(old_clean_text) if old_end == -1 else max(old_end, old_start)
+            aligned_sections.append((new_clean_text[new_start:new_end], old_clean_text[old_start:old_end]))
+            new_start, old_start = new_end, old_end
+
+    # Pack consecutive sections into chunks while they fit the budget
+    chunks = []
+    chunk_new, chunk_old, chunk_tokens = [], [], 0
+    for new_text, old_text in aligned_sections:
+        section_tokens = count_tokens(new_text) + count_tokens(old_text)
+        if chunk_new and chunk_tokens + section_tokens > token_budget:
+            chunks.append(("".join(chunk_new), "".join(chunk_old)))
+            chunk_new, chunk_old, chunk_tokens = [], [], 0
+        chunk_new.append(new_text)
+        chunk_old.append(old_text)
+        chunk_tokens += section_tokens
+    if chunk_new:
+        chunks.append(("".join(chunk_new), "".join(chunk_old)))
+    return chunks
+
+
+def post_chat_completion(messages, max_tokens=4096, temperature=1):
+    """
+    Send a chat completion request to the GPT-4o endpoint through the shared gateway.
+
+    The gateway does not retry these calls; the caller is expected to retry transient failures.
+
+    Args:
+        messages (list): The chat messages of the request.
+        max_tokens (int): Maximum number of completion tokens.
+        temperature (float): Sampling temperature.
+
+    Returns:
+        str: The content of the completion.
+    """
+    return get_gateway().chat(messages, max_tokens, temperature, operation="document_chunk_comparison", max_retries=0)
+
+
+def compare_documents_map_reduce(new_clean_text, old_clean_text, aligned_sections=None, token_budget=MAP_REDUCE_CHUNK_TOKEN_BUDGET, max_concurrency=DEFAULT_MAX_CONCURRENCY, on_update=None):
+    """
+    Compare two documents by comparing aligned chunks concurrently and merging their tables.
+
+    Args:
+        new_clean_text (str): Cleaned text of the new file.
+        old_clean_text (str): Cleaned text of the old file.
+        aligned_sections (list, optional): Tuples of (new_text, old_text) of the aligned sections in document order.
+            Defaults to None.
+        token_budget (int): Maximum tokens of new and old text combined in a chunk.
+        max_concurrency (int): Maximum number of chunk comparisons in flight at once.
+        on_update (callable, optional): Called with the merged report of the chunks completed so far. Defaults to None.
+
+    Returns:
+        tuple: The merged Section/Change report and the number of chunks whose comparison failed.
+            The report is incomplete when any chunk failed.
+    """
+    chunks = split_documents_into_chunks(new_clean_text, old_clean_text, aligned_sections, token_budget)
+
+    # Map: build one comparison request per chunk
+    jobs = []
+    for index, (chunk_new, chunk_old) in enumerate(chunks):
+        messages = [
+            {"role": "system", "content": document_system_prompt},
+            {"role": "user", "content": f"Compare the following two document versions and provide a detailed summary of the changes. This is part {index + 1} of {len(chunks)} of the documents; only report the sections contained in this part.\n\nNewer Version:\n{chunk_new}\n\nOlder Version:\n{chunk_old}"}
+        ]
+        jobs.append(((index, messages), sum(count_tokens(message["content"]) for message in messages) + 4096))
+
+    completed_results = {}
+
+    async def compare_chunk(payload):
+        index, messages = payload
+        result = await asyncio.to_thread(post_chat_completion, messages)
+        # Show the rows of the chunks completed so far in document order
+        if on_update:
+            completed_results[index] = result
+            on_update(merge_comparison_tables([completed_results[key] for key in sorted(completed_results)]))
+        return result
+
+    start_time = time.perf_counter()
+    # Share the deployment quotas with the section comparisons running at the same time
+    engine = ConcurrentComparisonEngine(compare_chunk, max_concurrency=max_concurrency, rate_limiter=get_gateway().rate_limiter)
+    chunk_results = asyncio.run(engine.run(jobs))
+    logger.info(f"Compared {len(chunks)} chunks in {time.perf_counter() - start_time:.1f}s, largest request {max(tokens for _, tokens in jobs)} tokens")
+
+    failed_chunks = sum(result is None for result in chunk_results)
+    if failed_chunks:
+        logger.error(f"Failed to compare {failed_chunks} of {len(chunks)} chunks")
+
+    # Reduce: merge the per-chunk tables locally
+    return merge_comparison_tables(chunk_results), failed_chunks
+
+
+def get_aligned_section_texts(file_pair, db_name="capstone_db", collection_name="sections_data"):
+    """
+    Get the aligned section texts of a file pair from the database.
+
+    Args:
+        file_pair (str): File pair identifier.
+        db_name (str): Database name.
+        collection_name (str): Collection name.
+
+    Returns:
+        list: Tuples of (new_text, old_text) in document order, or an empty list if the pair is not stored.
+    """
+    result = client[db_name][collection_name].find_one({"file_pair": file_pair}, {"sections.new_text": 1, "sections.old_text": 1})
+    if not result or "sections" not in result:
+        return []
+    return [(section.get("new_text", ""), section.get("old_text", "")) for section in result["sections"]]
+
+
 def get_differences_between_sections(list_of_section_texts):
     """
     Get the differences between sections.
@@ -706,43 +1068,15 @@ def get_differences_between_sections(list_of_section_texts):
         new_text = section_text[1]
         old_text = section_text[2]
 
-        # Find the differences between the two texts
-        result = compare_strings(new_text, old_text)
-        result_string = ""
-        # Display the results
-        if result:
-            print("Section heading: ", section_text[0])
-            print("Differences:")
-            result_string = result_string + "Differences:\n"
-            for diff in result.differences:
-                print(f"Type: {diff.type}, Description: {diff.description}")
-                result_string = result_string + f"Type: {diff.type}, Description: {diff.description}\n"
-                if diff.section:
-                    result_string = result_string + f"Section: {diff.section}\n"
-                    print(f"Section: {diff.section}")
-                if diff.new_file_text or diff.old_file_text:
-                    result_string = result_string + f"New content: {diff.new_file_text}\n"
-                    result_string = result_string + f"Old content: {diff.old_file_text}\n"
-                    print(f"New content: {diff.new_file_text}")
-                    print(f"Old content: {diff.old_file_text}")
-                if diff.content:
-                    result_string = result_string + f"Content: {diff.content}\n"
-                    print(f"Content: {diff.content}")
-                if diff.position is not None:
-                    result_string = result_string + f"Position: {diff.position}\n"
-                    print(f"Position: {diff.position}")
-
-            result_string = result_string + "\n\nSummary:"
-            result_string = result_string + result.summary
-            result_string = result_string + "\n\n-----------------------------------------------\n\n"
-            print("\nSummary:")
-            print(result.summary)
-
-            print("\n\n-----------------------------------------------\n\n")
+        # Find the differences between the two texts and keep them structured
+        comparison_document = build_comparison_document(compare_strings(new_text, old_text))
+        if comparison_document:
+            logger.debug("Section heading: %s", section_text[0])
+            logger.debug(render_comparison_results(comparison_document))
         else:
-            print("Error in comparing the two texts")
+            logger.error("Error in comparing the two texts")
 
-        section_text.append(result_string)
+        section_text.append(comparison_document)
 
     return list_of_section_texts
 
@@ -786,15 +1120,15 @@ def get_sections_from_db(file_path_new, file_path_old, db_name="capstone_db", co
     new_file_name = os.path.splitext(os.path.basename(file_path_new))[0]
     old_file_name = os.path.splitext(os.path.basename(file_path_old))[0]
     file_pair = f"{new_file_name}_{old_file_name}"
-    print("searching for file pair: ", file_pair)
+    logger.debug("searching for file pair: %s", file_pair)
     try:
         # Connect to MongoDB
         client = MongoClient(uri)  # Update with your MongoDB connection string
         db = client[db_name]
         collection = db[collection_name]
 
-        # Query the database for the file pair
-        result = collection.find_one({"file_pair": file_pair})
+        # Query the database for the headings of the file pair, leaving the texts on the server
+        result = collection.find_one({"file_pair": file_pair}, {"sections.section_heading": 1})
 
         if result and "sections" in result:
             # Extract and return the section headings
@@ -804,7 +1138,7 @@ def get_sections_from_db(file_path_new, file_path_old, db_name="capstone_db", co
             return []
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
         return []
 
 
@@ -822,9 +1156,9 @@ def fetch_old_and_new_text(file_path_new, file_path_old, db_name="capstone_db",
         list: List of tuples containing old and new text.
     """
     file_name_new = os.path.splitext(file_path_new.name)[0]
-    print(file_name_new)
+    logger.debug(file_name_new)
     file_name_old = os.path.splitext(file_path_old.name)[0]
-    print(file_name_old)
+    logger.debug(file_name_old)
     file_pair = f"{file_name_new}_{file_name_old}"
     try:
         # Connect to MongoDB
@@ -847,11 +1181,11 @@ def fetch_old_and_new_text(file_path_new, file_path_old, db_name="capstone_db",
             return []
 
     except Exception as e:
-        print(f"An error occurred while fetching texts: {e}")
+        logger.error(f"An error occurred while fetching texts: {e}")
         return []
 
 
-def process_and_compare_pdfs(query, file_pair, new_clean_text, old_clean_text, repetitions=3):
+def process_and_compare_pdfs(query, file_pair, new_clean_text, old_clean_text, repetitions=3, map_reduce=None, on_update=None, refresh=False):
     """
     Process and compare two PDF documents.
 
@@ -861,6 +1195,11 @@ def process_and_compare_pdfs(query, file_pair, new_clean_text, old_clean_text, r
         new_clean_text (str): Cleaned text of the new file.
         old_clean_text (str): Cleaned text of the old file.
         repetitions (int): Number of repetitions.
+        map_reduce (bool | None): Compare aligned chunks concurrently instead of the whole documents in one prompt.
+            None switches to map-reduce when the documents exceed MAP_REDUCE_THRESHOLD_TOKENS.
+        on_update (callable, optional): Called with the partial comparison results while they stream in.
+            Defaults to None.
+        refresh (bool): Recompute the whole-document comparison even when a stored result exists. Defaults to False.
 
     Returns:
         str: Comparison results.
@@ -875,28 +1214,77 @@ def process_and_compare_pdfs(query, file_pair, new_clean_text, old_clean_text, r
             err = f"No results found for section '{query}'"
             return err
     else:
-        # Compare the documents using GPT-4o
-        print("Comparing documents...")
-        comparison_result = compare_documents_with_gpt4o(new_clean_text, old_clean_text)
+        # Serve a stored comparison of the same documents unless a refresh is requested
+        if not refresh:
+            stored_result = fetch_results(file_pair, new_clean_text, old_clean_text)
+            if stored_result:
+                if on_update:
+                    on_update(stored_result)
+                return stored_result
+
+        if map_reduce is None:
+            map_reduce = count_tokens(new_clean_text) + count_tokens(old_clean_text) > MAP_REDUCE_THRESHOLD_TOKENS
+        if map_reduce:
+            # Compare aligned chunks concurrently; each chunk is small enough that no refinement pass is needed
+            logger.info("Comparing documents chunk by chunk...")
+            comparison_result, failed_chunks = compare_documents_map_reduce(new_clean_text, old_clean_text, get_aligned_section_texts(file_pair),
+                                                                            on_update=on_update)
+            # An incomplete table is shown but not stored, so the next view compares the documents again
+            if failed_chunks:
+                return f"{comparison_result}\n\nError in document comparison: {failed_chunks} parts of the documents could not be compared, so this table is incomplete."
+            if comparison_result:
+                save_results(file_pair, new_clean_text, old_clean_text, comparison_result)
+            return comparison_result
 
-        if comparison_result:
-            print("\n--- Initial Comparison Results ---")
-            print(comparison_result)
-        else:
-            print("Failed to retrieve differences.")
+        # Compare the documents using GPT-4o
+        logger.info("Comparing documents...")
+        comparison_result = compare_documents_with_gpt4o(new_clean_text, old_clean_text, cache=None if refresh else comparison_cache, on_update=on_update)
+
+        # An error is returned as it is, so it is neither refined into a table nor stored
+        if not comparison_result or comparison_result.startswith("Error in document comparison"):
+            logger.error("Failed to retrieve differences.")
+            return comparison_result
+        logger.debug("\n--- Initial Comparison Results ---")
+        logger.debug(comparison_result)
+
+        # Refine with the previous table and the local diff instead of resending both documents
+        changed_hunks_text = format_changed_hunks(get_changed_hunks_by_section(file_pair, new_clean_text, old_clean_text))
+        document_tokens = count_tokens(document_system_prompt) + count_tokens(new_clean_text) + count_tokens(old_clean_text)
+        refinement_tokens = count_tokens(refinement_system_prompt) + count_tokens(changed_hunks_text)
+        tokens_saved = 0
+        iteration_latencies = []
 
         # Repeat the comparison for the specified number of repetitions
         for i in range(repetitions - 1):
-            print(f"\n--- Iteration: {i+2} ---")
-            print("Making API call to GPT-4o for document comparison...")
-            new_result = compare_documents_with_gpt4o_loop(new_clean_text, old_clean_text, comparison_result, i, endpoint, api_key)
+            logger.info(f"\n--- Iteration: {i+2} ---")
+            logger.info("Making API call to GPT-4o for document comparison...")
+            start_time = time.perf_counter()
+            new_result = compare_documents_with_gpt4o_loop(new_clean_text, old_clean_text, comparison_result, i, endpoint, api_key,
+                                                           on_update=on_update, changed_hunks_text=changed_hunks_text)
+            iteration_latencies.append(time.perf_counter() - start_time)
+            tokens_saved += document_tokens - refinement_tokens
 
             if new_result:
-                print("\n--- Additional Differences Found ---")
-                print(new_result)
+                logger.debug("\n--- Additional Differences Found ---")
+                logger.debug(new_result)
+                new_rows = set(parse_comparison_table_rows(new_result)) - set(parse_comparison_table_rows(comparison_result))
                 comparison_result = new_result
+                # Stop once a pass adds no rows; the remaining passes would send the same input again
+                if not new_rows:
+                    skipped_iterations = repetitions - 2 - i
+                    tokens_saved += skipped_iterations * (document_tokens + count_tokens(comparison_result))
+                    logger.info(f"Refinement converged after {i + 1} of {repetitions - 1} passes, skipping {skipped_iterations}, "
+                          f"about {skipped_iterations * sum(iteration_latencies) / len(iteration_latencies):.1f}s saved")
+                    break
             else:
-                print("Failed to retrieve additional differences.")
+                logger.error("Failed to retrieve additional differences.")
+
+        if repetitions > 1:
+            logger.info(f"Refinement: about {tokens_saved} prompt tokens saved compared to resending both documents")
+
+        # Store the result so repeat views of the same documents are served instantly
+        if comparison_result:
+            save_results(file_pair, new_clean_text, old_clean_text, comparison_result)
 
         # Return the comparison results
         return comparison_result
\ No newline at end of file
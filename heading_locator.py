@@ -0,0 +1,189 @@
+# Import necessary libraries and modules
+from bisect import bisect_left
+from collections import deque
+
+
+class MultiPatternMatcher:
+    """
+    An Aho-Corasick automaton that finds every occurrence of a set of patterns in a single linear scan.
+
+    Attributes:
+        patterns (list): The distinct, non-empty patterns the automaton was built from.
+    """
+
+    def __init__(self, patterns):
+        """
+        Builds the automaton for the given patterns.
+
+        Args:
+            patterns (iterable): Strings to search for. Empty strings and duplicates are ignored.
+        """
+        # Keep the distinct non-empty patterns in their original order
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        # Initialize the trie with a single root state
+        self._transitions = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+
+        # Insert each pattern into the trie
+        for pattern_index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self._transitions)
+                    self._transitions[state][char] = next_state
+                    self._transitions.append({})
+                    self._fail.append(0)
+                    self._outputs.append([])
+                state = next_state
+            self._outputs[state].append(pattern_index)
+
+        # Compute failure links breadth-first so shorter suffixes are resolved first
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._transitions[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._transitions[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._transitions[fail_state].get(char, 0)
+                # Inherit the matches of the longest proper suffix
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """
+        Yields every occurrence of every pattern in the text, including overlapping ones.
+
+        Args:
+            text (str): The text to scan.
+
+        Yields:
+            tuple: The start index of the occurrence and the matched pattern.
+        """
+        state = 0
+        for index, char in enumerate(text):
+            # Follow failure links until a transition on the character exists
+            while state and char not in self._transitions[state]:
+                state = self._fail[state]
+            state = self._transitions[state].get(char, 0)
+            for pattern_index in self._outputs[state]:
+                pattern = self.patterns[pattern_index]
+                yield index - len(pattern) + 1, pattern
+
+    def find_all(self, text):
+        """
+        Finds the start positions of every pattern in the text.
+
+        Args:
+            text (str): The text to scan.
+
+        Returns:
+            dict: A dictionary mapping each pattern to a sorted list of its start positions.
+        """
+        positions = {pattern: [] for pattern in self.patterns}
+        for start, pattern in self.iter_matches(text):
+            positions[pattern].append(start)
+        # Matches are reported by end position, so shorter patterns can be out of start order
+        for pattern_positions in positions.values():
+            pattern_positions.sort()
+        return positions
+
+    def remove_all(self, text):
+        """
+        Removes every occurrence of the patterns from the text, preferring the leftmost and then the longest match.
+
+        Args:
+            text (str): The text to clean.
+
+        Returns:
+            str: The text with all pattern occurrences removed.
+        """
+        # Collect all matches as (start, end) spans
+        spans = sorted(((start, start + len(pattern)) for start, pattern in self.iter_matches(text)),
+                       key=lambda span: (span[0], -span[1]))
+        # Keep the text between non-overlapping matches
+        kept_parts = []
+        cursor = 0
+        for start, end in spans:
+            if start < cursor:
+                continue
+            kept_parts.append(text[cursor:start])
+            cursor = end
+        kept_parts.append(text[cursor:])
+        return "".join(kept_parts)
+
+
+class HeadingLocator:
+    """
+    Locates headings in a document text using one multi-pattern scan built once per document.
+
+    Lookups follow the semantics of `str.find`, so it can replace repeated `text.find(heading, start)` calls.
+
+    Attributes:
+        text (str): The document text that was scanned.
+    """
+
+    def __init__(self, text, headings):
+        """
+        Scans the text once for all the given headings.
+
+        Args:
+            text (str): The document text to scan.
+            headings (iterable): The heading strings to locate.
+        """
+        self.text = text
+        self._positions = MultiPatternMatcher(headings).find_all(text)
+
+    def find(self, heading, start=0):
+        """
+        Finds the first occurrence of a heading at or after a start index.
+
+        Args:
+            heading (str): The heading to find.
+            start (int): The index to start searching from.
+
+        Returns:
+            int: The index of the occurrence, or -1 if the heading does not occur after the start index.
+        """
+        positions = self._positions.get(heading)
+        if positions is None:
+            # Fall back to a direct search for headings that were not part of the scan
+            return self.text.find(heading, start)
+        # Count a negative start from the end of the text, as str.find does
+        if start < 0:
+            start = max(0, start + len(self.text))
+        index = bisect_left(positions, start)
+        return positions[index] if index < len(positions) else -1
+
+    def find_all(self, heading):
+        """
+        Returns every start position of a heading.
+
+        Args:
+            heading (str): The heading to look up.
+
+        Returns:
+            list: Sorted start positions of the heading in the text.
+        """
+        positions = self._positions.get(heading)
+        if positions is None:
+            return MultiPatternMatcher([heading]).find_all(self.text).get(heading, [])
+        return list(positions)
+
+
+def remove_table_of_contents_entries(text, table_of_contents_list):
+    """
+    Removes table of contents entries from a document text in a single pass.
+
+    Args:
+        text (str): The document text to clean.
+        table_of_contents_list (list): The table of contents entries to remove.
+
+    Returns:
+        str: The text with all table of contents entries removed.
+    """
+    if not table_of_contents_list:
+        return text
+    return MultiPatternMatcher(table_of_contents_list).remove_all(text)
@@ -0,0 +1,584 @@
+# Import necessary libraries and modules
+import logging
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qs
+import httpx
+from dotenv import load_dotenv
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Load environment variables from .env file
+endpoint = os.getenv('endpoint')
+api_key = os.getenv('api_key')
+# Quotas of the model deployment, shared by all callers of a gateway
+requests_per_minute = int(os.getenv('requests_per_minute', 60))
+tokens_per_minute = int(os.getenv('tokens_per_minute', 80000))
+
+# API version used when the endpoint does not specify one
+DEFAULT_API_VERSION = "2024-08-01-preview"
+# Model deployment used when the endpoint does not name one
+DEFAULT_DEPLOYMENT = "gpt-4o"
+# Connection, read and overall timeouts of a model call in seconds
+CONNECT_TIMEOUT_SECONDS = 10
+REQUEST_TIMEOUT_SECONDS = 300
+# Connection pool limits shared by all calls of a gateway
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+# Retries of rate-limited, failed and timed out calls
+DEFAULT_MAX_RETRIES = 3
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30
+
+# The usage meter of the current context, if any
+_current_usage_meter = ContextVar("current_usage_meter", default=None)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when a call is rejected because the circuit breaker is open.
+
+    Attributes:
+        retry_after_seconds (float): Seconds until the circuit lets a trial call through.
+    """
+
+    def __init__(self, message, retry_after_seconds=0.0):
+        """
+        Initializes the error.
+
+        Args:
+            message (str): The error message.
+            retry_after_seconds (float): Seconds until the circuit lets a trial call through.
+        """
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker that stops calls to the model after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast. Once
+    `reset_seconds` have passed a single trial call is let through; it closes the circuit on
+    success and reopens it on failure. Rate-limited calls are not failures: the endpoint answered,
+    and the caller is expected to retry them.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_seconds (float): Seconds the circuit stays open before a trial call.
+        consecutive_failures (int): Failures since the last successful call.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        """
+        Initializes a closed circuit.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit.
+            reset_seconds (float): Seconds the circuit stays open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Checks whether a call may proceed.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            # Let a single trial call through once the reset period has passed
+            open_seconds = time.monotonic() - self._opened_at
+            if open_seconds >= self.reset_seconds and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise CircuitOpenError(f"Model calls suspended after {self.consecutive_failures} consecutive failures",
+                                   max(0.0, self.reset_seconds - open_seconds))
+
+    def record_success(self):
+        """
+        Closes the circuit after a successful call.
+        """
+        with self._lock:
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_throttled(self):
+        """
+        Ends a rate-limited call without counting it as a failure, freeing the trial slot of a half-open circuit.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """
+        Counts a failed call and opens the circuit once the threshold is reached.
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class TokenBucketRateLimiter:
+    """
+    A rate limiter that enforces a requests-per-minute and a tokens-per-minute quota across threads and event loops.
+
+    Both quotas are modelled as token buckets that refill continuously, so short bursts up to the
+    full quota are allowed while the average rate stays within the quota. Each request reserves its
+    capacity at once, taking the buckets into debt if needed, and waits until the debt is repaid; so
+    requests are admitted in arrival order even when they come from different event loops.
+
+    Attributes:
+        requests_per_minute (int): Maximum number of requests per minute.
+        tokens_per_minute (int): Maximum number of prompt and completion tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        """
+        Initializes both buckets full.
+
+        Args:
+            requests_per_minute (int): Maximum number of requests per minute.
+            tokens_per_minute (int): Maximum number of prompt and completion tokens per minute.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._available_requests = float(requests_per_minute)
+        self._available_tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """
+        Adds the capacity accumulated since the last update to both buckets.
+        """
+        now = time.monotonic()
+        elapsed_minutes = (now - self._updated_at) / 60
+        self._updated_at = now
+        self._available_requests = min(self.requests_per_minute, self._available_requests + elapsed_minutes * self.requests_per_minute)
+        self._available_tokens = min(self.tokens_per_minute, self._available_tokens + elapsed_minutes * self.tokens_per_minute)
+
+    def reserve(self, tokens):
+        """
+        Consumes one request and the given number of tokens and returns how long to wait before sending.
+
+        Args:
+            tokens (int): Estimated tokens of the request. Requests larger than the quota consume the whole quota.
+
+        Returns:
+            float: Seconds until the reserved capacity has accumulated, 0 if it is available now.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            self._refill()
+            self._available_requests -= 1
+            self._available_tokens -= tokens
+            wait_for_request = max(0.0, -self._available_requests) / self.requests_per_minute * 60
+            wait_for_tokens = max(0.0, -self._available_tokens) / self.tokens_per_minute * 60
+            return max(wait_for_request, wait_for_tokens)
+
+    async def acquire(self, tokens):
+        """
+        Reserves one request and the given number of tokens and waits until they are available.
+
+        Args:
+            tokens (int): Estimated tokens of the request. Requests larger than the quota consume the whole quota.
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class UsageMeter:
+    """
+    Adds up the token usage of the model calls made while it is active, from any thread or task of its context.
+
+    Attributes:
+        prompt_tokens (int): Prompt tokens of the measured calls.
+        completion_tokens (int): Completion tokens of the measured calls.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty meter.
+        """
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens, completion_tokens):
+        """
+        Adds the usage of one call.
+
+        Args:
+            prompt_tokens (int): Prompt tokens of the call.
+            completion_tokens (int): Completion tokens of the call.
+        """
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+# Function to measure the token usage of the calls made in a block
+@contextmanager
+def measure_usage():
+    """
+    Measures the token usage of the model calls made in the current context, e.g. by one comparison run.
+
+    Calls of other runs sharing the gateway are not counted, and resetting the gateway's metrics does not
+    affect the meter. Tasks and threads started from the block inherit the meter.
+
+    Yields:
+        UsageMeter: The meter of the block.
+    """
+    meter = UsageMeter()
+    token = _current_usage_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_usage_meter.reset(token)
+
+
+# Function to split an endpoint into its Azure OpenAI parts
+def parse_endpoint(endpoint_url):
+    """
+    Splits an endpoint into the Azure OpenAI resource URL, deployment and API version.
+
+    Both the resource URL (https://<resource>.openai.azure.com/) and the full chat completions URL
+    (https://<resource>.openai.azure.com/openai/deployments/<deployment>/chat/completions?api-version=...)
+    are accepted.
+
+    Args:
+        endpoint_url (str): The endpoint to parse.
+
+    Returns:
+        tuple: The resource URL, the deployment name and the API version.
+    """
+    parts = urlsplit(endpoint_url or "")
+    resource_url = f"{parts.scheme}://{parts.netloc}/" if parts.netloc else endpoint_url
+    deployment = DEFAULT_DEPLOYMENT
+    path_segments = [segment for segment in parts.path.split("/") if segment]
+    if "deployments" in path_segments and path_segments.index("deployments") + 1 < len(path_segments):
+        deployment = path_segments[path_segments.index("deployments") + 1]
+    api_version = parse_qs(parts.query).get("api-version", [DEFAULT_API_VERSION])[0]
+    return resource_url, deployment, api_version
+
+
+class LLMGateway:
+    """
+    The single client through which all comparison paths call the model.
+
+    The gateway keeps one pooled keep-alive connection to the endpoint, applies timeouts and retries,
+    guards the endpoint with a circuit breaker and records the latency and token usage of every call.
+
+    Attributes:
+        resource_url (str): The Azure OpenAI resource URL.
+        deployment (str): The model deployment.
+        api_version (str): The Azure OpenAI API version.
+        max_retries (int): Retries of rate-limited, failed and timed out calls.
+        circuit_breaker (CircuitBreaker): Breaker shared by all calls of the gateway.
+        rate_limiter (TokenBucketRateLimiter): Limiter of the deployment quotas shared by all concurrent comparisons.
+        client (AzureOpenAI): The pooled synchronous client.
+    """
+
+    def __init__(self, azure_endpoint=None, azure_api_key=None, max_retries=DEFAULT_MAX_RETRIES, circuit_breaker=None, rate_limiter=None):
+        """
+        Initializes the gateway and its connection pool.
+
+        Args:
+            azure_endpoint (str, optional): The Azure OpenAI endpoint. Defaults to the 'endpoint' environment variable.
+            azure_api_key (str, optional): The Azure OpenAI API key. Defaults to the 'api_key' environment variable.
+            max_retries (int): Retries of rate-limited, failed and timed out calls.
+            circuit_breaker (CircuitBreaker, optional): Breaker to use. Defaults to a new CircuitBreaker.
+            rate_limiter (TokenBucketRateLimiter, optional): Limiter to use. Defaults to a new limiter with the
+                'requests_per_minute' and 'tokens_per_minute' quotas.
+        """
+        self.resource_url, self.deployment, self.api_version = parse_endpoint(azure_endpoint or endpoint)
+        self.api_key = azure_api_key or api_key
+        self.max_retries = max_retries
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.rate_limiter = rate_limiter or TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+        self.timeout = httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+        self.limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+        self.client = AzureOpenAI(
+            azure_endpoint=self.resource_url,
+            api_key=self.api_key,
+            api_version=self.api_version,
+            timeout=self.timeout,
+            max_retries=max_retries,
+            http_client=httpx.Client(limits=self.limits, timeout=self.timeout)
+        )
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def create_async_client(self):
+        """
+        Creates a pooled asynchronous client for one event loop, with the SDK's own retries disabled.
+
+        The caller is expected to retry, e.g. through ConcurrentComparisonEngine.
+
+        Returns:
+            AsyncAzureOpenAI: The client.
+        """
+        return AsyncAzureOpenAI(
+            azure_endpoint=self.resource_url,
+            api_key=self.api_key,
+            api_version=self.api_version,
+            timeout=self.timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        )
+
+    def _record_call(self, operation, start_time, usage, success, error=None):
+        """
+        Records the metrics of a finished call and updates the circuit breaker.
+
+        Args:
+            operation (str): Name of the calling operation.
+            start_time (float): The perf_counter value when the call started.
+            usage: The usage object of the completion, if any.
+            success (bool): Whether the call succeeded.
+            error (Exception, optional): The error of a failed call. Rate-limited calls do not count toward the breaker.
+        """
+        if success:
+            self.circuit_breaker.record_success()
+        elif isinstance(error, RateLimitError):
+            self.circuit_breaker.record_throttled()
+        else:
+            self.circuit_breaker.record_failure()
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        usage_meter = _current_usage_meter.get()
+        if usage_meter is not None:
+            usage_meter.add(prompt_tokens, completion_tokens)
+        with self._lock:
+            self._calls.append({
+                "operation": operation,
+                "latency_seconds": time.perf_counter() - start_time,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "success": success
+            })
+
+    def parse(self, messages, response_format, operation="parse"):
+        """
+        Requests a structured completion and returns the object parsed by the SDK.
+
+        Args:
+            messages (list): The chat messages of the request.
+            response_format: The Pydantic model of the response.
+            operation (str): Name of the calling operation, used in the metrics.
+
+        Returns:
+            The parsed response, or None if the model refused to answer.
+        """
+        self.circuit_breaker.before_call()
+        start_time = time.perf_counter()
+        try:
+            completion = self.client.beta.chat.completions.parse(
+                model=self.deployment,
+                messages=messages,
+                response_format=response_format
+            )
+        except Exception as e:
+            self._record_call(operation, start_time, None, False, e)
+            raise
+        self._record_call(operation, start_time, completion.usage, True)
+        return completion.choices[0].message.parsed
+
+    async def aparse(self, async_client, messages, response_format, operation="parse"):
+        """
+        Requests a structured completion on an asynchronous client and returns the parsed object.
+
+        Args:
+            async_client (AsyncAzureOpenAI): A client created by create_async_client.
+            messages (list): The chat messages of the request.
+            response_format: The Pydantic model of the response.
+            operation (str): Name of the calling operation, used in the metrics.
+
+        Returns:
+            The parsed response, or None if the model refused to answer.
+        """
+        self.circuit_breaker.before_call()
+        start_time = time.perf_counter()
+        try:
+            completion = await async_client.beta.chat.completions.parse(
+                model=self.deployment,
+                messages=messages,
+                response_format=response_format
+            )
+        except Exception as e:
+            self._record_call(operation, start_time, None, False, e)
+            raise
+        self._record_call(operation, start_time, completion.usage, True)
+        return completion.choices[0].message.parsed
+
+    def chat(self, messages, max_tokens=4096, temperature=1, operation="chat", max_retries=None):
+        """
+        Requests a free-form completion.
+
+        Args:
+            messages (list): The chat messages of the request.
+            max_tokens (int): Maximum number of completion tokens.
+            temperature (float): Sampling temperature.
+            operation (str): Name of the calling operation, used in the metrics.
+            max_retries (int, optional): Overrides the gateway's retries, e.g. 0 when the caller retries itself.
+
+        Returns:
+            str: The content of the completion.
+        """
+        self.circuit_breaker.before_call()
+        client = self.client if max_retries is None else self.client.with_options(max_retries=max_retries)
+        start_time = time.perf_counter()
+        try:
+            completion = client.chat.completions.create(
+                model=self.deployment,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=1,
+                n=1
+            )
+        except Exception as e:
+            self._record_call(operation, start_time, None, False, e)
+            raise
+        self._record_call(operation, start_time, completion.usage, True)
+        return completion.choices[0].message.content
+
+    def stream_chat(self, messages, max_tokens=4096, temperature=1, operation="stream"):
+        """
+        Streams a free-form completion.
+
+        Args:
+            messages (list): The chat messages of the request.
+            max_tokens (int): Maximum number of completion tokens.
+            temperature (float): Sampling temperature.
+            operation (str): Name of the calling operation, used in the metrics.
+
+        Yields:
+            str: The content of each streamed token delta.
+        """
+        self.circuit_breaker.before_call()
+        start_time = time.perf_counter()
+        usage = None
+        stream = None
+        success = False
+        error = None
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.deployment,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=1,
+                n=1,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                # The last chunk carries the usage and no choices
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            success = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # A consumer that stops early (GeneratorExit, a rerun raised in a callback) counts as a failed call,
+            # so a half-open circuit breaker is never left waiting for its trial call
+            if stream is not None and not success:
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            self._record_call(operation, start_time, usage, success, error)
+
+    def metrics_summary(self):
+        """
+        Summarizes the calls made through the gateway since the last reset.
+
+        Returns:
+            dict: Call and failure counts, token totals and the mean and 95th percentile latency per operation.
+        """
+        with self._lock:
+            calls = list(self._calls)
+        summary = {}
+        for operation in sorted({call["operation"] for call in calls}):
+            operation_calls = [call for call in calls if call["operation"] == operation]
+            latencies = sorted(call["latency_seconds"] for call in operation_calls)
+            summary[operation] = {
+                "calls": len(operation_calls),
+                "failures": sum(not call["success"] for call in operation_calls),
+                "prompt_tokens": sum(call["prompt_tokens"] for call in operation_calls),
+                "completion_tokens": sum(call["completion_tokens"] for call in operation_calls),
+                "mean_latency_seconds": sum(latencies) / len(latencies),
+                "p95_latency_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            }
+        return summary
+
+    def log_metrics(self):
+        """
+        Logs the metrics summary of the gateway.
+        """
+        for operation, metrics in self.metrics_summary().items():
+            logger.info(f"LLM {operation}: {metrics['calls']} calls ({metrics['failures']} failed), "
+                  f"{metrics['prompt_tokens']} prompt + {metrics['completion_tokens']} completion tokens, "
+                  f"latency mean {metrics['mean_latency_seconds']:.2f}s p95 {metrics['p95_latency_seconds']:.2f}s")
+
+    def reset_metrics(self):
+        """
+        Clears the recorded call metrics, e.g. at the start of a batch.
+        """
+        with self._lock:
+            self._calls = []
+
+
+# Function to create the gateway of an endpoint once
+@lru_cache(maxsize=None)
+def _create_gateway(azure_endpoint, azure_api_key):
+    """
+    Creates the gateway of an endpoint and API key pair once per process.
+
+    Args:
+        azure_endpoint (str): The Azure OpenAI endpoint.
+        azure_api_key (str): The Azure OpenAI API key.
+
+    Returns:
+        LLMGateway: The gateway.
+    """
+    return LLMGateway(azure_endpoint, azure_api_key)
+
+
+# Function to get the shared gateway of an endpoint
+def get_gateway(azure_endpoint=None, azure_api_key=None):
+    """
+    Returns the gateway shared by all callers of an endpoint.
+
+    Args:
+        azure_endpoint (str, optional): The Azure OpenAI endpoint. Defaults to the 'endpoint' environment variable.
+        azure_api_key (str, optional): The Azure OpenAI API key. Defaults to the 'api_key' environment variable.
+
+    Returns:
+        LLMGateway: The gateway.
+    """
+    return _create_gateway(azure_endpoint or endpoint, azure_api_key or api_key)
@@ -0,0 +1,146 @@
+# Import necessary libraries and modules
+import re
+import hashlib
+import unicodedata
+from difflib import SequenceMatcher
+
+# Comparison result recorded for sections whose normalized texts are identical
+NO_CHANGE_SUMMARY = "No changes found in this section between the two versions of the document."
+
+# Typographic characters mapped to their plain equivalents before comparing
+TYPOGRAPHIC_REPLACEMENTS = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+    "\u2013": "-", "\u2014": "-", "\u2212": "-", "\u00a0": " ",
+})
+
+
+# Function to normalize text before comparing it
+def normalize_text(text):
+    """
+    Normalizes Unicode, hyphenation and whitespace so that layout-only differences are ignored.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    if not text:
+        return ""
+    # Fold compatibility characters such as ligatures and full-width forms
+    text = unicodedata.normalize("NFKC", text).translate(TYPOGRAPHIC_REPLACEMENTS)
+    # Drop soft hyphens and join words hyphenated across line breaks
+    text = text.replace("\u00ad", "")
+    text = re.sub(r'(\w)-[ \t]*\n\s*(\w)', r'\1\2', text)
+    # Collapse all whitespace runs into single spaces
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+# Function to hash a normalized text
+def text_fingerprint(text):
+    """
+    Returns a hash of the normalized text.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: The SHA-256 hex digest of the normalized text.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+# Function to find the changed hunks between two texts
+def get_changed_hunks(new_text, old_text, context_words=0):
+    """
+    Runs a word-level diff of two normalized texts.
+
+    Args:
+        new_text (str): The text from the new file.
+        old_text (str): The text from the old file.
+        context_words (int): Number of preceding words of the new text to include with each hunk. Defaults to 0.
+
+    Returns:
+        list: Dictionaries with the keys 'type' ('added', 'removed' or 'modified'), 'new_text' and 'old_text',
+            plus 'context' when context_words is set.
+    """
+    return diff_words(normalize_text(new_text).split(), normalize_text(old_text).split(), context_words)
+
+
+# Function to diff two word lists
+def diff_words(new_words, old_words, context_words=0):
+    """
+    Runs a word-level diff of two word lists.
+
+    Args:
+        new_words (list): Words of the new file text.
+        old_words (list): Words of the old file text.
+        context_words (int): Number of preceding words of the new text to include with each hunk. Defaults to 0.
+
+    Returns:
+        list: Dictionaries with the keys 'type' ('added', 'removed' or 'modified'), 'new_text' and 'old_text',
+            plus 'context' when context_words is set.
+    """
+    matcher = SequenceMatcher(None, old_words, new_words, autojunk=False)
+
+    hunks = []
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        hunk_type = {"insert": "added", "delete": "removed", "replace": "modified"}[tag]
+        hunk = {
+            "type": hunk_type,
+            "new_text": " ".join(new_words[new_start:new_end]),
+            "old_text": " ".join(old_words[old_start:old_end]),
+        }
+        if context_words:
+            hunk["context"] = " ".join(new_words[max(0, new_start - context_words):new_start])
+        hunks.append(hunk)
+    return hunks
+
+
+# Function to compute the diff statistics of a section pair
+def compute_diff_stats(new_text, old_text):
+    """
+    Compares a section pair locally and summarizes its changed hunks.
+
+    Identical normalized texts are detected by hash and skip the word-level diff.
+
+    Args:
+        new_text (str): The text from the new file.
+        old_text (str): The text from the old file.
+
+    Returns:
+        dict: The hashes, word counts, hunk counts and an 'identical' flag of the section pair.
+    """
+    # Normalize each text once and reuse it for hashing and diffing
+    normalized_new = normalize_text(new_text)
+    normalized_old = normalize_text(old_text)
+    new_hash = hashlib.sha256(normalized_new.encode("utf-8")).hexdigest()
+    old_hash = hashlib.sha256(normalized_old.encode("utf-8")).hexdigest()
+    new_words = normalized_new.split()
+    old_words = normalized_old.split()
+    diff_stats = {
+        "identical": new_hash == old_hash,
+        "new_hash": new_hash,
+        "old_hash": old_hash,
+        "new_word_count": len(new_words),
+        "old_word_count": len(old_words),
+        "hunks": 0,
+        "words_added": 0,
+        "words_removed": 0,
+        "words_modified": 0,
+    }
+    if diff_stats["identical"]:
+        return diff_stats
+
+    # Count the changed hunks and the words they touch
+    for hunk in diff_words(new_words, old_words):
+        diff_stats["hunks"] += 1
+        if hunk["type"] == "added":
+            diff_stats["words_added"] += len(hunk["new_text"].split())
+        elif hunk["type"] == "removed":
+            diff_stats["words_removed"] += len(hunk["old_text"].split())
+        else:
+            diff_stats["words_modified"] += max(len(hunk["new_text"].split()), len(hunk["old_text"].split()))
+    return diff_stats
@@ -0,0 +1,508 @@
+# Import necessary libraries and modules
+import re
+import math
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from local_diff import get_changed_hunks
+from token_counting import count_tokens
+
+# Latency distributions supported by the mock endpoint
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+# Maximum number of differences in a synthetic comparison
+MAX_SYNTHETIC_DIFFERENCES = 20
+# Number of words sent per streamed chunk
+STREAM_WORDS_PER_CHUNK = 3
+
+
+class LatencyModel:
+    """
+    Samples the injected latency of the mock endpoint from a seeded distribution.
+
+    Attributes:
+        distribution (str): One of LATENCY_DISTRIBUTIONS.
+        mean (float): Mean latency in seconds.
+        spread (float): Half-width for 'uniform', standard deviation for 'normal' and 'lognormal'.
+    """
+
+    def __init__(self, distribution="fixed", mean=0.0, spread=0.0, seed=0):
+        """
+        Initializes the latency model.
+
+        Args:
+            distribution (str): One of LATENCY_DISTRIBUTIONS.
+            mean (float): Mean latency in seconds.
+            spread (float): Half-width for 'uniform', standard deviation for 'normal' and 'lognormal'.
+            seed (int): Seed of the random generator, so runs are reproducible.
+
+        Raises:
+            ValueError: If the distribution is not supported.
+        """
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unsupported latency distribution '{distribution}', expected one of {LATENCY_DISTRIBUTIONS}")
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """
+        Samples one latency.
+
+        Returns:
+            float: The latency in seconds, never negative.
+        """
+        with self._lock:
+            if self.distribution == "uniform":
+                latency = self._random.uniform(self.mean - self.spread, self.mean + self.spread)
+            elif self.distribution == "normal":
+                latency = self._random.gauss(self.mean, self.spread)
+            elif self.distribution == "lognormal":
+                # Parameterize by the mean and standard deviation of the latency itself, giving a long right tail
+                if self.mean <= 0:
+                    return 0.0
+                variance_ratio = 1 + (self.spread / self.mean) ** 2
+                sigma = math.sqrt(math.log(variance_ratio))
+                mu = math.log(self.mean) - sigma ** 2 / 2
+                latency = self._random.lognormvariate(mu, sigma)
+            else:
+                latency = self.mean
+        return max(0.0, latency)
+
+
+# Function to build the key of a request for record and replay
+def make_request_key(payload):
+    """
+    Builds a stable key of a chat completions request from the fields that determine its answer.
+
+    Args:
+        payload (dict): The JSON body of the request.
+
+    Returns:
+        str: The SHA-256 hex digest of the request.
+    """
+    relevant_fields = {field: payload.get(field) for field in ("messages", "response_format", "temperature", "max_tokens", "stream")}
+    return hashlib.sha256(json.dumps(relevant_fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+# Function to build a synthetic structured comparison of two texts
+def build_synthetic_comparison(new_text, old_text):
+    """
+    Builds a deterministic comparison in the ComparisonResult schema from a local word diff.
+
+    Args:
+        new_text (str): The text from the new file.
+        old_text (str): The text from the old file.
+
+    Returns:
+        dict: The comparison with 'differences' and 'summary'.
+    """
+    hunks = get_changed_hunks(new_text, old_text)
+    differences = [{
+        "type": hunk["type"],
+        "description": f"Text {hunk['type']} in the new file",
+        "section": None,
+        "new_file_text": hunk["new_text"] or None,
+        "old_file_text": hunk["old_text"] or None,
+        "content": hunk["new_text"] or hunk["old_text"],
+        "position": None
+    } for hunk in hunks[:MAX_SYNTHETIC_DIFFERENCES]]
+    summary = f"{len(hunks)} changes found." if hunks else "No changes found."
+    return {"differences": differences, "summary": summary}
+
+
+# Function to build a synthetic Section/Change table of two documents
+def build_synthetic_table(new_text, old_text):
+    """
+    Builds a deterministic Section/Change markdown table from a local word diff.
+
+    Args:
+        new_text (str): Text of the new document.
+        old_text (str): Text of the old document.
+
+    Returns:
+        str: The markdown table.
+    """
+    lines = ["| Section | Change |", "|---------|--------|"]
+    for index, hunk in enumerate(get_changed_hunks(new_text, old_text)[:MAX_SYNTHETIC_DIFFERENCES]):
+        change = f"{hunk['type'].capitalize()}: '{hunk['old_text']}' -> '{hunk['new_text']}'".replace("|", "/")
+        lines.append(f"| Change {index + 1} | {change} |")
+    if len(lines) == 2:
+        lines.append("| Entire document | No changes |")
+    return "\n".join(lines)
+
+
+# Function to answer a chat completions request with synthetic content
+def build_synthetic_content(payload):
+    """
+    Builds the assistant content for a request from the prompts used by the comparison pipeline.
+
+    Structured requests get JSON in the requested schema: one result per '### Section id:' block for
+    packed requests, a single comparison otherwise. Free-form requests get a Section/Change table.
+
+    Args:
+        payload (dict): The JSON body of the request.
+
+    Returns:
+        str: The assistant content.
+    """
+    user_content = next((message.get("content") or "" for message in reversed(payload.get("messages", [])) if message.get("role") == "user"), "")
+    response_format = payload.get("response_format") or {}
+
+    if response_format.get("type") == "json_schema":
+        schema_name = (response_format.get("json_schema") or {}).get("name", "")
+        if schema_name == "PackedComparisonResult" or "### Section id:" in user_content:
+            results = []
+            for block in re.split(r'^### Section id: ', user_content, flags=re.MULTILINE)[1:]:
+                section_id, _, body = block.partition("\n")
+                new_text, _, old_text = body.partition("\n\nOld File text: ")
+                comparison = build_synthetic_comparison(new_text.replace("New File text: ", "", 1), old_text)
+                results.append({"section_id": section_id.strip(), **comparison})
+            return json.dumps({"results": results})
+        new_text, _, old_text = user_content.partition("\n\nOld File text: ")
+        return json.dumps(build_synthetic_comparison(new_text.split("New File text: ", 1)[-1], old_text))
+
+    # Refinement passes already carry the previous table; return it unchanged
+    if "Preliminary comparison:" in user_content:
+        previous_table = user_content.split("Preliminary comparison:", 1)[1].split("Changes found by the word-level diff:", 1)[0]
+        return previous_table.strip()
+    new_text, _, old_text = user_content.partition("\n\nOlder Version:\n")
+    return build_synthetic_table(new_text.split("Newer Version:\n", 1)[-1], old_text)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the Azure OpenAI chat completions endpoint.
+
+    The server speaks the chat completions protocol, including structured outputs and streaming, with
+    configurable latency and injected 429 responses. It can record the answers of a real endpoint and
+    replay them later, so benchmarks run reproducibly offline. Point the pipeline at it by setting
+    `endpoint` to its url.
+
+    Attributes:
+        latency_model (LatencyModel): Latency injected before every answer.
+        rate_limit_probability (float): Probability of answering a request with 429.
+        rate_limit_every (int): Answer every n-th request with 429; 0 disables it.
+        retry_after_seconds (float): Retry-After sent with injected 429 responses.
+        record_path (str | None): File the answers of the upstream endpoint are appended to.
+        replay_path (str | None): File of recorded answers to replay.
+        upstream_endpoint (str | None): Real endpoint forwarded to while recording.
+        upstream_api_key (str | None): API key of the upstream endpoint.
+        stats (dict): Counts of requests, rate-limited requests, replay hits and misses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency_model=None, rate_limit_probability=0.0, rate_limit_every=0,
+                 retry_after_seconds=1.0, record_path=None, replay_path=None, upstream_endpoint=None, upstream_api_key=None, seed=0):
+        """
+        Initializes the server without starting it.
+
+        Args:
+            host (str): Host to bind to.
+            port (int): Port to bind to; 0 picks a free port.
+            latency_model (LatencyModel, optional): Latency injected before every answer. Defaults to no latency.
+            rate_limit_probability (float): Probability of answering a request with 429.
+            rate_limit_every (int): Answer every n-th request with 429; 0 disables it.
+            retry_after_seconds (float): Retry-After sent with injected 429 responses.
+            record_path (str, optional): File the answers of the upstream endpoint are appended to.
+            replay_path (str, optional): File of recorded answers to replay.
+            upstream_endpoint (str, optional): Real endpoint forwarded to while recording.
+            upstream_api_key (str, optional): API key of the upstream endpoint.
+            seed (int): Seed of the 429 injection, so runs are reproducible.
+
+        Raises:
+            ValueError: If recording is requested without an upstream endpoint.
+        """
+        if record_path and not upstream_endpoint:
+            raise ValueError("Recording requires an upstream endpoint")
+        super().__init__((host, port), MockOpenAIRequestHandler)
+        self.latency_model = latency_model or LatencyModel()
+        self.rate_limit_probability = rate_limit_probability
+        self.rate_limit_every = rate_limit_every
+        self.retry_after_seconds = retry_after_seconds
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.upstream_endpoint = upstream_endpoint
+        self.upstream_api_key = upstream_api_key
+        self.stats = {"requests": 0, "rate_limited": 0, "replay_hits": 0, "replay_misses": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._recordings = {}
+        if replay_path:
+            with open(replay_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        recording = json.loads(line)
+                        self._recordings[recording["key"]] = recording
+
+    @property
+    def url(self):
+        """
+        The base url of the server, usable as the `endpoint` of the pipeline.
+        """
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+
+        Returns:
+            MockOpenAIServer: The server itself.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and releases the port.
+        """
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def should_rate_limit(self):
+        """
+        Counts a request and decides whether to answer it with 429.
+
+        Returns:
+            bool: True if the request should be rate limited.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            limited = (self.rate_limit_every and self.stats["requests"] % self.rate_limit_every == 0) or \
+                self._random.random() < self.rate_limit_probability
+            if limited:
+                self.stats["rate_limited"] += 1
+            return bool(limited)
+
+    def get_recording(self, key):
+        """
+        Looks up a recorded answer.
+
+        Args:
+            key (str): The key returned by make_request_key.
+
+        Returns:
+            dict | None: The recording, or None if the request was not recorded.
+        """
+        recording = self._recordings.get(key)
+        with self._lock:
+            self.stats["replay_hits" if recording else "replay_misses"] += 1
+        return recording
+
+    def record(self, key, status, content_type, body):
+        """
+        Appends an answer of the upstream endpoint to the recording file.
+
+        Args:
+            key (str): The key returned by make_request_key.
+            status (int): HTTP status of the answer.
+            content_type (str): Content type of the answer.
+            body (bytes): Body of the answer.
+        """
+        recording = {"key": key, "status": status, "content_type": content_type, "body": body.decode("utf-8")}
+        with self._lock:
+            self._recordings[key] = recording
+            with open(self.record_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(recording, ensure_ascii=False) + "\n")
+
+
+class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the chat completions requests of a MockOpenAIServer.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        """
+        Answers a chat completions request.
+        """
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.split("?", 1)[0].endswith("/chat/completions"):
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+        payload = json.loads(body or b"{}")
+
+        time.sleep(self.server.latency_model.sample())
+        if self.server.should_rate_limit():
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                           {"Retry-After": str(self.server.retry_after_seconds)})
+            return
+
+        key = make_request_key(payload)
+        if self.server.record_path:
+            self.forward_and_record(key, body)
+            return
+        if self.server.replay_path:
+            recording = self.server.get_recording(key)
+            if recording:
+                self.send_body(recording["status"], recording["content_type"], recording["body"].encode("utf-8"))
+                return
+
+        content = build_synthetic_content(payload)
+        if payload.get("stream"):
+            self.send_stream(payload, content)
+        else:
+            self.send_json(200, self.build_completion(payload, content))
+
+    def build_completion(self, payload, content):
+        """
+        Wraps assistant content in a chat completion object.
+
+        Args:
+            payload (dict): The JSON body of the request.
+            content (str): The assistant content.
+
+        Returns:
+            dict: The chat completion.
+        """
+        prompt_tokens = sum(count_tokens(message.get("content") or "") for message in payload.get("messages", []))
+        completion_tokens = count_tokens(content)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model") or "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def send_stream(self, payload, content):
+        """
+        Streams assistant content as server-sent events, a few words per chunk.
+
+        Args:
+            payload (dict): The JSON body of the request.
+            content (str): The assistant content.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_event(data):
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        base_chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": payload.get("model") or "gpt-4o"}
+        words = re.findall(r'\S+\s*|\s+', content)
+        for start in range(0, len(words), STREAM_WORDS_PER_CHUNK):
+            delta = "".join(words[start:start + STREAM_WORDS_PER_CHUNK])
+            send_event(json.dumps({**base_chunk, "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}))
+        send_event(json.dumps({**base_chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({**base_chunk, "choices": [], "usage": self.build_completion(payload, content)["usage"]}))
+        send_event("[DONE]")
+
+    def forward_and_record(self, key, body):
+        """
+        Forwards a request to the upstream endpoint, records its answer and returns it.
+
+        Args:
+            key (str): The key returned by make_request_key.
+            body (bytes): The raw request body.
+        """
+        upstream_url = self.server.upstream_endpoint.rstrip("/") + self.path
+        request = urllib.request.Request(upstream_url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "api-key": self.server.upstream_api_key or self.headers.get("api-key", "")
+        })
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, content_type, response_body = response.status, response.headers.get("Content-Type", "application/json"), response.read()
+        except urllib.error.HTTPError as e:
+            status, content_type, response_body = e.code, e.headers.get("Content-Type", "application/json"), e.read()
+        # Only successful answers are worth replaying
+        if status == 200:
+            self.server.record(key, status, content_type, response_body)
+        self.send_body(status, content_type, response_body)
+
+    def send_json(self, status, data, headers=None):
+        """
+        Sends a JSON response.
+
+        Args:
+            status (int): HTTP status.
+            data (dict): The response body.
+            headers (dict, optional): Additional headers.
+        """
+        self.send_body(status, "application/json", json.dumps(data).encode("utf-8"), headers)
+
+    def send_body(self, status, content_type, body, headers=None):
+        """
+        Sends a complete response.
+
+        Args:
+            status (int): HTTP status.
+            content_type (str): Content type of the body.
+            body (bytes): The response body.
+            headers (dict, optional): Additional headers.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Silences the per-request access log.
+        """
+
+
+# Main execution logic to run the mock endpoint on its own
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the Azure OpenAI chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind to")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind to")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="fixed", help="Latency distribution")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="Mean latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.0, help="Half-width (uniform) or standard deviation (normal, lognormal) in seconds")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="Probability of answering with 429")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every n-th request with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After in seconds sent with 429 answers")
+    parser.add_argument("--record", help="Forward requests to --upstream and append its answers to this file")
+    parser.add_argument("--replay", help="Replay answers recorded in this file; unrecorded requests get synthetic answers")
+    parser.add_argument("--upstream", help="Real endpoint to forward to while recording")
+    parser.add_argument("--upstream-api-key", help="API key of the real endpoint")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latency and 429 answers")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency_model=LatencyModel(args.latency, args.latency_mean, args.latency_spread, args.seed),
+        rate_limit_probability=args.rate_limit_probability,
+        rate_limit_every=args.rate_limit_every,
+        retry_after_seconds=args.retry_after,
+        record_path=args.record,
+        replay_path=args.replay,
+        upstream_endpoint=args.upstream,
+        upstream_api_key=args.upstream_api_key,
+        seed=args.seed
+    )
+    print(f"Mock endpoint listening on {server.url} (set endpoint = \"{server.url}\" in .env)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stopped after {server.stats}")
+        server.server_close()
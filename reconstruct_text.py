@@ -1,8 +1,11 @@
 # Import necessary libraries and modules
+import logging
 import os
 from pymongo.mongo_client import MongoClient
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 
 load_dotenv()
 # Load environment variables from .env file
@@ -14,9 +17,9 @@ client = MongoClient(uri)
 # Send a ping to confirm a successful connection
 try:
     client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
+    logger.info("Pinged your deployment. You successfully connected to MongoDB!")
 except Exception as e:
-    print(e)
+    logger.error(e)
 
 # Access the capstone database
 capstone_db = client['capstone_db']
@@ -24,15 +27,9 @@ capstone_db = client['capstone_db']
 # Access the adobe_api_json_outputs collection
 adobe_api_json_outputs_db = capstone_db['adobe_api_json_outputs']
 
-# Count documents in the adobe_api_json_outputs collection
-adobe_api_json_outputs_db.count_documents({})
-
 # Access the documents_data collection
 documents_data_db = capstone_db['documents_data']
 
-# Count documents in the documents_data collection
-documents_data_db.count_documents({})
-
 # Function to find all PDF files in a directory (including nested directories)
 def find_all_pdfs(root_folder):
     """
@@ -144,10 +141,10 @@ def update_documents_data_db(file_name, text, db_collection):
         # Check the result
         if result.matched_count > 0:
             if result.modified_count > 0:
-                print("Document updated successfully!")
+                logger.info("Document updated successfully!")
             else:
-                print("Document found, but no changes were made.")
+                logger.info("Document found, but no changes were made.")
         else:
-            print("No document found with the specified file_name.")
+            logger.error("No document found with the specified file_name.")
     else:
-        print(f"{file_name} not found in the database")
+        logger.error(f"{file_name} not found in the database")
@@ -0,0 +1,313 @@
+# Import necessary libraries and modules
+import logging
+import re
+from difflib import SequenceMatcher
+from adobe_PDF_extract_API import ExtractTextInfoFromPDF
+from heading_locator import HeadingLocator
+from token_counting import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Default token budget for a single comparison unit (new and old text combined)
+DEFAULT_SECTION_TOKEN_BUDGET = 6000
+
+
+# Function to build the heading tree of a document with text offsets
+def build_heading_tree(json_data, cleaned_text, regex_pattern=r'^\d+(\.\d+)*\s+'):
+    """
+    Builds a nested H1 to H6 heading tree for a document and locates every heading in its cleaned text.
+
+    Args:
+        json_data (dict): Adobe API JSON data of the document.
+        cleaned_text (str): Cleaned text of the document.
+        regex_pattern (str, optional): Regex pattern for cleaning headings. Defaults to r'^\\d+(\\.\\d+)*\\s+'.
+
+    Returns:
+        list: The top-level heading nodes. Each node is a dictionary with the keys
+            'key' (cleaned heading), 'text' (original heading), 'level', 'start', 'end' and 'children'.
+    """
+    section_headings = ExtractTextInfoFromPDF.get_section_headings(json_data, max_level=6)
+    # Scan the cleaned text once for all headings
+    locator = HeadingLocator(cleaned_text, [heading["text"] for heading in section_headings])
+
+    # Locate headings in document order, skipping the ones that cannot be found
+    located_nodes = []
+    cursor = 0
+    for heading in section_headings:
+        key = re.sub(regex_pattern, '', heading["text"]).strip()
+        if key == '':
+            continue
+        start = locator.find(heading["text"], cursor)
+        if start == -1:
+            continue
+        located_nodes.append({"key": key, "text": heading["text"], "level": heading["level"], "start": start, "end": len(cleaned_text), "children": []})
+        cursor = start + len(heading["text"])
+
+    # Nest the headings by level and close each section at the next heading of the same or a higher level
+    roots = []
+    stack = []
+    for node in located_nodes:
+        while stack and stack[-1]["level"] >= node["level"]:
+            stack.pop()["end"] = node["start"]
+        if stack:
+            stack[-1]["children"].append(node)
+        else:
+            roots.append(node)
+        stack.append(node)
+
+    return roots
+
+
+# Function to match the child headings of two aligned sections
+def align_heading_nodes(new_nodes, old_nodes):
+    """
+    Aligns two lists of sibling heading nodes by their cleaned heading text, preserving document order.
+
+    Args:
+        new_nodes (list): Heading nodes of the new file.
+        old_nodes (list): Heading nodes of the old file.
+
+    Returns:
+        list: Tuples of matched (new_node, old_node) pairs in document order.
+    """
+    matcher = SequenceMatcher(None, [node["key"] for node in new_nodes], [node["key"] for node in old_nodes], autojunk=False)
+    matched_pairs = []
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            matched_pairs.append((new_nodes[block.a + offset], old_nodes[block.b + offset]))
+    return matched_pairs
+
+
+# Function to split an aligned pair of sections into comparison units
+def split_aligned_section(label, new_range, old_range, new_children, old_children, cleaned_text_new, cleaned_text_old, token_budget, label_prefix="", split_always=False):
+    """
+    Recursively splits an aligned pair of sections into the smallest matched subsections that fit the token budget.
+
+    Args:
+        label (str): Label of the section, used as the heading of its units.
+        new_range (tuple): Start and end offsets of the section in the new file.
+        old_range (tuple): Start and end offsets of the section in the old file.
+        new_children (list): Child heading nodes of the section in the new file.
+        old_children (list): Child heading nodes of the section in the old file.
+        cleaned_text_new (str): Cleaned text of the new file.
+        cleaned_text_old (str): Cleaned text of the old file.
+        token_budget (int): Maximum tokens of new and old text combined for a single unit.
+        label_prefix (str): Prefix for the labels of the subsections. Defaults to "".
+        split_always (bool): Split into children even when the section fits the budget. Defaults to False.
+
+    Returns:
+        list: Tuples of (label, new_text, old_text) in document order.
+    """
+    section_text_new = cleaned_text_new[new_range[0]:new_range[1]]
+    section_text_old = cleaned_text_old[old_range[0]:old_range[1]]
+
+    # Keep the section whole when it fits the budget
+    if not split_always and count_tokens(section_text_new) + count_tokens(section_text_old) <= token_budget:
+        return [(label, section_text_new, section_text_old)]
+
+    matched_pairs = align_heading_nodes(new_children, old_children)
+    if not matched_pairs:
+        return [(label, section_text_new, section_text_old)]
+
+    units = []
+    # Text before the first matched subsection belongs to the section itself
+    intro_text_new = cleaned_text_new[new_range[0]:matched_pairs[0][0]["start"]]
+    intro_text_old = cleaned_text_old[old_range[0]:matched_pairs[0][1]["start"]]
+    if intro_text_new.strip() or intro_text_old.strip():
+        units.append((label, intro_text_new, intro_text_old))
+
+    # Each matched subsection runs until the next matched subsection, absorbing unmatched ones in between
+    for index, (new_node, old_node) in enumerate(matched_pairs):
+        if index + 1 < len(matched_pairs):
+            new_end, old_end = matched_pairs[index + 1][0]["start"], matched_pairs[index + 1][1]["start"]
+        else:
+            new_end, old_end = new_range[1], old_range[1]
+        child_label = f"{label_prefix}{new_node['key']}"
+        units.extend(split_aligned_section(
+            child_label,
+            (new_node["start"], new_end),
+            (old_node["start"], old_end),
+            new_node["children"],
+            old_node["children"],
+            cleaned_text_new,
+            cleaned_text_old,
+            token_budget,
+            label_prefix=f"{child_label} > "))
+
+    return units
+
+
+# Function to extract aligned comparison units from the heading trees of both files
+def get_hierarchical_section_texts(new_file_json, old_file_json, cleaned_text_new, cleaned_text_old, token_budget=DEFAULT_SECTION_TOKEN_BUDGET):
+    """
+    Extracts aligned section texts by recursing into the H1 to H6 heading trees of both files.
+
+    Top-level sections are always aligned. A matched section that exceeds the token budget is split into
+    its matched subsections, so each comparison unit is the smallest matched subsection under the budget.
+
+    Args:
+        new_file_json (dict): Adobe API JSON data of the new file.
+        old_file_json (dict): Adobe API JSON data of the old file.
+        cleaned_text_new (str): Cleaned text of the new file.
+        cleaned_text_old (str): Cleaned text of the old file.
+        token_budget (int, optional): Maximum tokens of new and old text combined for a single unit.
+            Defaults to DEFAULT_SECTION_TOKEN_BUDGET.
+
+    Returns:
+        list: List of lists containing the section heading, new text, old text and next section heading,
+            in the same layout as get_section_texts.
+    """
+    new_roots = build_heading_tree(new_file_json, cleaned_text_new)
+    old_roots = build_heading_tree(old_file_json, cleaned_text_old)
+    return align_heading_trees(new_roots, old_roots, cleaned_text_new, cleaned_text_old, token_budget)
+
+
+# Function to extract aligned comparison units from two built heading trees
+def align_heading_trees(new_roots, old_roots, cleaned_text_new, cleaned_text_old, token_budget=DEFAULT_SECTION_TOKEN_BUDGET):
+    """
+    Extracts aligned section texts from heading trees built with build_heading_tree.
+
+    The trees are only read, so the tree of a document can be built once and aligned against several others.
+
+    Args:
+        new_roots (list): Top-level heading nodes of the new file.
+        old_roots (list): Top-level heading nodes of the old file.
+        cleaned_text_new (str): Cleaned text of the new file.
+        cleaned_text_old (str): Cleaned text of the old file.
+        token_budget (int, optional): Maximum tokens of new and old text combined for a single unit.
+            Defaults to DEFAULT_SECTION_TOKEN_BUDGET.
+
+    Returns:
+        list: List of lists containing the section heading, new text, old text and next section heading.
+    """
+    if not align_heading_nodes(new_roots, old_roots):
+        return [["Entire document", cleaned_text_new, cleaned_text_old, "Entire document was provided"]]
+
+    units = split_aligned_section(
+        "Initial content",
+        (0, len(cleaned_text_new)),
+        (0, len(cleaned_text_old)),
+        new_roots,
+        old_roots,
+        cleaned_text_new,
+        cleaned_text_old,
+        token_budget,
+        split_always=True)
+
+    # Link each unit to the heading of the unit that follows it
+    list_of_section_texts = []
+    for index, (label, section_text_new, section_text_old) in enumerate(units):
+        next_heading = units[index + 1][0] if index + 1 < len(units) else "Last section: No section after this."
+        list_of_section_texts.append([label, section_text_new, section_text_old, next_heading])
+
+    logger.info(f"Total section heading pairs: {len(list_of_section_texts)}")
+
+    return list_of_section_texts
+
+
+# Function to match the child headings of several versions of a section
+def align_heading_node_lists(node_lists):
+    """
+    Aligns the sibling heading nodes of several versions, keeping the headings found in every version.
+
+    Each version is aligned against the previous one, so the result agrees with the alignment of every
+    pair of adjacent versions.
+
+    Args:
+        node_lists (list): Heading nodes of each version, from newest to oldest.
+
+    Returns:
+        list: Tuples with the matched node of every version, in document order.
+    """
+    matched_nodes = [(node,) for node in node_lists[0]]
+    for nodes in node_lists[1:]:
+        matched_pairs = align_heading_nodes([matched[-1] for matched in matched_nodes], nodes)
+        next_node = {id(previous_node): node for previous_node, node in matched_pairs}
+        matched_nodes = [matched + (next_node[id(matched[-1])],) for matched in matched_nodes if id(matched[-1]) in next_node]
+    return matched_nodes
+
+
+# Function to split an aligned section of several versions into comparison units
+def split_aligned_version_section(label, ranges, children_lists, cleaned_texts, token_budget, label_prefix="", split_always=False):
+    """
+    Recursively splits a section aligned across several versions into the smallest matched subsections
+    in which any two versions together fit the token budget.
+
+    Args:
+        label (str): Label of the section, used as the heading of its units.
+        ranges (list): Start and end offsets of the section in each version.
+        children_lists (list): Child heading nodes of the section in each version.
+        cleaned_texts (list): Cleaned text of each version.
+        token_budget (int): Maximum tokens of two versions combined for a single unit.
+        label_prefix (str): Prefix for the labels of the subsections. Defaults to "".
+        split_always (bool): Split into children even when the section fits the budget. Defaults to False.
+
+    Returns:
+        list: Tuples of (label, texts) in document order, with the text of the unit in each version.
+    """
+    section_texts = [cleaned_text[start:end] for cleaned_text, (start, end) in zip(cleaned_texts, ranges)]
+
+    # Keep the section whole when its two largest versions fit the budget together
+    if not split_always and sum(sorted(count_tokens(section_text) for section_text in section_texts)[-2:]) <= token_budget:
+        return [(label, section_texts)]
+
+    matched_nodes = align_heading_node_lists(children_lists)
+    if not matched_nodes:
+        return [(label, section_texts)]
+
+    units = []
+    intro_texts = [cleaned_text[start:node["start"]] for cleaned_text, (start, _), node in zip(cleaned_texts, ranges, matched_nodes[0])]
+    if any(intro_text.strip() for intro_text in intro_texts):
+        units.append((label, intro_texts))
+
+    for index, nodes in enumerate(matched_nodes):
+        if index + 1 < len(matched_nodes):
+            ends = [node["start"] for node in matched_nodes[index + 1]]
+        else:
+            ends = [end for _, end in ranges]
+        child_label = f"{label_prefix}{nodes[0]['key']}"
+        units.extend(split_aligned_version_section(
+            child_label,
+            [(node["start"], end) for node, end in zip(nodes, ends)],
+            [node["children"] for node in nodes],
+            cleaned_texts,
+            token_budget,
+            label_prefix=f"{child_label} > "))
+
+    return units
+
+
+# Function to extract comparison units aligned across several versions of a document
+def align_version_heading_trees(heading_trees, cleaned_texts, token_budget=DEFAULT_SECTION_TOKEN_BUDGET):
+    """
+    Aligns the heading trees of several versions of a document in one pass, so every pair of versions
+    is compared over the same units.
+
+    Args:
+        heading_trees (list): Heading tree of each version, from newest to oldest, as returned by build_heading_tree.
+        cleaned_texts (list): Cleaned text of each version.
+        token_budget (int, optional): Maximum tokens of two versions combined for a single unit.
+            Defaults to DEFAULT_SECTION_TOKEN_BUDGET.
+
+    Returns:
+        list: Lists containing the section heading, the texts of the section in each version and the next section heading.
+    """
+    if not align_heading_node_lists(heading_trees):
+        return [["Entire document", list(cleaned_texts), "Entire document was provided"]]
+
+    units = split_aligned_version_section(
+        "Initial content",
+        [(0, len(cleaned_text)) for cleaned_text in cleaned_texts],
+        heading_trees,
+        cleaned_texts,
+        token_budget,
+        split_always=True)
+
+    aligned_units = []
+    for index, (label, section_texts) in enumerate(units):
+        next_heading = units[index + 1][0] if index + 1 < len(units) else "Last section: No section after this."
+        aligned_units.append([label, section_texts, next_heading])
+
+    logger.info(f"Total sections aligned across {len(cleaned_texts)} versions: {len(aligned_units)}")
+
+    return aligned_units
@@ -1,14 +1,20 @@
 # Import necessary libraries and modules
+import logging
 import os
+import hashlib
+import threading
 import fitz  # PyMuPDF for text extraction from PDF
 from collections import defaultdict
-import tiktoken
+from token_counting import get_encoder
 from pymongo.mongo_client import MongoClient
 from reconstruct_text import reconstruct_document_exclude_toc, get_adobe_api_json_outputs_db
 from tqdm import tqdm
+from tracing import trace_run, trace_span, RUNS_COLLECTION_NAME
 import re
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 # Load environment variables from .env file
 uri = os.getenv('uri')
@@ -23,21 +29,26 @@ documents_data_db = capstone_db['documents_data']
 # Select the 'adobe_api_json_outputs' collection
 adobe_api_json_outputs_db = capstone_db['adobe_api_json_outputs']
 
+# PyMuPDF is not thread-safe, so documents prepared concurrently are opened one at a time
+_pymupdf_lock = threading.Lock()
+
 # Function to extract text from each page of the PDF
-def extract_page_texts(file_path):
+def extract_page_texts(file_path=None, pdf_bytes=None):
     """
     Extracts text from each page of a PDF file.
 
     Args:
-        file_path (str): The path to the PDF file.
+        file_path (str, optional): The path to the PDF file.
+        pdf_bytes (bytes, optional): The content of the PDF file, opened in memory instead of from the path.
 
     Returns:
         tuple: A tuple containing a list of page texts and the total number of pages.
     """
-    # Open the PDF file
-    doc = fitz.open(file_path)
-    # Extract text from each page
-    page_texts = [page.get_text() for page in doc]
+    with _pymupdf_lock:
+        # Open the PDF file
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf") if pdf_bytes is not None else fitz.open(file_path)
+        # Extract text from each page
+        page_texts = [page.get_text() for page in doc]
     # Get the total number of pages
     total_pages = len(page_texts)
     return page_texts, total_pages
@@ -152,53 +163,137 @@ def count_tokens(text, model="gpt-4o"):
     Returns:
         int: The number of tokens in the text.
     """
-    # Initialize the tokenizer for GPT-4o (assuming it behaves similarly to other OpenAI models)
-    encoder = tiktoken.encoding_for_model(model)
+    # Reuse the cached tokenizer for GPT-4o (assuming it behaves similarly to other OpenAI models)
+    encoder = get_encoder(model)
     
     # Encode the text and count tokens
     tokens = encoder.encode(text)
     return len(tokens)
 
+# Function to hash the content of a PDF file
+def get_content_hash(pdf_bytes):
+    """
+    Hashes the content of a PDF file, identifying a document independently of its file name.
+
+    Args:
+        pdf_bytes (bytes): The content of the PDF file.
+
+    Returns:
+        str: The SHA-256 hex digest of the content.
+    """
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+# Function to hash the content of a PDF file on disk
+def get_file_content_hash(file_path):
+    """
+    Hashes the content of a PDF file on disk with get_content_hash.
+
+    Args:
+        file_path (str): Path to the PDF file.
+
+    Returns:
+        str: The SHA-256 hex digest of the content.
+    """
+    with open(file_path, 'rb') as file:
+        return get_content_hash(file.read())
+
+
+# Function to find a processed document by its content
+def find_document_by_hash(content_hash, db_collection=documents_data_db):
+    """
+    Finds the name under which a document with the given content was processed.
+
+    Args:
+        content_hash (str): The SHA-256 hex digest of the document content.
+        db_collection: The 'documents_data' collection. Defaults to the module's collection.
+
+    Returns:
+        str | None: The stored file name, or None if no document with this content was processed.
+    """
+    document = db_collection.find_one({"content_hash": content_hash}, {"file_name": 1})
+    return document["file_name"] if document else None
+
+
+# Function to choose the name a document is stored under
+def resolve_document_name(file_name, content_hash, db_collection=documents_data_db, adobe_collection=adobe_api_json_outputs_db):
+    """
+    Identifies a document by its content, using its file name only when no other content is stored under it.
+
+    Args:
+        file_name (str): Base name of the uploaded file.
+        content_hash (str): The SHA-256 hex digest of the document content.
+        db_collection: The 'documents_data' collection. Defaults to the module's collection.
+        adobe_collection: The 'adobe_api_json_outputs' collection. Defaults to the module's collection.
+
+    Returns:
+        str: The stored name of a known document, the file name if it is free, or otherwise the file name
+            qualified with the content hash, so a new revision never reuses the outputs of an older one.
+    """
+    stored_name = find_document_by_hash(content_hash, db_collection)
+    if stored_name:
+        return stored_name
+    # The name is taken by different or unverifiable content, such as a document processed before hashing
+    name_taken = (db_collection.count_documents({"file_name": file_name}, limit=1) > 0
+                  or adobe_collection.count_documents({"file_name": file_name}, limit=1) > 0)
+    return f"{file_name}_{content_hash[:12]}" if name_taken else file_name
+
+
 # Main function to process a PDF file and upload data to MongoDB
-def process_and_upload_pdf(file_path):
+def process_and_upload_pdf(file_path, pdf_bytes=None):
     """
     Processes a PDF file to extract and clean text, then uploads the data to MongoDB.
 
     Args:
-        file_path (str): The path to the PDF file.
+        file_path (str): The path to the PDF file; only its name is used when the content is given.
+        pdf_bytes (bytes, optional): The content of the PDF file. Defaults to reading the file.
     """
     # Get the file name without extension
     file_name = os.path.splitext(os.path.basename(file_path))[0]
-    # Extract text from each page of the PDF
-    page_texts, total_pages = extract_page_texts(file_path)
-    # Detect repeated headers and footers
-    headers, footers = detect_repeated_headers_footers(page_texts)
-    # Remove headers and footers from the page texts
-    cleaned_pages = remove_headers_footers(page_texts, headers, footers)
-    # Get the JSON output from the Adobe API
-    adobe_api_json_output = get_adobe_api_json_outputs_db(file_name, adobe_api_json_outputs_db)
-
-    # Reconstruct the document text excluding the table of contents
-    cleaned_text = reconstruct_document_exclude_toc(adobe_api_json_output)
-
-    # Count the number of tokens in the cleaned text
-    token_count = count_tokens(cleaned_text)
-
-    # Create document data
-    document_data = {
-        "file_name": file_name,
-        "cleaned_text": cleaned_text,
-        "cleaned_pages": cleaned_pages,
-        "headers": list(headers),
-        "footers": list(footers),
-        "total_pages": total_pages,
-        "token_count": token_count
-    }
+    # Read the file once; the text is extracted from the bytes in memory
+    if pdf_bytes is None:
+        with open(file_path, "rb") as file:
+            pdf_bytes = file.read()
+
+    with trace_run(file_name, capstone_db[RUNS_COLLECTION_NAME]):
+        # Extract text from each page of the PDF
+        with trace_span("extract", file_name=file_name) as span:
+            page_texts, total_pages = extract_page_texts(pdf_bytes=pdf_bytes)
+            span.set(bytes=len(pdf_bytes), pages=total_pages)
+
+        # Get the JSON output from the Adobe API
+        with trace_span("ingest", file_name=file_name):
+            adobe_api_json_output = get_adobe_api_json_outputs_db(file_name, adobe_api_json_outputs_db)
+
+        with trace_span("clean", file_name=file_name) as span:
+            # Detect repeated headers and footers
+            headers, footers = detect_repeated_headers_footers(page_texts)
+            # Remove headers and footers from the page texts
+            cleaned_pages = remove_headers_footers(page_texts, headers, footers)
+            # Reconstruct the document text excluding the table of contents
+            cleaned_text = reconstruct_document_exclude_toc(adobe_api_json_output)
+            # Count the number of tokens in the cleaned text
+            token_count = count_tokens(cleaned_text)
+            span.set(bytes=len(cleaned_text.encode("utf-8")), tokens=token_count)
+
+        # Create document data
+        document_data = {
+            "file_name": file_name,
+            "content_hash": get_content_hash(pdf_bytes),
+            "cleaned_text": cleaned_text,
+            "cleaned_pages": cleaned_pages,
+            "headers": list(headers),
+            "footers": list(footers),
+            "total_pages": total_pages,
+            "token_count": token_count
+        }
 
-    # Upload to MongoDB
-    documents_data_db.update_one(
-        {"file_name": file_name},
-        {"$set": document_data},
-        upsert=True
-    )
-    print(f"Processed and uploaded {file_name} to documents_data collection.")
+        # Upload to MongoDB
+        with trace_span("upload", file_name=file_name):
+            documents_data_db.create_index("content_hash")
+            documents_data_db.update_one(
+                {"file_name": file_name},
+                {"$set": document_data},
+                upsert=True
+            )
+    logger.info(f"Processed and uploaded {file_name} to documents_data collection.")
\ No newline at end of file
@@ -2,11 +2,13 @@
 import streamlit as st
 from pymongo import MongoClient
 import os
-from adobe_PDF_extract_API import ExtractTextInfoFromPDF
-from app import upload_json_file_to_mongodb, find_section_wise_differences_in_files
-from section_processing import process_and_upload_pdf
-from document_comparison import get_sections_from_db, fetch_old_and_new_text, process_and_compare_pdfs
-import shutil
+import time
+from document_comparison import process_and_compare_pdfs, format_section_comparison, comparison_cache
+from comparison_jobs import ComparisonWorkerPool, submit_comparison_job, prioritize_section, ACTIVE_JOB_STATUSES, JOBS_COLLECTION_NAME, POLL_INTERVAL_SECONDS
+from comparison_results import render_comparison_results, list_section_headings, fetch_section, get_partial_pairs
+from token_counting import get_encoder
+from section_processing import get_content_hash, resolve_document_name
+import tempfile
 from dotenv import load_dotenv
 
 
@@ -14,52 +16,300 @@ load_dotenv()
 # Load environment variables from .env file
 uri = os.getenv('uri')
 
+
+# Function to get the database shared by all sessions and reruns
+@st.cache_resource
+def get_database():
+    """
+    Connects to MongoDB once per server process instead of on every rerun of the script.
+
+    Returns:
+        Database: The 'capstone_db' database.
+    """
+    # Connect to the MongoDB client using the provided URI
+    client = MongoClient(uri)
+    # Select the 'capstone_db' database
+    return client['capstone_db']
+
+
+# Function to get the tokenizer shared by all sessions and reruns
+@st.cache_resource
+def get_tokenizer(model="gpt-4o"):
+    """
+    Loads the tokenizer once per server process.
+
+    Args:
+        model (str): The model whose tokenizer to load.
+
+    Returns:
+        tiktoken.Encoding: The tokenizer.
+    """
+    return get_encoder(model)
+
+
+# Number of section headings listed per page
+SECTION_PAGE_SIZE = 50
+
 # MongoDB connection setup
-# Connect to the MongoDB client using the provided URI
-client = MongoClient(uri)
-# Select the 'capstone_db' database
-capstone_db = client['capstone_db']
+capstone_db = get_database()
 # Select the 'documents_data' collection
 documents_data_db = capstone_db['documents_data']
 # Select the 'adobe_api_json_outputs' collection
 adobe_api_json_outputs_db = capstone_db['adobe_api_json_outputs']
 # Select the 'sections_data' collection
 sections_data_db = capstone_db['sections_data']
+# Select the 'comparison_jobs' collection
+comparison_jobs_db = capstone_db[JOBS_COLLECTION_NAME]
+# Load the tokenizer before the first comparison needs it
+get_tokenizer()
+
+
+# Function to start the comparison workers shared by all sessions and reruns
+@st.cache_resource
+def get_worker_pool():
+    """
+    Starts the worker threads that run the queued comparison jobs, once per server process.
+
+    Set 'comparison_workers' to 0 when the jobs are run by a standalone `python comparison_jobs.py` instead.
+
+    Returns:
+        ComparisonWorkerPool: The started pool.
+    """
+    return ComparisonWorkerPool(get_database(), comparison_cache=comparison_cache).start()
+
+
+# Start the workers outside the script thread, so reruns and refreshes do not interrupt running jobs
+get_worker_pool()
+
+
+# Function to hash the content of an uploaded file
+def get_file_hash(uploaded_file):
+    """
+    Hashes the content of an uploaded file, so cached data follows the content rather than the file name.
+
+    Args:
+        uploaded_file: The uploaded file object.
+
+    Returns:
+        str: The SHA-256 hex digest of the file content.
+    """
+    return get_content_hash(uploaded_file.getvalue())
+
+
+# Function to find the stored name of an uploaded document
+@st.cache_data(show_spinner=False)
+def get_stored_file_name(file_hash, file_name):
+    """
+    Finds the name under which a document with this content is, or will be, stored.
+
+    Args:
+        file_hash (str): Hash of the document content.
+        file_name (str): Base name of the uploaded file.
+
+    Returns:
+        str: The stored name of known content, or a name no other content is stored under.
+    """
+    return resolve_document_name(file_name, file_hash, documents_data_db, adobe_api_json_outputs_db)
+
+
+# Function to check which stored outputs exist for a document
+@st.cache_data(show_spinner=False)
+def get_document_presence(file_hash, file_name):
+    """
+    Checks whether a document has stored Adobe API outputs and processed text.
+
+    Args:
+        file_hash (str): Hash of the document content.
+        file_name (str): Stored name of the document, as returned by get_stored_file_name.
+
+    Returns:
+        tuple: Whether the document is in the 'adobe_api_json_outputs' and, with this content, in the 'documents_data' collection.
+    """
+    in_adobe = adobe_api_json_outputs_db.count_documents({"file_name": file_name}, limit=1) > 0
+    in_documents = documents_data_db.count_documents({"file_name": file_name, "content_hash": file_hash}, limit=1) > 0
+    return in_adobe, in_documents
+
+
+# Function to load the cleaned texts of a pair
+@st.cache_data(show_spinner=False)
+def get_cleaned_texts(new_file_hash, old_file_hash, new_file_name, old_file_name):
+    """
+    Loads the cleaned texts of the new and old document.
+
+    Args:
+        new_file_hash (str): Hash of the new document content, used as the cache key.
+        old_file_hash (str): Hash of the old document content, used as the cache key.
+        new_file_name (str): Base name of the new document.
+        old_file_name (str): Base name of the old document.
+
+    Returns:
+        tuple: The cleaned texts of the new and old document.
+    """
+    cleaned_texts = []
+    for file_name in (new_file_name, old_file_name):
+        document = documents_data_db.find_one({"file_name": file_name}, {"cleaned_text": 1}) or {}
+        cleaned_texts.append(str(document.get("cleaned_text", "No cleaned text found for the given file name.")))
+    return tuple(cleaned_texts)
+
+
+# Function to check whether a pair has been compared
+@st.cache_data(show_spinner=False)
+def is_pair_compared(new_file_hash, old_file_hash, file_pair):
+    """
+    Checks whether all sections of a pair have been compared and stored.
+
+    Args:
+        new_file_hash (str): Hash of the new document content, used as the cache key.
+        old_file_hash (str): Hash of the old document content, used as the cache key.
+        file_pair (str): Name of the file pair.
+
+    Returns:
+        bool: True if the pair is stored and not still being compared.
+    """
+    return sections_data_db.count_documents({"file_pair": file_pair, "status": {"$ne": "comparing"}}, limit=1) > 0
+
+
+# Function to load one page of the section headings of a pair
+@st.cache_data(show_spinner=False)
+def get_section_page(new_file_hash, old_file_hash, file_pair, search, page):
+    """
+    Loads one page of the section headings of a pair, filtered on the server.
+
+    Args:
+        new_file_hash (str): Hash of the new document content, used as the cache key.
+        old_file_hash (str): Hash of the old document content, used as the cache key.
+        file_pair (str): Name of the file pair.
+        search (str): Text the headings must contain; empty for all headings.
+        page (int): Zero-based page number.
+
+    Returns:
+        dict: The 'total' number of matching headings and the 'sections' of the page.
+    """
+    return list_section_headings(sections_data_db, file_pair, search, page * SECTION_PAGE_SIZE, SECTION_PAGE_SIZE)
+
+
+# Function to load a single section of a pair
+@st.cache_data(show_spinner=False)
+def get_section(new_file_hash, old_file_hash, file_pair, section_id):
+    """
+    Loads the texts and comparison of the section being displayed.
+
+    Args:
+        new_file_hash (str): Hash of the new document content, used as the cache key.
+        old_file_hash (str): Hash of the old document content, used as the cache key.
+        file_pair (str): Name of the file pair.
+        section_id (int): Position of the section in the pair.
+
+    Returns:
+        dict | None: The stored section.
+    """
+    return fetch_section(sections_data_db, file_pair, section_id)
+
+
+# Function to load the sections of a pair that is still being compared
+def get_pair_progress(file_pair):
+    """
+    Loads the headings and the comparisons stored so far of a pair, without the section texts.
+
+    Not cached, since the running job stores a comparison every few seconds.
+
+    Args:
+        file_pair (str): Name of the file pair.
+
+    Returns:
+        list: The stored sections with 'section_heading', 'compared', 'differences' and 'summary'.
+    """
+    result = sections_data_db.find_one(
+        {"file_pair": file_pair},
+        {"sections.section_heading": 1, "sections.compared": 1, "sections.differences": 1, "sections.summary": 1})
+    return (result or {}).get("sections", [])
+
+
+# Function to show the progress of a comparison job
+def render_job_progress(job):
+    """
+    Shows the stage and progress of a running comparison job and the sections it has compared so far.
+
+    The section the user selects is moved to the front of the job's comparison queue.
+
+    Args:
+        job (dict): The job as stored in MongoDB.
+    """
+    if job["status"] == "queued":
+        st.info("The comparison is queued and will start when a worker is free.")
+        return
+    total_sections = job.get("total_sections")
+    completed_sections = job.get("completed_sections", 0)
+    if job["stage"] == "preparing documents":
+        # Show the preparation of each document on its own
+        documents = job.get("documents", {})
+        col1, col2 = st.columns(2)
+        with col1:
+            st.info(f"New file: {documents.get('new', 'waiting')}")
+        with col2:
+            st.info(f"Old file: {documents.get('old', 'waiting')}")
+    elif total_sections:
+        st.progress(completed_sections / total_sections, text=f"Compared {completed_sections} of {total_sections} sections")
+    else:
+        st.info(f"Comparison in progress: {job['stage']}...")
+
+    # The sections are stored once they are aligned, and each comparison as soon as it completes
+    pair_sections = get_pair_progress(job["_id"]) if job["stage"] == "comparing sections" else []
+    if not pair_sections:
+        return
+    # Sections are chosen by position, since headings such as "General" or "Scope" repeat
+    selected_index = st.selectbox("Select a section to compare first", [None] + list(range(len(pair_sections))), key="priority_section",
+                                  format_func=lambda index: "Select a section" if index is None else str(pair_sections[index].get("section_heading")))
+    if selected_index is not None:
+        if job.get("priority_section") != selected_index:
+            prioritize_section(comparison_jobs_db, job["_id"], selected_index)
+        if pair_sections[selected_index].get("compared"):
+            st.text(render_comparison_results(pair_sections[selected_index]))
+        else:
+            st.info(f"{pair_sections[selected_index].get('section_heading')} is compared next.")
+
+    # Show the compared sections in document order
+    for section in pair_sections:
+        if section.get("compared"):
+            with st.expander(str(section["section_heading"])):
+                st.text(render_comparison_results(section))
+
+
+# Function to invalidate the cached data of a pair once its documents and sections are stored
+def invalidate_cached_data(file_pair, new_file_hash, old_file_hash, new_file_name, old_file_name):
+    """
+    Clears the cached presence checks, cleaned texts and completion check of one pair, so the next rerun
+    reads the stored data. The entries of other pairs and sessions are kept.
+
+    Sections are only cached once the pair is compared, and stored names do not change when a document is
+    stored, so neither needs clearing.
+
+    Args:
+        file_pair (str): Name of the file pair.
+        new_file_hash (str): Hash of the new document content.
+        old_file_hash (str): Hash of the old document content.
+        new_file_name (str): Stored name of the new document.
+        old_file_name (str): Stored name of the old document.
+    """
+    get_document_presence.clear(new_file_hash, new_file_name)
+    get_document_presence.clear(old_file_hash, old_file_name)
+    get_cleaned_texts.clear(new_file_hash, old_file_hash, new_file_name, old_file_name)
+    is_pair_compared.clear(new_file_hash, old_file_hash, file_pair)
 
-# Clear the contents of the folder at startup
-def clear_upload_dir():
-    """
-    Clears the contents of the upload directory to ensure a fresh start.
-
-    This function is called at the beginning of the application to remove any existing files in the upload directory.
-    """
-    # Check if the upload directory exists
-    if os.path.exists(UPLOAD_DIR):
-        # Iterate over the files in the upload directory
-        for file_name in os.listdir(UPLOAD_DIR):
-            # Construct the full path to the file
-            file_path = os.path.join(UPLOAD_DIR, file_name)
-            try:
-                # Check if the file is a file or a link
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    # Remove the file or link
-                    os.unlink(file_path)
-                # Check if the file is a directory
-                elif os.path.isdir(file_path):
-                    # Remove the directory
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                # Print an error message if the file cannot be deleted
-                print(f"Failed to delete {file_path}: {e}")
-
-# Directory to save uploaded PDF files
-UPLOAD_DIR = "uploaded_pdfs"
-# Create the upload directory if it does not exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# Clear folder at startup
-# Call the function to clear the upload directory
-clear_upload_dir()
+# Function to get the upload directory of the current session
+def get_session_upload_dir():
+    """
+    Returns a temporary directory private to the current browser session.
+
+    Each session writes its unknown uploads to its own directory, so concurrent sessions never
+    overwrite or delete each other's files.
+
+    Returns:
+        str: The path to the directory.
+    """
+    if "upload_dir" not in st.session_state:
+        st.session_state.upload_dir = tempfile.mkdtemp(prefix="nexteer_uploads_")
+    return st.session_state.upload_dir
 
 # Helper function to get the base name without extension
 def get_base_filename(file):
@@ -72,35 +322,55 @@ def get_base_filename(file):
     Returns:
         str: The base name of the file.
     """
-    # Extract the base name from the file name
-    return os.path.splitext(file.name)[0]
+    # Extract the base name from the file name, ignoring any client-supplied directories
+    return os.path.splitext(os.path.basename(file.name))[0]
 
 # Function to save uploaded file
-def save_uploaded_file(uploaded_file):
+def save_uploaded_file(uploaded_file, file_name, file_hash):
     """
-    Saves the uploaded PDF file to the upload directory.
+    Saves the uploaded PDF file to the upload directory of the session, once per content.
 
     Args:
         uploaded_file: The uploaded file object.
+        file_name (str): Base name to save the file under.
+        file_hash (str): Hash of the file content, naming the subdirectory the file is saved in.
 
     Returns:
-        str | None: The path to the saved file or None if not a PDF.
+        str: The path to the saved file.
     """
-    # Check if the uploaded file is a PDF
-    if uploaded_file.type == "application/pdf":
-        # Construct the full path to the file
-        file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
+    # Construct the full path to the file
+    file_dir = os.path.join(get_session_upload_dir(), file_hash)
+    file_path = os.path.join(file_dir, f"{file_name}.pdf")
+    # Reruns while the comparison job runs find the file already written
+    if not os.path.exists(file_path):
+        os.makedirs(file_dir, exist_ok=True)
         # Open the file in binary write mode
         with open(file_path, "wb") as f:
             # Write the file buffer to the path
             f.write(uploaded_file.getbuffer())
-        # Return the path to the saved file
-        return file_path
-    else:
-        # Display an error message if the file is not a PDF
-        st.error("Uploaded file is not a PDF.")
-        # Return None
-        return None
+    # Return the path to the saved file
+    return file_path
+
+# Function to resolve an uploaded file against the stored documents
+def resolve_uploaded_file(uploaded_file, file_hash):
+    """
+    Finds the stored document with the content of an upload, and saves the upload only if it is unknown.
+
+    Args:
+        uploaded_file: The uploaded file object.
+        file_hash (str): Hash of the file content.
+
+    Returns:
+        tuple: The file path, the base file name and whether the document is already stored. The path of a
+            stored document is only its name, since the comparison reads everything from storage.
+    """
+    # Documents are matched by content, so a renamed upload reuses the stored results and a new revision
+    # uploaded under a stored name gets a name of its own
+    file_name = get_stored_file_name(file_hash, get_base_filename(uploaded_file))
+    file_in_adobe, file_in_documents = get_document_presence(file_hash, file_name)
+    if file_in_adobe and file_in_documents:
+        return f"{file_name}.pdf", file_name, True
+    return save_uploaded_file(uploaded_file, file_name, file_hash), file_name, False
 
 # Streamlit UI setup
 # Set the title of the app
@@ -114,14 +384,11 @@ uploaded_pdf2 = st.sidebar.file_uploader("Upload the old File")
 
 # Check if both files are uploaded
 if uploaded_pdf1 and uploaded_pdf2:
-    # Save uploaded PDFs
-    # Save the new file
-    file_path1 = save_uploaded_file(uploaded_pdf1)
-    # Save the old file
-    file_path2 = save_uploaded_file(uploaded_pdf2)
-
-    # Check if both files are saved successfully
-    if file_path1 and file_path2:
+    # Check if both files are PDFs
+    if uploaded_pdf1.type != "application/pdf" or uploaded_pdf2.type != "application/pdf":
+        # Display an error message if a file is not a PDF
+        st.error("Uploaded file is not a PDF.")
+    else:
         # Display subheader
         st.subheader("Uploaded Files")
         # Display the new file name
@@ -129,111 +396,81 @@ if uploaded_pdf1 and uploaded_pdf2:
         # Display the old file name
         st.text(f"Old File: {uploaded_pdf2.name}")
 
-        # Check if the first file is in the MongoDB collections
-        # Check if the file is in the 'adobe_api_json_outputs' collection
-        file1_in_adobe = adobe_api_json_outputs_db.find_one({"file_name": get_base_filename(uploaded_pdf1)})
-        # Check if the file is in the 'documents_data' collection
-        file1_in_documents = documents_data_db.find_one({"file_name": get_base_filename(uploaded_pdf1)})
+        # Hash the uploaded files in memory so cached data is reused across reruns and invalidated when the content changes
+        new_file_hash = get_file_hash(uploaded_pdf1)
+        old_file_hash = get_file_hash(uploaded_pdf2)
 
-        # Display results for the first file
-        # Check if the file is in the 'adobe_api_json_outputs' collection
-        if file1_in_adobe:
-            # Display a success message
-            st.success(f"{uploaded_pdf1.name} is present in the Adobe API outputs collection.")
-        else:
-            # Display a warning message
-            st.warning(f"{uploaded_pdf1.name} is not present in the Adobe API outputs collection.")
-            # Display an info message
-            st.info(f"Processing {uploaded_pdf1.name} with Adobe API...")
-            # Create an instance of the ExtractTextInfoFromPDF class
-            extractor = ExtractTextInfoFromPDF(file_path1)
-            # Extract the text from the PDF
-            json_path = extractor.extract_text()
-            # Check if the text is extracted successfully
-            if json_path:
-                # Upload the JSON file to the 'adobe_api_json_outputs' collection
-                upload_json_file_to_mongodb(json_path, adobe_api_json_outputs_db)
-                # Display a success message
-                st.success(f"Processed and uploaded {uploaded_pdf1.name} to Adobe API outputs collection.")
+        # Answer known documents from storage; only unknown ones are written to the session's directory
+        file_path1, new_file_name, new_file_stored = resolve_uploaded_file(uploaded_pdf1, new_file_hash)
+        file_path2, old_file_name, old_file_stored = resolve_uploaded_file(uploaded_pdf2, old_file_hash)
 
-        # Check if the file is in the 'documents_data' collection
-        if file1_in_documents:
-            # Display a success message
-            st.success(f"{uploaded_pdf1.name} is present in the documents data collection.")
-        else:
-            # Process and upload the file to the 'documents_data' collection
-            process_and_upload_pdf(file_path1)
-
-        # Check if the second file is in the MongoDB collections
-        # Check if the file is in the 'adobe_api_json_outputs' collection
-        file2_in_adobe = adobe_api_json_outputs_db.find_one({"file_name": get_base_filename(uploaded_pdf2)})
-        # Check if the file is in the 'documents_data' collection
-        file2_in_documents = documents_data_db.find_one({"file_name": get_base_filename(uploaded_pdf2)})
-
-        # Display results for the second file
-        # Check if the file is in the 'adobe_api_json_outputs' collection
-        if file2_in_adobe:
-            # Display a success message
-            st.success(f"{uploaded_pdf2.name} is present in the Adobe API outputs collection.")
-        else:
-            # Display a warning message
-            st.warning(f"{uploaded_pdf2.name} is not present in the Adobe API outputs collection.")
-            # Display an info message
-            st.info(f"Processing {uploaded_pdf2.name} with Adobe API...")
-            # Create an instance of the ExtractTextInfoFromPDF class
-            extractor = ExtractTextInfoFromPDF(file_path2)
-            # Extract the text from the PDF
-            json_path = extractor.extract_text()
-            # Check if the text is extracted successfully
-            if json_path:
-                # Upload the JSON file to the 'adobe_api_json_outputs' collection
-                upload_json_file_to_mongodb(json_path, adobe_api_json_outputs_db)
+        # Show which documents are stored; missing ones are produced by the comparison job
+        for uploaded_file, file_name, file_stored in ((uploaded_pdf1, new_file_name, new_file_stored), (uploaded_pdf2, old_file_name, old_file_stored)):
+            if file_stored:
                 # Display a success message
-                st.success(f"Processed and uploaded {uploaded_pdf2.name} to Adobe API outputs collection.")
-
-        # Check if the file is in the 'documents_data' collection
-        if file2_in_documents:
-            # Display a success message
-            st.success(f"{uploaded_pdf2.name} is present in the documents data collection.")
-        else:
-            # Process and upload the file to the 'documents_data' collection
-            process_and_upload_pdf(file_path2)
+                st.success(f"{uploaded_file.name} is already processed as {file_name}.")
+            else:
+                # Display an info message
+                st.info(f"{uploaded_file.name} will be extracted and processed by the comparison job.")
 
-        # Get the base names of the files without extensions
-        new_file_name = os.path.splitext(os.path.basename(file_path1))[0]
-        old_file_name = os.path.splitext(os.path.basename(file_path2))[0]
         # Construct the file pair name
         file_pair = f"{new_file_name}_{old_file_name}"
-        # Check if the result is in the 'sections_data' collection
-        result = sections_data_db.find_one({"file_pair": file_pair})
-        # Check if the result is not found
-        if not result:
-            # Print a message
-            print("Result not found in MongoDB")
-            # Find the section-wise differences in the files
-            find_section_wise_differences_in_files(file_path1, file_path2, adobe_api_json_outputs_db, documents_data_db, sections_data_db)
-        else:
-            # Print a message
-            print("Result found in MongoDB")
-
-        # Get the sections from the database
-        sections = get_sections_from_db(file_path1, file_path2)
-        # Add a placeholder to the sections list
-        sections_with_placeholder = ["Select a section"] + sections
+        # The job deletes the uploads it was given once it finishes
+        temporary_files = [file_path for file_path, file_stored in ((file_path1, new_file_stored), (file_path2, old_file_stored)) if not file_stored]
+        # Check if the result is not yet in the 'sections_data' collection
+        if not is_pair_compared(new_file_hash, old_file_hash, file_pair):
+            # Queue the comparison, or find the job already queued by an earlier run or another session
+            job = submit_comparison_job(comparison_jobs_db, file_path1, file_path2, file_pair, temporary_files=temporary_files)
+            if job["status"] in ACTIVE_JOB_STATUSES:
+                # Show the progress and the sections compared so far, then poll again
+                render_job_progress(job)
+                time.sleep(POLL_INTERVAL_SECONDS)
+                st.rerun()
+            elif job["status"] == "failed":
+                # Display the stored error; the job is queued again only when the user asks for it
+                st.error(f"Comparison of {file_pair} failed: {job['error']}")
+                if st.button("Retry comparison"):
+                    submit_comparison_job(comparison_jobs_db, file_path1, file_path2, file_pair, retry=True, temporary_files=temporary_files)
+                    st.rerun()
+                st.stop()
+            # The job stored the documents and the pair, so drop the cached misses and reload
+            invalidate_cached_data(file_pair, new_file_hash, old_file_hash, new_file_name, old_file_name)
+
+        # Page through the section headings, filtered on the server; texts are loaded only for the selected section
+        section_search = st.text_input("Filter sections by heading", key="section_search")
+        section_page = get_section_page(new_file_hash, old_file_hash, file_pair, section_search, st.session_state.get("section_page", 1) - 1)
+        page_count = max(1, -(-section_page["total"] // SECTION_PAGE_SIZE))
+        if st.session_state.get("section_page", 1) > page_count:
+            # The filter left fewer pages, so go back to the first one
+            st.session_state.section_page = 1
+            section_page = get_section_page(new_file_hash, old_file_hash, file_pair, section_search, 0)
 
         # Check if sections are found
-        if sections:
+        if section_page["total"]:
+            if page_count > 1:
+                st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, key="section_page")
+            headings_by_id = {section["section_id"]: section["section_heading"] for section in section_page["sections"]}
             # Create a selectbox to select a section
-            user_query = st.selectbox("Select a section to view differences", sections_with_placeholder)
+            selected_section_id = st.selectbox("Select a section to view differences", [None] + list(headings_by_id),
+                                               format_func=lambda section_id: "Select a section" if section_id is None else headings_by_id[section_id])
+            user_query = "Select a section" if selected_section_id is None else headings_by_id[selected_section_id]
+        elif section_search:
+            # Display a warning message
+            st.warning("No sections match the filter.")
+            selected_section_id = None
+            user_query = "Select a section"
         else:
+            selected_section_id = None
             # Display a warning message
             st.warning("No sections found for the uploaded documents. You can manually enter a query below.")
             # Create a text input to enter a query
             user_query = st.text_input("Enter the section of the file to view differences:")
 
         # Get the cleaned text for the new and old files
-        new_file_cleaned_text = str(documents_data_db.find_one({"file_name": new_file_name}).get("cleaned_text", "No cleaned text found for the given file name."))
-        old_file_cleaned_text = str(documents_data_db.find_one({"file_name": old_file_name}).get("cleaned_text", "No cleaned text found for the given file name."))
+        new_file_cleaned_text, old_file_cleaned_text = get_cleaned_texts(new_file_hash, old_file_hash, new_file_name, old_file_name)
+
+        # Let the user force a new whole-document comparison instead of the stored one
+        refresh_comparison = st.checkbox("Refresh comparison (ignore stored results)", value=False)
 
         # Compare documents
         # Check if the "Compare Documents" button is clicked
@@ -244,14 +481,19 @@ if uploaded_pdf1 and uploaded_pdf2:
             This function is called when the "Compare Documents" button is clicked. It processes the uploaded files, 
             fetches the old and new text, and then compares the documents.
             """
+            # Create a placeholder that shows the comparison table while it streams in
+            result_placeholder = st.empty()
             # Process files
             with st.spinner("Processing and comparing documents..."):
-                # Fetch the old and new text
-                old_new_texts = fetch_old_and_new_text(uploaded_pdf1, uploaded_pdf2)
                 # Get the selected texts
-                selected_texts = [text for text in old_new_texts if text[0] == user_query]
-                # Process and compare the PDFs
-                result = process_and_compare_pdfs(user_query, file_pair, new_file_cleaned_text, old_file_cleaned_text, repetitions=2)
+                selected_section = get_section(new_file_hash, old_file_hash, file_pair, selected_section_id) if selected_section_id is not None else None
+                if selected_section_id is not None:
+                    # Show the stored comparison of the selected section itself, not the first one with the same heading
+                    result = (format_section_comparison(selected_section) if selected_section else None) or f"No results found for section '{user_query}'"
+                else:
+                    # Process and compare the PDFs, rendering the table incrementally as tokens arrive
+                    result = process_and_compare_pdfs(user_query, file_pair, new_file_cleaned_text, old_file_cleaned_text, repetitions=2,
+                                                      on_update=result_placeholder.markdown, refresh=refresh_comparison)
                 
             # Check if the result is an error message
             if isinstance(result, str) and result.startswith("Error"):
@@ -261,12 +503,13 @@ if uploaded_pdf1 and uploaded_pdf2:
                 # Display a success message
                 st.success("Comparison completed successfully!")
                 
-                # Display the result
-                st.write(result) 
+                # Display the final result in place of the streamed one
+                result_placeholder.markdown(result)
                 # Check if selected texts are found
-                if selected_texts:
-                    # Get the section heading, old text, and new text
-                    section_heading, old_text, new_text = selected_texts[0]
+                if selected_section:
+                    # Get the old text and new text
+                    old_text = selected_section.get("old_text", "No Old Text Found")
+                    new_text = selected_section.get("new_text", "No New Text Found")
 
                     # Create two columns
                     col1, col2 = st.columns(2)
@@ -294,6 +537,14 @@ else:
     # Display a warning message
     st.warning("Please upload both documents to proceed.")
 
+# Show the pairs whose comparison was interrupted; resubmitting one compares only its missing sections
+with st.sidebar.expander("Unfinished comparisons"):
+    partial_pairs = get_partial_pairs(sections_data_db)
+    if not partial_pairs:
+        st.write("None")
+    for partial_pair in partial_pairs:
+        st.write(f"{partial_pair['file_pair']}: {partial_pair['compared_sections']} of {partial_pair['total_sections']} sections")
+
 # Sidebar exit button with cleanup
 # Check if the "Exit Application" button is clicked
 if st.sidebar.button("Exit Application"):
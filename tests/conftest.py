@@ -0,0 +1,11 @@
+# Import necessary libraries and modules
+import os
+import sys
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The gateway reads its endpoint on import; the tests never call it
+os.environ.setdefault("endpoint", "http://127.0.0.1")
+os.environ.setdefault("api_key", "test-key")
+# Some modules ping MongoDB on import; make the ping fail fast when no server is configured
+os.environ.setdefault("uri", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100")
@@ -0,0 +1,57 @@
+# Import necessary libraries and modules
+import pytest
+
+batch_compare = pytest.importorskip("batch_compare", reason="batch_compare needs pymongo, pandas and the Adobe PDF Services SDK")
+
+
+# Function to build planned comparisons from file names
+def plan(*comparisons):
+    return [{"file_names": tuple(file_names), "file_paths": tuple(f"/pdfs/{file_name}.pdf" for file_name in file_names)}
+            for file_names in comparisons]
+
+
+def test_plan_batch_drops_repeated_and_unresolved_comparisons(monkeypatch):
+    def fake_get_file_paths_from_pair(comparison, pdf_paths):
+        missing = [file_name for file_name in comparison if file_name not in pdf_paths]
+        if missing:
+            raise FileNotFoundError(f"PDF not found: {missing[0]}")
+        return tuple(pdf_paths[file_name] for file_name in comparison)
+
+    monkeypatch.setattr(batch_compare, "get_file_paths_from_pair", fake_get_file_paths_from_pair)
+    pdf_paths = {"A": "/pdfs/A.pdf", "B": "/pdfs/B.pdf"}
+    planned_comparisons, unresolved_comparisons = batch_compare.plan_batch([("A", "B"), ("A", "B"), ("A", "C")], pdf_paths)
+    assert planned_comparisons == [{"file_names": ("A", "B"), "file_paths": ("/pdfs/A.pdf", "/pdfs/B.pdf")}]
+    assert unresolved_comparisons == [{"file_names": ("A", "C"), "error": "PDF not found: C"}]
+
+
+def test_build_batch_graph_lists_each_document_once_with_its_pairs():
+    documents = batch_compare.build_batch_graph(plan(("A", "B"), ("C", "B"), ("A", "C")))
+    assert list(documents) == ["A", "B", "C"]
+    assert documents["A"] == {"file_path": "/pdfs/A.pdf", "pairs": [0, 2]}
+    assert documents["B"]["pairs"] == [0, 1]
+    assert documents["C"]["pairs"] == [1, 2]
+
+
+def test_order_documents_prepares_a_version_series_version_by_version():
+    planned_pairs = plan(("v3", "v2"), ("v2", "v1"), ("v3", "v1"))
+    documents = batch_compare.build_batch_graph(planned_pairs)
+    assert batch_compare.order_documents(documents, planned_pairs) == ["v3", "v2", "v1"]
+
+
+def test_order_documents_prepares_shared_documents_first():
+    planned_pairs = plan(("A", "X"), ("B", "X"), ("C", "D"))
+    documents = batch_compare.build_batch_graph(planned_pairs)
+    assert batch_compare.order_documents(documents, planned_pairs) == ["X", "A", "B", "C", "D"]
+
+
+def test_order_documents_prefers_completing_a_pair_over_sharing():
+    planned_pairs = plan(("A", "B"), ("C", "D"), ("C", "E"), ("C", "F"))
+    documents = batch_compare.build_batch_graph(planned_pairs)
+    # After C, each of D, E and F completes a pair; they win over B, which only shares a pair with A
+    assert batch_compare.order_documents(documents, planned_pairs) == ["C", "D", "E", "F", "A", "B"]
+
+
+def test_order_documents_breaks_ties_by_first_position():
+    planned_pairs = plan(("A", "B"), ("C", "D"))
+    documents = batch_compare.build_batch_graph(planned_pairs)
+    assert batch_compare.order_documents(documents, planned_pairs) == ["A", "B", "C", "D"]
@@ -0,0 +1,45 @@
+# Import necessary libraries and modules
+import re
+import pytest
+from heading_locator import MultiPatternMatcher, HeadingLocator, remove_table_of_contents_entries
+
+TEXT = "1 Scope\nThis document covers the scope.\n2 Terms\nScope of terms.\n3 Scope limits\nEnd."
+HEADINGS = ["1 Scope", "2 Terms", "3 Scope limits", "Scope"]
+
+
+def test_find_all_reports_overlapping_occurrences_in_start_order():
+    positions = MultiPatternMatcher(["abab", "bab", "b"]).find_all("ababab")
+    assert positions == {"abab": [0, 2], "bab": [1, 3], "b": [1, 3, 5]}
+
+
+def test_matcher_ignores_empty_and_duplicate_patterns():
+    assert MultiPatternMatcher(["", "a", "a"]).patterns == ["a"]
+
+
+@pytest.mark.parametrize("heading", HEADINGS)
+@pytest.mark.parametrize("start", [0, 1, 8, 40, 60, len(TEXT), len(TEXT) + 5, -1, -10, -len(TEXT), -len(TEXT) - 5])
+def test_find_matches_str_find(heading, start):
+    locator = HeadingLocator(TEXT, HEADINGS)
+    assert locator.find(heading, start) == TEXT.find(heading, start)
+
+
+def test_find_falls_back_for_headings_outside_the_scan():
+    locator = HeadingLocator(TEXT, HEADINGS)
+    assert locator.find("limits", 0) == TEXT.find("limits")
+    assert locator.find("missing", 0) == -1
+
+
+def test_find_all_returns_a_copy_of_the_positions():
+    locator = HeadingLocator(TEXT, HEADINGS)
+    positions = locator.find_all("Scope")
+    positions.clear()
+    assert locator.find_all("Scope") == [match.start() for match in re.finditer("Scope", TEXT)]
+
+
+def test_remove_all_prefers_leftmost_then_longest_match():
+    assert MultiPatternMatcher(["ab", "abc", "bcd"]).remove_all("xabcdx") == "xdx"
+
+
+def test_remove_table_of_contents_entries():
+    assert remove_table_of_contents_entries("1 Scope 3\n1 Scope\nText", ["1 Scope 3\n"]) == "1 Scope\nText"
+    assert remove_table_of_contents_entries("Text", []) == "Text"
@@ -0,0 +1,171 @@
+# Import necessary libraries and modules
+import asyncio
+import time
+from types import SimpleNamespace
+import httpx
+import pytest
+from openai import RateLimitError, APIStatusError
+import llm_gateway
+from llm_gateway import TokenBucketRateLimiter, LLMGateway, CircuitBreaker, CircuitOpenError
+from async_comparison import is_retryable_error, get_retry_after_seconds
+
+
+class FakeClock:
+    """
+    A monotonic clock that only moves when the test advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(llm_gateway, "time", SimpleNamespace(monotonic=fake_clock.monotonic, perf_counter=time.perf_counter))
+    return fake_clock
+
+
+def test_rate_limiter_allows_a_burst_up_to_the_request_quota(clock):
+    limiter = TokenBucketRateLimiter(requests_per_minute=3, tokens_per_minute=1000)
+    assert [limiter.reserve(10) for _ in range(3)] == [0, 0, 0]
+    assert limiter.reserve(10) == pytest.approx(20.0)
+    # Each further request queues behind the debt of the previous ones
+    assert limiter.reserve(10) == pytest.approx(40.0)
+
+
+def test_rate_limiter_waits_for_the_token_quota(clock):
+    limiter = TokenBucketRateLimiter(requests_per_minute=100, tokens_per_minute=600)
+    assert limiter.reserve(500) == 0
+    assert limiter.reserve(400) == pytest.approx(30.0)
+
+
+def test_rate_limiter_caps_requests_larger_than_the_quota(clock):
+    limiter = TokenBucketRateLimiter(requests_per_minute=100, tokens_per_minute=600)
+    assert limiter.reserve(5000) == 0
+    assert limiter.reserve(600) == pytest.approx(60.0)
+
+
+def test_rate_limiter_refills_over_time_without_exceeding_the_quota(clock):
+    limiter = TokenBucketRateLimiter(requests_per_minute=2, tokens_per_minute=1000)
+    limiter.reserve(0)
+    limiter.reserve(0)
+    clock.advance(30)
+    assert limiter.reserve(0) == 0
+    assert limiter.reserve(0) == pytest.approx(30.0)
+    # A long idle period refills the buckets only up to the quota
+    clock.advance(600)
+    assert [limiter.reserve(0) for _ in range(2)] == [0, 0]
+    assert limiter.reserve(0) == pytest.approx(30.0)
+
+
+def test_rate_limiter_acquire_sleeps_for_the_reserved_delay(clock, monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(llm_gateway.asyncio, "sleep", fake_sleep)
+    limiter = TokenBucketRateLimiter(requests_per_minute=1, tokens_per_minute=1000)
+    asyncio.run(limiter.acquire(10))
+    asyncio.run(limiter.acquire(10))
+    assert delays == [pytest.approx(60.0)]
+
+
+def test_gateway_owns_one_rate_limiter_with_the_deployment_quotas():
+    gateway = LLMGateway(azure_endpoint="https://example.openai.azure.com/", azure_api_key="test-key")
+    assert gateway.rate_limiter.requests_per_minute == llm_gateway.requests_per_minute
+    assert gateway.rate_limiter.tokens_per_minute == llm_gateway.tokens_per_minute
+    shared_limiter = TokenBucketRateLimiter(requests_per_minute=5, tokens_per_minute=500)
+    assert LLMGateway(azure_endpoint="https://example.openai.azure.com/", azure_api_key="test-key",
+                      rate_limiter=shared_limiter).rate_limiter is shared_limiter
+
+
+# Function to build an API error with the given status code
+def make_status_error(error_class, status_code):
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://example.openai.azure.com/"))
+    return error_class("error", response=response, body=None)
+
+
+def test_circuit_breaker_opens_after_the_failure_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    clock.advance(10)
+    with pytest.raises(CircuitOpenError) as error_info:
+        breaker.before_call()
+    assert error_info.value.retry_after_seconds == pytest.approx(20.0)
+
+
+def test_circuit_breaker_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.before_call()
+    assert breaker.consecutive_failures == 1
+
+
+def test_circuit_breaker_lets_a_single_trial_through_after_the_reset_period(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.advance(30)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # A successful trial closes the circuit
+    breaker.record_success()
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_circuit_breaker_reopens_after_a_failed_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError) as error_info:
+        breaker.before_call()
+    assert error_info.value.retry_after_seconds == pytest.approx(30.0)
+
+
+def test_circuit_breaker_does_not_count_throttled_calls(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_throttled()
+    breaker.before_call()
+    assert breaker.consecutive_failures == 0
+    # A throttled trial frees the trial slot without reopening the circuit
+    breaker.record_failure()
+    clock.advance(30)
+    breaker.before_call()
+    breaker.record_throttled()
+    breaker.before_call()
+
+
+def test_gateway_counts_server_errors_but_not_rate_limited_calls_toward_the_breaker():
+    gateway = LLMGateway(azure_endpoint="https://example.openai.azure.com/", azure_api_key="test-key",
+                         circuit_breaker=CircuitBreaker(failure_threshold=2))
+    for _ in range(3):
+        gateway._record_call("chat", time.perf_counter(), None, False, make_status_error(RateLimitError, 429))
+    assert gateway.circuit_breaker.consecutive_failures == 0
+    gateway._record_call("chat", time.perf_counter(), None, False, make_status_error(APIStatusError, 500))
+    assert gateway.circuit_breaker.consecutive_failures == 1
+    assert [call["success"] for call in gateway._calls] == [False, False, False, False]
+
+
+def test_open_circuit_is_retried_after_its_reset_delay():
+    error = CircuitOpenError("open", retry_after_seconds=12.5)
+    assert is_retryable_error(error)
+    assert get_retry_after_seconds(error) == 12.5
+    assert is_retryable_error(make_status_error(RateLimitError, 429))
+    assert not is_retryable_error(make_status_error(APIStatusError, 400))
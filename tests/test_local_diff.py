@@ -0,0 +1,62 @@
+# Import necessary libraries and modules
+import pytest
+from local_diff import normalize_text, text_fingerprint, get_changed_hunks, compute_diff_stats
+
+
+@pytest.mark.parametrize("text, expected", [
+    (None, ""),
+    ("", ""),
+    ("ﬁnal oﬃce", "final office"),
+    ("“quoted” ‘text’", "\"quoted\" 'text'"),
+    ("pages 1–2 — minus −1", "pages 1-2 - minus -1"),
+    ("hyphen-\n  ated and soft­hyphen", "hyphenated and softhyphen"),
+    ("  spaced out\n\n\ttext  ", "spaced out text"),
+    ("well-known term", "well-known term"),
+])
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+def test_text_fingerprint_ignores_layout_only_differences():
+    assert text_fingerprint("The ﬁrst clause") == text_fingerprint("The  first\nclause")
+    assert text_fingerprint("The first clause") != text_fingerprint("The second clause")
+
+
+def test_get_changed_hunks_reports_types_and_context():
+    hunks = get_changed_hunks("one two three five six", "one two four five", context_words=2)
+    assert hunks == [
+        {"type": "modified", "new_text": "three", "old_text": "four", "context": "one two"},
+        {"type": "added", "new_text": "six", "old_text": "", "context": "three five"},
+    ]
+
+
+def test_compute_diff_stats_detects_texts_identical_after_normalization():
+    diff_stats = compute_diff_stats("The “terms” apply-\nhere.", 'The "terms" applyhere.')
+    assert diff_stats["identical"] is True
+    assert diff_stats["new_hash"] == diff_stats["old_hash"]
+    assert diff_stats["new_word_count"] == diff_stats["old_word_count"] == 3
+    assert (diff_stats["hunks"], diff_stats["words_added"], diff_stats["words_removed"], diff_stats["words_modified"]) == (0, 0, 0, 0)
+
+
+def test_compute_diff_stats_counts_added_removed_and_modified_words():
+    old_text = "alpha beta gamma delta epsilon"
+    new_text = "alpha beta new words gamma epsilon zeta eta"
+    diff_stats = compute_diff_stats(new_text, old_text)
+    assert diff_stats["identical"] is False
+    assert diff_stats["new_word_count"] == 8 and diff_stats["old_word_count"] == 5
+    assert diff_stats["hunks"] == 3
+    assert diff_stats["words_added"] == 4
+    assert diff_stats["words_removed"] == 1
+    assert diff_stats["words_modified"] == 0
+
+
+def test_compute_diff_stats_counts_the_longer_side_of_a_modified_hunk():
+    diff_stats = compute_diff_stats("keep one two three keep", "keep four keep")
+    assert diff_stats["hunks"] == 1
+    assert diff_stats["words_modified"] == 3
+
+
+def test_compute_diff_stats_handles_empty_sections():
+    diff_stats = compute_diff_stats("", None)
+    assert diff_stats["identical"] is True
+    assert diff_stats["new_word_count"] == diff_stats["old_word_count"] == 0
@@ -0,0 +1,84 @@
+# Import necessary libraries and modules
+import pytest
+
+section_alignment = pytest.importorskip("section_alignment", reason="section_alignment needs the Adobe PDF Services SDK")
+
+NEW_TEXT = "Cover\n1 A\nalpha new\n1.1 A1\nsub one\n1.2 A2\nsub two\n2 B\nbeta\n"
+OLD_TEXT = "Cover\n1 A\nalpha\n1.1 A1\nsub one old\n2 B\nbeta\n3 C\ngamma\n"
+NEW_HEADINGS = [("1 A", 1), ("1.1 A1", 2), ("1.2 A2", 2), ("2 B", 1)]
+OLD_HEADINGS = [("1 A", 1), ("1.1 A1", 2), ("2 B", 1), ("3 C", 1)]
+
+
+@pytest.fixture(autouse=True)
+def plain_headings_and_word_tokens(monkeypatch):
+    # Read the headings from a list instead of Adobe JSON, and count words instead of model tokens
+    monkeypatch.setattr(section_alignment.ExtractTextInfoFromPDF, "get_section_headings",
+                        staticmethod(lambda headings, max_level=1: [{"text": text, "level": level} for text, level in headings]))
+    monkeypatch.setattr(section_alignment, "count_tokens", lambda text: len(text.split()))
+
+
+def test_build_heading_tree_nests_levels_and_closes_sections():
+    roots = section_alignment.build_heading_tree(NEW_HEADINGS + [("9 Missing", 1)], NEW_TEXT)
+    assert [node["key"] for node in roots] == ["A", "B"]
+    section_a, section_b = roots
+    assert [child["key"] for child in section_a["children"]] == ["A1", "A2"]
+    assert section_a["start"] == NEW_TEXT.find("1 A") and section_a["end"] == NEW_TEXT.find("2 B")
+    assert section_a["children"][0]["end"] == NEW_TEXT.find("1.2 A2")
+    assert section_a["children"][1]["end"] == NEW_TEXT.find("2 B")
+    assert section_b["end"] == len(NEW_TEXT)
+
+
+def test_align_heading_trees_keeps_sections_within_budget_whole():
+    units = section_alignment.align_heading_trees(section_alignment.build_heading_tree(NEW_HEADINGS, NEW_TEXT),
+                                                  section_alignment.build_heading_tree(OLD_HEADINGS, OLD_TEXT),
+                                                  NEW_TEXT, OLD_TEXT, token_budget=1000)
+    assert [unit[0] for unit in units] == ["Initial content", "A", "B"]
+    assert units[0][1:3] == ["Cover\n", "Cover\n"]
+    assert units[1][1] == NEW_TEXT[NEW_TEXT.find("1 A"):NEW_TEXT.find("2 B")]
+    # The unmatched section C of the old file stays with the last matched section
+    assert units[2][2] == "2 B\nbeta\n3 C\ngamma\n"
+    assert [unit[3] for unit in units] == ["A", "B", "Last section: No section after this."]
+
+
+def test_align_heading_trees_splits_sections_over_budget_into_matched_subsections():
+    units = section_alignment.align_heading_trees(section_alignment.build_heading_tree(NEW_HEADINGS, NEW_TEXT),
+                                                  section_alignment.build_heading_tree(OLD_HEADINGS, OLD_TEXT),
+                                                  NEW_TEXT, OLD_TEXT, token_budget=8)
+    assert [unit[0] for unit in units] == ["Initial content", "A", "A > A1", "B"]
+    # The subsection A2 missing from the old file is absorbed by the matched subsection before it
+    assert units[2][1] == "1.1 A1\nsub one\n1.2 A2\nsub two\n"
+    assert units[2][2] == "1.1 A1\nsub one old\n"
+
+
+def test_align_heading_trees_without_common_headings_compares_the_entire_document():
+    units = section_alignment.align_heading_trees(section_alignment.build_heading_tree([("1 A", 1)], NEW_TEXT),
+                                                  section_alignment.build_heading_tree([("3 C", 1)], OLD_TEXT), NEW_TEXT, OLD_TEXT)
+    assert units == [["Entire document", NEW_TEXT, OLD_TEXT, "Entire document was provided"]]
+
+
+def test_align_version_heading_trees_agrees_with_the_pairwise_alignment():
+    middle_text = "Cover\n1 A\nalpha mid\n1.1 A1\nsub one\n2 B\nbeta mid\n"
+    middle_headings = [("1 A", 1), ("1.1 A1", 2), ("2 B", 1)]
+    texts = [NEW_TEXT, middle_text, OLD_TEXT]
+    trees = [section_alignment.build_heading_tree(headings, text)
+             for headings, text in zip([NEW_HEADINGS, middle_headings, OLD_HEADINGS], texts)]
+    aligned_units = section_alignment.align_version_heading_trees(trees, texts, token_budget=1000)
+    assert [unit[0] for unit in aligned_units] == ["Initial content", "A", "B"]
+    # Every pair of versions sees the same texts as when aligned on its own
+    pairwise_units = section_alignment.align_heading_trees(trees[0], trees[2], NEW_TEXT, OLD_TEXT, token_budget=1000)
+    assert [[label, section_texts[0], section_texts[2], next_heading] for label, section_texts, next_heading in aligned_units] == pairwise_units
+
+
+def test_align_heading_nodes_keeps_document_order_and_skips_unmatched_keys():
+    new_nodes = [{"key": key} for key in ["A", "X", "B", "C"]]
+    old_nodes = [{"key": key} for key in ["A", "B", "Y", "C"]]
+    matched_pairs = section_alignment.align_heading_nodes(new_nodes, old_nodes)
+    assert [(new_node["key"], old_node["key"]) for new_node, old_node in matched_pairs] == [("A", "A"), ("B", "B"), ("C", "C")]
+
+
+def test_align_heading_node_lists_keeps_headings_found_in_every_version():
+    node_lists = [[{"key": key, "version": version} for key in keys]
+                  for version, keys in enumerate([["A", "B", "C"], ["A", "C"], ["A", "B", "C"]])]
+    matched_nodes = section_alignment.align_heading_node_lists(node_lists)
+    assert [[node["key"] for node in nodes] for nodes in matched_nodes] == [["A", "A", "A"], ["C", "C", "C"]]
+    assert [node["version"] for node in matched_nodes[0]] == [0, 1, 2]
@@ -0,0 +1,49 @@
+# Import necessary libraries and modules
+import pytest
+
+version_series = pytest.importorskip("version_series", reason="version_series needs pymongo, pandas and the Adobe PDF Services SDK")
+from comparison_results import build_identical_comparison_document
+
+
+# Function to build a compared section as stored by compare_series_pair
+def compared_section(new_text, old_text, comparison=None, diff_stats=None):
+    return ["Heading", new_text, old_text, "Next heading", comparison, diff_stats]
+
+
+def test_get_series_pairs_of_two_versions_is_the_single_pair():
+    assert version_series.get_series_pairs(("v2", "v1")) == [("v2", "v1")]
+
+
+def test_get_series_pairs_of_three_versions_adds_the_long_range_pair():
+    assert version_series.get_series_pairs(("v3", "v2", "v1")) == [("v3", "v2"), ("v2", "v1"), ("v3", "v1")]
+
+
+def test_get_version_pair_section_texts_picks_the_two_versions():
+    aligned_units = [["A", ["a3", "a2", "a1"], "B"], ["B", ["b3", "b2", "b1"], "Last section: No section after this."]]
+    assert version_series.get_version_pair_section_texts(aligned_units, 0, 2) == [
+        ["A", "a3", "a1", "B"], ["B", "b3", "b1", "Last section: No section after this."]]
+
+
+def test_compose_section_comparison_without_changes_is_the_identical_comparison():
+    step_sections = [compared_section("same text", "same  text"), compared_section("same text", "same\ntext")]
+    assert version_series.compose_section_comparison(step_sections) == build_identical_comparison_document()
+
+
+def test_compose_section_comparison_with_one_changed_step_reuses_its_comparison():
+    comparison = {"summary": "A clause was added."}
+    step_sections = [compared_section("text with clause", "text", comparison), compared_section("text", "text")]
+    assert version_series.compose_section_comparison(step_sections) is comparison
+
+
+def test_compose_section_comparison_with_several_changed_steps_needs_a_comparison():
+    step_sections = [compared_section("text three", "text two", {"summary": "first"}),
+                     compared_section("text two", "text one", {"summary": "second"})]
+    assert version_series.compose_section_comparison(step_sections) is None
+
+
+def test_compose_section_comparison_uses_the_stored_diff_stats():
+    comparison = {"summary": "A clause was added."}
+    # The stored statistics win over the texts, which are only diffed when no statistics were stored
+    step_sections = [compared_section("text three", "text two", {"summary": "layout only"}, {"identical": True}),
+                     compared_section("text two", "text one", comparison, {"identical": False})]
+    assert version_series.compose_section_comparison(step_sections) is comparison
@@ -1,21 +1,14 @@
 # Import necessary libraries and modules
-import os
-from dotenv import load_dotenv
+import logging
 from pydantic import BaseModel, Field, ValidationError
-from openai import AzureOpenAI
-from openai.types.chat import ChatCompletion
+from llm_gateway import get_gateway
 
-load_dotenv()
-# Load environment variables from .env file
-endpoint = os.getenv('endpoint')
-api_key = os.getenv('api_key')
+logger = logging.getLogger(__name__)
 
-# Initialize the Azure OpenAI client
-client = AzureOpenAI(
-    azure_endpoint=endpoint,
-    api_key=api_key,
-    api_version="2024-08-01-preview"
-)
+# Model deployment used for section comparisons
+DEPLOYMENT_NAME = get_gateway().deployment
+# Version of the section comparison prompt, part of the comparison cache key
+PROMPT_VERSION = "section-comparison-v1"
 
 # Define the Pydantic model for structured output
 class Difference(BaseModel):
@@ -50,59 +43,133 @@ class ComparisonResult(BaseModel):
     differences: list[Difference] = Field(description="List of differences between the two strings")
     summary: str = Field(description="Summary of the main differences")
 
+class SectionComparisonResult(BaseModel):
+    """
+    Represents the result of comparing one section within a packed request.
+
+    Attributes:
+        section_id (str): Identifier of the compared section as given in the prompt.
+        differences (list[Difference]): List of differences between the two section texts.
+        summary (str): Summary of the main differences.
+    """
+    section_id: str = Field(description="Identifier of the compared section exactly as given in the prompt")
+    differences: list[Difference] = Field(description="List of differences between the two section texts")
+    summary: str = Field(description="Summary of the main differences")
+
+class PackedComparisonResult(BaseModel):
+    """
+    Represents the results of a request that compares several sections at once.
+
+    Attributes:
+        results (list[SectionComparisonResult]): One result per compared section.
+    """
+    results: list[SectionComparisonResult] = Field(description="One comparison result per section id")
+
+# Function to build the prompt messages for a section comparison
+def build_comparison_messages(new_file_text: str, old_file_text: str) -> list[dict]:
+    """
+    Builds the chat messages used to compare two text sections.
+
+    Args:
+        new_file_text (str): The text from the new file.
+        old_file_text (str): The text from the old file.
+
+    Returns:
+        list[dict]: The system and user messages of the prompt.
+    """
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an AI assistant designed to compare text sections of a new file and an old file. "
+                "Identify the differences, categorize them as 'added', 'removed', or 'modified', and provide a detailed summary. "
+                "Please return the response strictly in JSON format."
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                "Compare the following text sections and return the differences in JSON format:\n\n"
+                f"New File text: {new_file_text}\n\nOld File text: {old_file_text}"
+            )
+        }
+    ]
+
+# Function to build the prompt messages for several section comparisons in one request
+def build_packed_comparison_messages(sections: list[tuple[str, str, str]]) -> list[dict]:
+    """
+    Builds the chat messages used to compare several pairs of text sections in a single request.
+
+    Args:
+        sections (list[tuple[str, str, str]]): Tuples of (section_id, new_file_text, old_file_text).
+
+    Returns:
+        list[dict]: The system and user messages of the prompt.
+    """
+    section_blocks = [
+        f"### Section id: {section_id}\n\nNew File text: {new_file_text}\n\nOld File text: {old_file_text}"
+        for section_id, new_file_text, old_file_text in sections
+    ]
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an AI assistant designed to compare text sections of a new file and an old file. "
+                "You will receive several independent sections, each introduced by its section id. "
+                "For every section, identify the differences, categorize them as 'added', 'removed', or 'modified', and provide a detailed summary. "
+                "Return exactly one result per section id and please return the response strictly in JSON format."
+            )
+        },
+        {
+            "role": "user",
+            "content": (
+                "Compare each of the following text sections independently and return the differences in JSON format:\n\n"
+                + "\n\n".join(section_blocks)
+            )
+        }
+    ]
+
 # Function to compare strings using Azure OpenAI
-def compare_strings(new_file_text: str, old_file_text: str) -> ComparisonResult | None:
+def compare_strings(new_file_text: str, old_file_text: str, cache=None) -> ComparisonResult | None:
     """
     Compares two strings using Azure OpenAI to identify differences.
 
     Args:
         new_file_text (str): The text from the new file.
         old_file_text (str): The text from the old file.
+        cache (ComparisonCache | None): Cache consulted before and updated after the API call. Defaults to None.
 
     Returns:
         ComparisonResult | None: A ComparisonResult object if successful, None otherwise.
     """
+    # Return a previous result for the exact same comparison when available
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(new_file_text, old_file_text, PROMPT_VERSION, DEPLOYMENT_NAME)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            return ComparisonResult.model_validate(cached_result)
+
     try:
         # Construct the messages for the prompt
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI assistant designed to compare text sections of a new file and an old file. "
-                    "Identify the differences, categorize them as 'added', 'removed', or 'modified', and provide a detailed summary. "
-                    "Please return the response strictly in JSON format."
-                )
-            },
-            {
-                "role": "user",
-                "content": (
-                    "Compare the following text sections and return the differences in JSON format:\n\n"
-                    f"New File text: {new_file_text}\n\nOld File text: {old_file_text}"
-                )
-            }
-        ]
-
-        # Make the API call with structured output using response_format
-        completion: ChatCompletion = client.beta.chat.completions.parse(
-            model="gpt-4o",  # Replace with your deployment name if different
-            messages=messages,
-            response_format=ComparisonResult
-        )
-
-        # Get the parsed response
-        response_content = completion.choices[0].message.content
-
-        # Validate the response content using Pydantic
-        result = ComparisonResult.model_validate_json(response_content)
+        messages = build_comparison_messages(new_file_text, old_file_text)
+
+        # Make the API call with structured output; the SDK already returns the validated model
+        result = get_gateway().parse(messages, ComparisonResult, operation="section_comparison")
+        if result is None:
+            logger.error("The model refused to compare the two texts.")
+            return None
+        if cache is not None:
+            cache.set(cache_key, result.model_dump())
         return result
 
     except ValidationError as ve:
         # Handle validation errors
-        print("Validation error:", ve)
-        print("Validation errors detail:", ve.errors())
+        logger.error("Validation error: %s", ve)
+        logger.error("Validation errors detail: %s", ve.errors())
     except Exception as e:
         # Handle general exceptions
-        print(f"Error during API call or processing: {e}")
+        logger.error(f"Error during API call or processing: {e}")
 
     return None
 
@@ -0,0 +1,34 @@
+# Import necessary libraries and modules
+from functools import lru_cache
+import tiktoken
+
+
+# Function to get a cached tokenizer for a model
+@lru_cache(maxsize=None)
+def get_encoder(model="gpt-4o"):
+    """
+    Returns the tokenizer for the specified model, creating it only once per process.
+
+    Args:
+        model (str): The model whose tokenizer to use.
+
+    Returns:
+        tiktoken.Encoding: The tokenizer for the model.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+# Function to count the number of tokens in a given text
+def count_tokens(text, model="gpt-4o"):
+    """
+    Counts the number of tokens in a given text using the specified model's tokenizer.
+
+    Args:
+        text (str): The text to tokenize.
+        model (str): The model whose tokenizer to use.
+
+    Returns:
+        int: The number of tokens in the text.
+    """
+    # Special tokens are counted as plain text since documents may contain them literally
+    return len(get_encoder(model).encode(text, disallowed_special=()))
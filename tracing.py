@@ -0,0 +1,268 @@
+# Import necessary libraries and modules
+import os
+import time
+import uuid
+import logging
+import argparse
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Prices in USD per million tokens, used to estimate the cost of model calls
+prompt_token_price = float(os.getenv('prompt_token_price', 2.50))
+completion_token_price = float(os.getenv('completion_token_price', 10.00))
+
+# Name of the collection the traced runs are stored in
+RUNS_COLLECTION_NAME = "pipeline_runs"
+# Numeric span attributes that are summed per stage in the run summary
+SUMMED_ATTRIBUTES = ("bytes", "pages", "tokens", "sections", "prompt_tokens", "completion_tokens", "cost_usd", "cache_hits", "cache_misses", "skipped_sections")
+
+# The run being traced in the current context, if any
+_current_run = ContextVar("current_run", default=None)
+
+
+class Span:
+    """
+    A timed pipeline stage with numeric and descriptive attributes.
+
+    Attributes:
+        stage (str): Name of the stage, e.g. 'extract', 'ingest', 'clean', 'parse', 'align', 'compare' or 'upload'.
+        attributes (dict): Attributes recorded for the stage, such as bytes, token usage and cache hits.
+        duration_seconds (float | None): Duration of the stage once it has finished.
+        error (str | None): The error that ended the stage, if any.
+    """
+
+    def __init__(self, stage, **attributes):
+        """
+        Initializes a span.
+
+        Args:
+            stage (str): Name of the stage.
+            **attributes: Initial attributes of the span.
+        """
+        self.stage = stage
+        self.attributes = dict(attributes)
+        self.duration_seconds = None
+        self.error = None
+
+    def set(self, **attributes):
+        """
+        Sets attributes of the span.
+
+        Args:
+            **attributes: Attributes to set.
+        """
+        self.attributes.update(attributes)
+
+    def add(self, **counters):
+        """
+        Adds to numeric attributes of the span.
+
+        Args:
+            **counters: Amounts to add to each attribute.
+        """
+        for name, amount in counters.items():
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def to_document(self):
+        """
+        Converts the span into the form stored with its run.
+
+        Returns:
+            dict: The stage, duration, error and attributes of the span.
+        """
+        return {"stage": self.stage, "duration_seconds": self.duration_seconds, "error": self.error, **self.attributes}
+
+
+class TracedRun:
+    """
+    A traced run of the pipeline, made up of the spans of its stages.
+
+    Attributes:
+        run_id (str): Unique identifier of the run.
+        name (str): Name of the run, e.g. the processed file or file pair.
+        started_at (datetime): Start time of the run.
+        spans (list): The finished spans of the run, in order of completion.
+    """
+
+    def __init__(self, name):
+        """
+        Starts a run.
+
+        Args:
+            name (str): Name of the run.
+        """
+        self.run_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []
+        self._start_time = time.perf_counter()
+
+    def summary(self):
+        """
+        Summarizes the run per stage.
+
+        Returns:
+            dict: For each stage, the number of spans, the total duration and the summed numeric attributes.
+        """
+        stages = {}
+        for span in self.spans:
+            stage_summary = stages.setdefault(span.stage, {"spans": 0, "duration_seconds": 0.0})
+            stage_summary["spans"] += 1
+            stage_summary["duration_seconds"] += span.duration_seconds or 0.0
+            for name in SUMMED_ATTRIBUTES:
+                if name in span.attributes:
+                    stage_summary[name] = stage_summary.get(name, 0) + span.attributes[name]
+        return stages
+
+    def to_document(self):
+        """
+        Converts the run into the form stored in MongoDB.
+
+        Returns:
+            dict: The run with its spans and per-stage summary.
+        """
+        return {
+            "run_id": self.run_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_seconds": time.perf_counter() - self._start_time,
+            "spans": [span.to_document() for span in self.spans],
+            "summary": self.summary()
+        }
+
+
+# Function to format the summary of a stored or running run
+def format_run_summary(run_document):
+    """
+    Formats the per-stage summary of a run as a text table.
+
+    Args:
+        run_document (dict): A run as returned by TracedRun.to_document or stored in MongoDB.
+
+    Returns:
+        str: The summary table.
+    """
+    lines = [f"Run {run_document['name']} ({run_document['run_id']}): {run_document['duration_seconds']:.2f}s",
+             f"{'stage':<10} {'spans':>5} {'seconds':>9} {'share':>6}  details"]
+    total_seconds = sum(stage["duration_seconds"] for stage in run_document["summary"].values()) or 1.0
+    for stage, stage_summary in run_document["summary"].items():
+        details = ", ".join(f"{name}={stage_summary[name]:.4f}" if name == "cost_usd" else f"{name}={stage_summary[name]}"
+                            for name in SUMMED_ATTRIBUTES if name in stage_summary)
+        lines.append(f"{stage:<10} {stage_summary['spans']:>5} {stage_summary['duration_seconds']:>9.2f} "
+                     f"{stage_summary['duration_seconds'] / total_seconds:>6.0%}  {details}")
+    return "\n".join(lines)
+
+
+# Function to estimate the cost of model calls
+def estimate_cost(prompt_tokens, completion_tokens):
+    """
+    Estimates the cost of model calls from their token usage.
+
+    Args:
+        prompt_tokens (int): Number of prompt tokens.
+        completion_tokens (int): Number of completion tokens.
+
+    Returns:
+        float: The estimated cost in USD.
+    """
+    return (prompt_tokens * prompt_token_price + completion_tokens * completion_token_price) / 1_000_000
+
+
+# Function to trace a run of the pipeline
+@contextmanager
+def trace_run(name, db_collection=None):
+    """
+    Traces a run of the pipeline; spans opened inside the block are recorded with it.
+
+    When a run is already being traced, the block joins that run instead of starting a new one, so
+    a pipeline step traces the same way on its own and as part of a larger run.
+
+    Args:
+        name (str): Name of the run.
+        db_collection (optional): MongoDB collection the finished run is stored in. Defaults to None.
+
+    Yields:
+        TracedRun: The run being traced.
+    """
+    parent_run = _current_run.get()
+    if parent_run is not None:
+        yield parent_run
+        return
+
+    run = TracedRun(name)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+        run_document = run.to_document()
+        logger.info(format_run_summary(run_document))
+        if db_collection is not None:
+            try:
+                db_collection.insert_one(run_document)
+            except Exception as e:
+                logger.error(f"Failed to store trace of run {run.run_id}: {e}")
+
+
+# Function to time one stage of the pipeline
+@contextmanager
+def trace_span(stage, **attributes):
+    """
+    Times a stage of the pipeline and records it with the current run.
+
+    Outside a traced run the span is still timed and logged, but not stored.
+
+    Args:
+        stage (str): Name of the stage.
+        **attributes: Initial attributes of the span.
+
+    Yields:
+        Span: The span, to record further attributes on.
+    """
+    span = Span(stage, **attributes)
+    start_time = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        span.duration_seconds = time.perf_counter() - start_time
+        run = _current_run.get()
+        if run is not None:
+            run.spans.append(span)
+        logger.debug(f"{stage} took {span.duration_seconds:.2f}s {span.attributes}")
+
+
+# Function to fetch the most recent traced runs
+def get_recent_runs(db_collection, limit=10):
+    """
+    Fetches the most recent traced runs.
+
+    Args:
+        db_collection: MongoDB collection the runs are stored in.
+        limit (int): Maximum number of runs to return.
+
+    Returns:
+        list: The stored runs, newest first.
+    """
+    return list(db_collection.find({}, {"_id": 0}).sort("started_at", -1).limit(limit))
+
+
+# Main execution logic to view the summaries of recent runs
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Show the per-stage summaries of recent pipeline runs.")
+    parser.add_argument("--last", type=int, default=5, help="Number of recent runs to show")
+    args = parser.parse_args()
+
+    runs_collection = MongoClient(os.getenv('uri'))['capstone_db'][RUNS_COLLECTION_NAME]
+    for run_document in get_recent_runs(runs_collection, args.last):
+        print(format_run_summary(run_document))
+        print()
@@ -0,0 +1,176 @@
+# Import necessary libraries and modules
+import os
+import logging
+from app import (get_cleaned_text_from_mongodb, compare_sections_with_checkpoints, upload_compared_sections_to_mongodb,
+                 load_completed_sections)
+from section_alignment import build_heading_tree, align_version_heading_trees
+from comparison_results import build_identical_comparison_document
+from local_diff import compute_diff_stats
+from tracing import trace_run, trace_span, RUNS_COLLECTION_NAME
+
+logger = logging.getLogger(__name__)
+
+
+# Function to list the pairs stored for a version series
+def get_series_pairs(file_names):
+    """
+    Lists the pairs compared for a series of versions: each pair of adjacent versions, then the newest against the oldest.
+
+    Args:
+        file_names (tuple): The file names of the versions, from newest to oldest.
+
+    Returns:
+        list: The (new, old) file name pairs.
+    """
+    pairs = [(file_names[position], file_names[position + 1]) for position in range(len(file_names) - 1)]
+    if len(file_names) > 2:
+        pairs.append((file_names[0], file_names[-1]))
+    return pairs
+
+
+# Function to take the section texts of two versions from the aligned units
+def get_version_pair_section_texts(aligned_units, new_position, old_position):
+    """
+    Builds the section texts of two versions from units aligned across the whole series.
+
+    Args:
+        aligned_units (list): The units as returned by align_version_heading_trees.
+        new_position (int): Position of the new version in the series.
+        old_position (int): Position of the old version in the series.
+
+    Returns:
+        list: Lists containing the section heading, new text, old text and next section heading.
+    """
+    return [[label, section_texts[new_position], section_texts[old_position], next_heading] for label, section_texts, next_heading in aligned_units]
+
+
+# Function to derive the long-range comparison of a section from its adjacent steps
+def compose_section_comparison(step_sections):
+    """
+    Derives the comparison of the newest and oldest version of a section from the comparisons of its adjacent versions.
+
+    When at most one step changed the section, the long-range comparison is that step's comparison, since the
+    other versions have the same normalized text. When several steps changed it, the changes cannot be
+    composed reliably and the section needs its own comparison.
+
+    Args:
+        step_sections (list): The compared section of each adjacent pair, followed by its structured comparison and diff statistics.
+
+    Returns:
+        dict | None: The derived structured comparison, or None if the section has to be compared.
+    """
+    changed_steps = [section for section in step_sections
+                     if not (section[5] or compute_diff_stats(section[1], section[2]))["identical"]]
+    if not changed_steps:
+        return build_identical_comparison_document()
+    if len(changed_steps) == 1:
+        return changed_steps[0][4]
+    return None
+
+
+# Function to compare one pair of a version series
+def compare_series_pair(file_pair, section_texts, sections_data, comparison_cache=None):
+    """
+    Compares the aligned sections of one pair of a series, or loads them if an earlier run completed the pair.
+
+    Args:
+        file_pair (tuple): The new and old file names.
+        section_texts (list): The aligned sections, each optionally followed by a comparison derived from other pairs.
+        sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+
+    Returns:
+        list: The sections, each followed by its structured comparison and diff statistics.
+    """
+    section_texts_with_results = load_completed_sections(file_pair, section_texts, sections_data)
+    if section_texts_with_results is not None:
+        logger.info(f"Skipping {file_pair[0]}_{file_pair[1]}: already compared")
+        return section_texts_with_results
+
+    section_texts_with_results = compare_sections_with_checkpoints(file_pair, section_texts, sections_data, comparison_cache)
+    with trace_span("upload"):
+        upload_compared_sections_to_mongodb(file_pair, section_texts_with_results, sections_data)
+    return section_texts_with_results
+
+
+# Function to compare a series of versions of a document
+def compare_version_series(file_names, heading_trees, cleaned_texts, sections_data, comparison_cache=None):
+    """
+    Compares a series of versions through their adjacent pairs and derives the newest-to-oldest comparison.
+
+    All versions are aligned once, so every pair is compared over the same sections. Every pair is compared
+    with per-section checkpoints, and a pair completed by an earlier run over the same sections is loaded
+    instead; in the newest-to-oldest pair only the sections changed in more than one step are sent to the model.
+
+    Args:
+        file_names (tuple): The file names of the versions, from newest to oldest.
+        heading_trees (list): Heading tree of each version, as returned by build_heading_tree.
+        cleaned_texts (list): Cleaned text of each version.
+        sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+
+    Returns:
+        dict: The number of 'sections' stored over all pairs, and the long-range sections that were
+            'derived_sections' from the adjacent steps or 'compared_sections' with the model.
+    """
+    with trace_run("_".join(file_names), sections_data.database[RUNS_COLLECTION_NAME]):
+        with trace_span("align") as span:
+            aligned_units = align_version_heading_trees(heading_trees, cleaned_texts)
+            span.set(sections=len(aligned_units))
+
+        # Compare each pair of adjacent versions
+        steps = []
+        for position in range(len(file_names) - 1):
+            file_pair = (file_names[position], file_names[position + 1])
+            section_texts = get_version_pair_section_texts(aligned_units, position, position + 1)
+            steps.append(compare_series_pair(file_pair, section_texts, sections_data, comparison_cache))
+
+        if len(file_names) == 2:
+            return {"sections": len(aligned_units), "derived_sections": 0, "compared_sections": 0}
+
+        # Reuse the adjacent comparisons for the newest-to-oldest pair wherever a single step changed the section
+        long_range_section_texts = get_version_pair_section_texts(aligned_units, 0, len(file_names) - 1)
+        pending_sections = 0
+        for index, section_text in enumerate(long_range_section_texts):
+            comparison_document = compose_section_comparison([step[index] for step in steps])
+            if comparison_document is None:
+                pending_sections += 1
+            else:
+                section_text.extend([comparison_document, compute_diff_stats(section_text[1], section_text[2])])
+
+        # The derived sections are stored as compared, so only the pending ones are checkpointed and sent to the model
+        compare_series_pair((file_names[0], file_names[-1]), long_range_section_texts, sections_data, comparison_cache)
+
+    derived_sections = len(long_range_section_texts) - pending_sections
+    logger.info(f"Derived {derived_sections} of {len(long_range_section_texts)} sections of {file_names[0]}_{file_names[-1]} "
+                f"from the adjacent versions")
+    return {"sections": len(aligned_units) * len(get_series_pairs(file_names)), "derived_sections": derived_sections, "compared_sections": pending_sections}
+
+
+# Function to compare a series of versions given as files
+def find_version_series_differences_in_files(file_paths, adobe_api_json_outputs_db, documents_data_db, sections_data, comparison_cache=None):
+    """
+    Loads a series of extracted and cleaned versions from MongoDB and compares them with compare_version_series.
+
+    Args:
+        file_paths (tuple): Paths to the files of the versions, from newest to oldest.
+        adobe_api_json_outputs_db: MongoDB collection for Adobe API outputs.
+        documents_data_db: MongoDB collection for document data.
+        sections_data: MongoDB collection for section data.
+        comparison_cache (ComparisonCache, optional): Cache of previous section comparisons. Defaults to None.
+
+    Returns:
+        dict: The section counts as returned by compare_version_series.
+    """
+    file_names = tuple(os.path.splitext(os.path.basename(file_path))[0] for file_path in file_paths)
+    with trace_run("_".join(file_names), sections_data.database[RUNS_COLLECTION_NAME]):
+        heading_trees = []
+        cleaned_texts = []
+        with trace_span("ingest") as span:
+            for file_path, file_name in zip(file_paths, file_names):
+                file_json = adobe_api_json_outputs_db.find_one({'file_name': file_name})
+                cleaned_text = get_cleaned_text_from_mongodb(file_name, documents_data_db)
+                heading_trees.append(build_heading_tree(file_json, cleaned_text))
+                cleaned_texts.append(cleaned_text)
+            span.set(bytes=sum(len(cleaned_text.encode("utf-8")) for cleaned_text in cleaned_texts))
+        return compare_version_series(file_names, heading_trees, cleaned_texts, sections_data, comparison_cache)